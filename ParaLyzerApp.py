@@ -1263,7 +1263,7 @@ class ParaLyzerApp(Logger, StatusBar):
                 # negative pause time mm:ss
                 self.paraLyzerCore.tilter.SetValue( 'negPause' , self.entrs['npa'].get() )
                 
-                if not self.paraLyzerCore.tilter.WriteSetup():
+                if not self.paraLyzerCore.tilter.WriteSetup(mode='batch'):
                     messagebox.showerror('Error', 'Could not write setup to tilter! Please check the connection...')
                     self.UpdateDetectionLabels()
         
@@ -1276,7 +1276,7 @@ class ParaLyzerApp(Logger, StatusBar):
             
             if self.ckbtns['utr'].get():
                 
-                if not self.paraLyzerCore.tilter.ResetTilterSetup():
+                if not self.paraLyzerCore.tilter.ResetTilterSetup(mode='batch'):
                     messagebox.showerror('Error', 'Could not reset tilter setup! Please check the connection...')
                     self.UpdateDetectionLabels()
                 else:
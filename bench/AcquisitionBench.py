@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end throughput of the acquisition pipeline.
+
+Polls of the simulated HF2 (Hf2Simulator) are driven through the poll loop of
+Hf2Core and the DataProcessor into every storage mode and backend, and into the
+raw capture. Every configuration runs in its own interpreter, so the peak RSS
+belongs to it alone. By default the simulator does not wait for its sample
+clock, which gives the max. rate the pipeline sustains. With --realtime it
+samples at the given rate and the real time factor shows if the pipeline keeps up.
+
+Reported per configuration:
+    samples/s     all samples of all demodulators till the last file was written
+    stages        poll (simulator), loop (one poll loop), queue wait and
+                  processing per chunk in ms (mean, p50, p95, max)
+    queue depth   max and p95 of the chunks waiting for the processor
+    peak RSS      of the whole process in MB
+
+Run from the repository root:
+    python -m bench.AcquisitionBench
+    python -m bench.AcquisitionBench --demods 6 --epairs 30 --rate 14400 --duration 20 --json results.json
+    python -m bench.AcquisitionBench --baseline results.json
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+import importlib.util
+import numpy as np
+
+from time import sleep, perf_counter
+
+# peak RSS, not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# a configuration is slower if it drops below its baseline by this fraction
+TOLERANCE = 0.2
+
+STAGE_KEYS = ['mean', 'p50', 'p95', 'max']
+
+
+def GetConfigs(args):
+
+    backends = ['mat']
+
+    if importlib.util.find_spec('h5py'):
+        backends.append('hdf5')
+    else:
+        print('h5py is not installed, skipping hdf5 backend')
+
+    configs = []
+
+    for workers in ([False, True] if args.workers else [False]):
+        for storageMode in ['fileSize', 'recordTime', 'eventSync']:
+            for backend in backends:
+                configs.append( {
+                        'name'          : 'process/%s/%s%s' % (storageMode, backend, '/workers' if workers else ''),
+                        'captureMode'   : 'process',
+                        'storageMode'   : storageMode,
+                        'storageBackend': backend,
+                        'demodWorkers'  : workers
+                    } )
+
+    configs.append( {'name': 'raw', 'captureMode': 'raw', 'storageMode': 'fileSize', 'storageBackend': 'mat', 'demodWorkers': False} )
+
+    return configs
+
+
+def GetSettings(args):
+
+    return {
+            'demods'    : args.demods,
+            'epairs'    : args.epairs,
+            'rate'      : args.rate,
+            'residence' : args.residence,
+            'duration'  : args.duration,
+            'realTime'  : args.realtime,
+            'dataloss'  : args.dataloss,
+            'jitter'    : args.jitter,
+            'fileSize'  : args.file_size,
+            'fileTime'  : args.file_time,
+            'queueDepth': args.queue_depth
+        }
+
+
+def Percentiles(times):
+    ''' mean, p50, p95 and max in ms
+    '''
+    if len(times) == 0:
+        return dict.fromkeys(STAGE_KEYS, 0.)
+
+    times = np.asarray(times) * 1e3
+
+    return {'mean': float(times.mean()), 'p50': float(np.percentile(times, 50)), 'p95': float(np.percentile(times, 95)), 'max': float(times.max())}
+
+
+def QueueTimes(stats):
+    ''' ChunkQueue statistics in the same form as Percentiles
+    '''
+    return {'mean': stats['mean'] * 1e3, 'p50': stats['median'] * 1e3, 'p95': stats['p95'] * 1e3, 'max': stats['max'] * 1e3}
+
+
+def GetPeakRss():
+    ''' Peak resident set size of this process in MB, None if unknown
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kB everywhere else
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def GetFolderSize(folder):
+
+    numFiles  = 0
+    numBytes  = 0
+
+    for root, _, files in os.walk(folder):
+        for f in files:
+            numFiles += 1
+            numBytes += os.path.getsize(os.path.join(root, f))
+
+    return numFiles, numBytes
+
+
+def RunConfig(config, settings, keep=False):
+    ''' Runs a single configuration, called in the child interpreter
+    '''
+    from libs.Hf2Core import Hf2Core
+
+    folder   = tempfile.mkdtemp(prefix='acquisition_bench_')
+    schedule = [(i, settings['residence']) for i in range(settings['epairs'])]
+
+    # only one of them may be given
+    if config['storageMode'] == 'recordTime':
+        stream = {'streamTime': settings['fileTime'], 'timeLenScaler': 'sec'}
+    else:
+        stream = {'streamFileSize': settings['fileSize']}
+
+    hf2 = Hf2Core( logLevel='ERROR', simulate=True, baseFolder=folder + '/',
+                   captureMode=config['captureMode'], storageMode=config['storageMode'], storageBackend=config['storageBackend'], **stream,
+                   demodWorkers=config['demodWorkers'], maxQueueDepth=settings['queueDepth'],
+                   simulator={'numDemods': settings['demods'], 'sampleRate': settings['rate'], 'schedule': schedule, 'seed': 0,
+                              'realTime': settings['realTime'], 'dataloss': settings['dataloss'], 'jitter': settings['jitter']} )
+
+    simulator = hf2._simulator
+
+    # time spent in the simulator
+    pollTimes = []
+    poll      = simulator.poll
+
+    def TimedPoll(*args, **kwargs):
+        start = perf_counter()
+        data  = poll(*args, **kwargs)
+        pollTimes.append( perf_counter() - start )
+        return data
+
+    simulator.poll = TimedPoll
+
+    # sample the depth of the processor queue
+    depths  = []
+    stopped = threading.Event()
+
+    def SampleDepth():
+        while not stopped.wait(0.01):
+            depths.append( hf2.GetQueueStats()['depth'] )
+
+    sampler = threading.Thread(target=SampleDepth, daemon=True)
+
+    samplesPerSec = settings['demods'] * settings['rate']
+
+    start = perf_counter()
+
+    hf2.StartPoll()
+    sampler.start()
+
+    # simulated time passes with every poll
+    while simulator.numSamples < settings['duration'] * samplesPerSec:
+        sleep(0.005)
+
+    polled = perf_counter()
+
+    # waits till the queue is empty and all files are written
+    hf2.StopPoll()
+
+    end = perf_counter()
+
+    stopped.set()
+    sampler.join()
+
+    stats              = hf2.GetQueueStats()
+    numFiles, numBytes = GetFolderSize(folder)
+    numSamples         = simulator.numSamples
+
+    result = {
+            'samples'      : numSamples,
+            'samplesPerSec': numSamples / (end - start),
+            'realTime'     : numSamples / samplesPerSec / (end - start),
+            'pollSeconds'  : polled - start,
+            'flushSeconds' : end - polled,
+            'stages'       : {
+                    'poll'     : Percentiles( pollTimes ),
+                    'loop'     : Percentiles( hf2.timer['elt'][1:] ),
+                    'queueWait': QueueTimes( stats['waitTime'] ),
+                    'process'  : QueueTimes( stats['procTime'] )
+                },
+            'queue'        : {
+                    'maxDepth'  : stats['maxDepth'],
+                    'p95Depth'  : float(np.percentile(depths, 95)) if depths else 0.,
+                    'numDropped': stats['numDropped'],
+                    'numSpilled': stats['numSpilled']
+                },
+            'peakRssMB'    : GetPeakRss(),
+            'files'        : numFiles,
+            'bytes'        : numBytes,
+            'recordFlags'  : hf2.GetRecordFlags()
+        }
+
+    hf2.__del__()
+
+    if keep:
+        result['folder'] = folder
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return result
+
+
+def RunInChild(config, settings, keep=False):
+
+    args = [sys.executable, '-m', 'bench.AcquisitionBench', '--child', json.dumps({'config': config, 'settings': settings, 'keep': keep})]
+    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if proc.returncode != 0:
+        raise Exception('%s failed:\n%s' % (config['name'], proc.stderr.strip()))
+
+    # result is the last line, everything before is output of the libs
+    return json.loads( proc.stdout.strip().splitlines()[-1] )
+
+
+def GetRevision():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def Compare(results, baseline):
+    ''' Returns a list of errors
+    '''
+    errors = []
+    before = {r['name']: r for r in baseline['results']}
+
+    if baseline['settings'] != results['settings']:
+        errors.append('settings differ from baseline, results are not comparable')
+        return errors
+
+    for r in results['results']:
+        if r['name'] in before:
+            limit = before[r['name']]['samplesPerSec'] * (1 - TOLERANCE)
+
+            if r['samplesPerSec'] < limit:
+                errors.append('%s: %.3f MS/s, baseline %.3f MS/s' % (r['name'], r['samplesPerSec']/1e6, before[r['name']]['samplesPerSec']/1e6))
+
+    return errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='End-to-end throughput of the acquisition pipeline')
+    parser.add_argument('--demods'     , type=int  , default=6      , help='number of demodulators')
+    parser.add_argument('--epairs'     , type=int  , default=30     , help='number of electrode pairs the Arduino switches through')
+    parser.add_argument('--rate'       , type=float, default=14400. , help='samples per second and demodulator')
+    parser.add_argument('--residence'  , type=float, default=10e3   , help='residence time per electrode pair in us')
+    parser.add_argument('--duration'   , type=float, default=10.    , help='simulated seconds per configuration')
+    parser.add_argument('--realtime'   , action='store_true'        , help='sample in real time instead of as fast as possible')
+    parser.add_argument('--dataloss'   , type=float, default=0.     , help='probability of data loss per poll')
+    parser.add_argument('--jitter'     , type=float, default=0.     , help='jitter of the sample clock in s')
+    parser.add_argument('--file-size'  , type=float, default=10.    , help='MB per file for storage mode fileSize')
+    parser.add_argument('--file-time'  , type=float, default=2.     , help='seconds per file for storage mode recordTime')
+    parser.add_argument('--queue-depth', type=int  , default=100    , help='max chunks waiting for the processor')
+    parser.add_argument('--workers'    , action='store_true'        , help='also run with demodulator worker processes')
+    parser.add_argument('--only'       , help='run configurations containing this string only')
+    parser.add_argument('--keep'       , action='store_true'        , help='keep the written files')
+    parser.add_argument('--json'       , help='store results in this file')
+    parser.add_argument('--baseline'   , help='compare against results of a former run')
+    parser.add_argument('--child'      , help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        job = json.loads(args.child)
+        print( json.dumps( RunConfig(job['config'], job['settings'], job['keep']) ) )
+        sys.exit(0)
+
+    settings = GetSettings(args)
+    configs  = [c for c in GetConfigs(args) if not args.only or args.only in c['name']]
+
+    print('%d demods, %d ePairs, %.0f S/s per demod, %.0f s %s\n' % (args.demods, args.epairs, args.rate, args.duration, 'real time' if args.realtime else 'as fast as possible'))
+    print('%-32s %9s %7s %28s %9s %9s %5s' % ('configuration', 'MS/s', 'x real', 'process p50/p95/max [ms]', 'max depth', 'RSS [MB]', 'files'))
+
+    results = []
+
+    for config in configs:
+
+        result = dict( RunInChild(config, settings, args.keep), name=config['name'], config=config )
+        results.append(result)
+
+        process = result['stages']['process']
+        rss     = result['peakRssMB']
+
+        print('%-32s %9.3f %7.1f %10.2f %8.2f %8.2f %9d %9s %5d' % (config['name'], result['samplesPerSec']/1e6, result['realTime'],
+                                                                  process['p50'], process['p95'], process['max'],
+                                                                  result['queue']['maxDepth'], '%.0f' % rss if rss else '-', result['files']))
+
+    output = {
+            'revision': GetRevision(),
+            'python'  : platform.python_version(),
+            'numpy'   : np.__version__,
+            'platform': platform.platform(),
+            'settings': settings,
+            'results' : results
+        }
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            errors = Compare(output, json.load(f))
+
+        if errors:
+            print('\n'.join(['\nFAILED:'] + ['  %s' % e for e in errors]))
+            sys.exit(1)
+
+        print('\nno regressions')
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Bytes on the wire and command round trips of the ASCII and the binary
+Arduino protocol, measured against the host side firmware simulator.
+
+Run from the repository root:
+    python -m bench.ArduinoProtocolBench
+"""
+
+from time import perf_counter
+
+from libs.ArduinoCore import ArduinoCore
+from libs.ArduinoSimulator import ArduinoSimulator
+
+
+# serial settings of the Arduino Uno, 10 bits per byte
+BAUDRATE = 115200
+
+
+def RunSetup(protocol, numElectrodePairs):
+    ''' Upload a setup, start and stop, returns simulator and elapsed time
+    '''
+
+    arduino = ArduinoCore(protocol=protocol, logLevel='ERROR')
+
+    simulator             = ArduinoSimulator()
+    arduino.comPort       = simulator
+    arduino.comPortInfo   = ['sim', 'Arduino Uno simulator']
+    arduino.comPortStatus = True
+
+    for ePair in range(numElectrodePairs):
+        arduino.DefineElectrodePair(ePair, 1000)
+
+    start = perf_counter()
+
+    assert arduino.SetupArduino(), 'Setup failed!'
+    assert arduino.Start()       , 'Start failed!'
+    assert arduino.Stop()        , 'Stop failed!'
+
+    elapsed = perf_counter() - start
+
+    assert len(simulator.schemes) == numElectrodePairs, 'Setup was not stored!'
+
+    return simulator, elapsed
+
+
+if __name__ == '__main__':
+
+    for numElectrodePairs in [1, 15, 30]:
+        for protocol in ArduinoCore.__protocols__:
+
+            simulator, elapsed = RunSetup(protocol, numElectrodePairs)
+
+            numBytes = simulator.bytesReceived + simulator.bytesSent
+
+            print('%2d pairs %-6s: %4d bytes to / %4d bytes from Arduino, wire %6.2f ms, commands took %7.1f ms' % (
+                        numElectrodePairs, protocol, simulator.bytesReceived, simulator.bytesSent,
+                        numBytes*10/BAUDRATE*1e3, elapsed*1e3))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for decoding HF2 DIO lines to electrode pairs.
+
+Compares DataProcessor.DioToElectrodePair against the former string based
+implementation and checks that both return the same values.
+
+Run from the repository root:
+    python -m bench.DioDecodingBench
+"""
+
+import numpy as np
+
+from timeit import repeat
+from tempfile import gettempdir
+
+from libs.DataProcessor import DataProcessor
+
+
+def DioToElectrodePairStr(dio):
+    ''' Former implementation, formats every sample as binary string
+    '''
+    return [ int(format(int(i), '032b')[7:12][::-1], 2) for i in dio]
+
+
+def GenerateDio(numSamples, maxElectrodePair=30, seed=0):
+    ''' Generate DIO samples like the Arduino sets them, including some
+        noise on the lines that are not used for the electrode pair.
+    '''
+    rng    = np.random.RandomState(seed)
+    ePairs = rng.randint(0, maxElectrodePair, numSamples)
+
+    dio  = DataProcessor.__ePairLut__[ePairs] << 20
+    dio |= rng.randint(0, 2**20, numSamples)
+    dio |= rng.randint(0, 2**7, numSamples) << 25
+
+    return dio.astype(np.uint32)
+
+
+if __name__ == '__main__':
+
+    numDemods  = 6
+    numSamples = 10000
+    numRepeat  = 5
+
+    dataProcessor = DataProcessor(baseFolder=gettempdir()+'/')
+
+    dio = GenerateDio(numSamples)
+
+    assert np.array_equal(dataProcessor.DioToElectrodePair(dio), DioToElectrodePairStr(dio)), 'Implementations differ!'
+
+    tStr = min(repeat(lambda: DioToElectrodePairStr(dio)           , number=numDemods, repeat=numRepeat))
+    tVec = min(repeat(lambda: dataProcessor.DioToElectrodePair(dio), number=numDemods, repeat=numRepeat))
+
+    print('%s demods x %s samples per poll' % (numDemods, numSamples))
+    print('string : %8.3f ms per poll' % (tStr*1e3))
+    print('numpy  : %8.3f ms per poll' % (tVec*1e3))
+    print('speedup: %8.1f x' % (tStr/tVec))
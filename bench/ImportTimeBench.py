@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of the modules in libs and of ParaLyzerApp.
+
+Every module is imported in a fresh interpreter with 'python -X importtime',
+the best of several runs is reported. The check fails (exit code 1) if
+importing a module pulls in one of the heavy dependencies, which have to be
+loaded on first use, or if a module got slower than in a stored baseline.
+
+Run from the repository root:
+    python -m bench.ImportTimeBench
+    python -m bench.ImportTimeBench --write-baseline importtime.json
+    python -m bench.ImportTimeBench --baseline importtime.json
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+import libs
+
+
+# must not be imported by any module, they are loaded on first use
+HEAVY_MODULES = ['matplotlib', 'scipy', 'zhinst', 'h5py']
+
+# a module is slower if it exceeds its baseline by this factor plus slack
+TOLERANCE = 1.5
+SLACK_US  = 20e3
+
+# 'import time:  self [us] | cumulative | imported package'
+_linePattern = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)\s*$')
+
+
+def GetModules():
+    ''' All modules of libs and the GUI
+    '''
+    folder  = os.path.dirname(libs.__file__)
+    names   = [os.path.splitext(f)[0] for f in os.listdir(folder) if f.endswith('.py')]
+
+    # former implementations are kept for reference only
+    modules = ['libs.%s' % n for n in names if n != '__init__' and not n.endswith('_old')]
+
+    return sorted(modules) + ['ParaLyzerApp']
+
+
+def MeasureImport(module):
+    ''' Returns cumulative import time of module in us and all modules which were imported with it
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if proc.returncode != 0:
+        raise Exception('Could not import %s:\n%s' % (module, proc.stderr.strip().splitlines()[-1]))
+
+    cumulative = None
+    imported   = set()
+
+    for line in proc.stderr.splitlines():
+        match = _linePattern.match(line)
+
+        if match:
+            imported.add( match.group(4) )
+
+            # top level entry
+            if match.group(4) == module and len(match.group(3)) == 1:
+                cumulative = int(match.group(2))
+
+    return cumulative, imported
+
+
+def Measure(modules, numRepeat):
+    ''' Returns module -> {'us': best cumulative time, 'heavy': heavy modules imported with it}
+    '''
+    results = {}
+
+    for module in modules:
+        times = []
+
+        for _ in range(numRepeat):
+            us, imported = MeasureImport(module)
+            times.append(us)
+
+        heavy = sorted( {m for m in imported if m.split('.')[0] in HEAVY_MODULES} )
+
+        results[module] = {'us': min(times), 'heavy': heavy}
+
+    return results
+
+
+def Check(results, baseline=None):
+    ''' Returns a list of errors
+    '''
+    errors = []
+
+    for module, result in results.items():
+
+        if result['heavy']:
+            errors.append('%s imports %s' % (module, ', '.join( sorted({m.split('.')[0] for m in result['heavy']}) )))
+
+        if baseline and module in baseline:
+            limit = baseline[module]['us'] * TOLERANCE + SLACK_US
+
+            if result['us'] > limit:
+                errors.append('%s takes %.1f ms, baseline %.1f ms' % (module, result['us']/1e3, baseline[module]['us']/1e3))
+
+    return errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Import time of libs')
+    parser.add_argument('--repeat'        , type=int, default=3, help='runs per module, best one is taken')
+    parser.add_argument('--baseline'      , help='compare against this file')
+    parser.add_argument('--write-baseline', help='store results in this file')
+    args = parser.parse_args()
+
+    modules = GetModules()
+    results = Measure(modules, args.repeat)
+
+    for module in sorted(results, key=lambda m: results[m]['us'], reverse=True):
+        print('%-26s %8.1f ms  %s' % (module, results[module]['us']/1e3, ' '.join(results[module]['heavy'])))
+
+    baseline = None
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    errors = Check(results, baseline)
+
+    if args.write_baseline:
+        with open(args.write_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if errors:
+        print('\n'.join(['FAILED:'] + ['  %s' % e for e in errors]))
+        sys.exit(1)
+
+    print('import times OK')
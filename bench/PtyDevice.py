@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in serial device based on a pseudo terminal (POSIX only).
+
+The slave side behaves like a real serial port and can be opened by
+ComDevice, the master side is driven from Python. Messages are
+timestamped with perf_counter, so the receiver can measure latency.
+"""
+
+import os
+import tty
+import threading
+
+from time import perf_counter, sleep
+
+
+class PtyDevice:
+    ''' Pseudo terminal pair, GetPortName() returns the port to pass to pySerial
+    '''
+
+    def __init__(self):
+
+        self._master, self._slave = os.openpty()
+
+        # no echo, no line editing
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+
+        self._sendThread = None
+
+### --------------------------------------------------------------------------------------------------
+
+    def GetPortName(self):
+        return os.ttyname(self._slave)
+
+### --------------------------------------------------------------------------------------------------
+
+    def Write(self, data):
+        os.write(self._master, data)
+
+### --------------------------------------------------------------------------------------------------
+
+    def Read(self, numBytes=4096):
+        return os.read(self._master, numBytes)
+
+### --------------------------------------------------------------------------------------------------
+
+    def SendMessages(self, numMessages, interval=0, payload=b'', delimiter=b'\n'):
+        ''' Send numMessages 'seq timestamp payload' messages in a background thread,
+            interval in seconds between two messages.
+        '''
+
+        def Send():
+            for seq in range(numMessages):
+                self.Write(b'%d %.9f %s%s' % (seq, perf_counter(), payload, delimiter))
+                if interval:
+                    sleep(interval)
+
+        self._sendThread = threading.Thread(target=Send)
+        self._sendThread.start()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Join(self):
+        if self._sendThread:
+            self._sendThread.join()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self):
+        self.Join()
+        os.close(self._master)
+        os.close(self._slave)
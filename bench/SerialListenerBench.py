@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency of the ComDevice listener against a pty stand-in device.
+
+Run from the repository root (POSIX only):
+    python -m bench.SerialListenerBench
+"""
+
+import serial
+import numpy as np
+
+from time import perf_counter, process_time
+
+from libs.ComDevice import ComDevice
+from bench.PtyDevice import PtyDevice
+
+
+def RunListener(numMessages, interval, payload=b''):
+    ''' Returns latencies in seconds, wall time and cpu time of the whole process,
+        including the sending thread of the stand-in device
+    '''
+
+    device    = PtyDevice()
+    latencies = []
+
+    def OnMessage(msg):
+        latencies.append( perf_counter() - float(msg.split(' ')[1]) )
+
+    comDevice = ComDevice(messageCallback=OnMessage)
+
+    comDevice.comPort       = serial.Serial()
+    comDevice.comPort.port  = device.GetPortName()
+    comDevice.comPortInfo   = [device.GetPortName(), 'pty']
+    comDevice.comPortStatus = True
+
+    # pySerial flushes the input when opening, so open before sending
+    comDevice.SafeOpenComPort()
+    comDevice.StartListening()
+
+    wallStart = perf_counter()
+    cpuStart  = process_time()
+
+    device.SendMessages(numMessages, interval, payload)
+    device.Join()
+
+    # wait for the last messages
+    deadline = perf_counter() + 5
+    while len(latencies) < numMessages and perf_counter() < deadline:
+        comDevice.GetMessage(timeout=1e-2)
+
+    wallTime = perf_counter() - wallStart
+    cpuTime  = process_time() - cpuStart
+
+    comDevice.StopListening()
+    device.Close()
+
+    return np.array(latencies), wallTime, cpuTime
+
+
+if __name__ == '__main__':
+
+    for name, numMessages, interval, payload in [('burst'  , 20000, 0   , b'x'*32),
+                                                 ('paced'  , 500  , 2e-3, b'x'*32),
+                                                 ('idle'   , 1    , 1.0 , b''    )]:
+
+        latencies, wallTime, cpuTime = RunListener(numMessages, interval, payload)
+
+        print('%-8s %6d/%-6d msgs %9.0f msgs/s  latency p50 %7.3f ms  p95 %7.3f ms  cpu %5.1f %%' % (
+                    name, len(latencies), numMessages, len(latencies)/wallTime,
+                    np.median(latencies)*1e3, np.percentile(latencies, 95)*1e3, 100*cpuTime/wallTime))
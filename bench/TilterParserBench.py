@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of the tilter's parameter messages.
+
+Compares the framing ('#') and parameter extraction of ChipTilterCore against
+the former implementation, which joined all pending chunks for every read and
+searched every key in every field. Self checks run first, traffic is generated
+like the tilter reports it every 2 s during a tilt cycle and delivered in
+chunks of random size, like the serial driver does.
+
+Run from the repository root:
+    python -m bench.TilterParserBench
+"""
+
+import random
+
+from timeit import repeat
+
+from libs.ChipTilterCore import ChipTilterCore
+from libs.ComDevice import FrameBuffer
+
+
+def ExtractParametersOld(msg, params):
+    ''' Former implementation of ChipTilterCore._ExtractParameters
+    '''
+    for key in ChipTilterCore.__parameters__:
+        paramSet = msg.split(';')
+        for param in paramSet:
+            if key in param:
+                val = param.split(key)[-1]
+
+                try:
+                    val = int(val)
+                except ValueError:
+                    pass
+                else:
+                    params[key] = val
+
+
+def HandleChunksOld(chunks):
+    ''' Former framing of ChipTilterCore.HandleInMessageQueue, returns the parameters of every message
+    '''
+    queue   = []
+    results = []
+    params  = {}
+
+    for chunk in chunks:
+
+        queue.append(chunk)
+
+        msgStr = ''.join(queue)
+
+        if '#' in msgStr:
+
+            queue = msgStr.split('#')
+
+            while len(queue) != 0:
+                ExtractParametersOld(queue.pop(0), params)
+                results.append( dict(params) )
+
+    return results
+
+
+def HandleChunksNew(tilter, chunks):
+    ''' Framing with FrameBuffer and ChipTilterCore.ParseParameters
+    '''
+    buf     = FrameBuffer(b'#')
+    results = []
+    params  = {}
+
+    for chunk in chunks:
+
+        buf.Feed(chunk)
+
+        for frame in buf.PopFrames():
+            params.update( tilter.ParseParameters(frame.decode('latin-1')) )
+            results.append( dict(params) )
+
+    return results
+
+
+def GenerateTraffic(numCycles, motion=18, pause=18):
+    ''' Parameter messages of numCycles tilt cycles, one every 2 s
+    '''
+    messages = []
+
+    def Report(m, p, t):
+        return 'ID1;A+65;A-65;M+%d;M-%d;m%d;P+%d;P-%d;p%d;H0;T0;t%d;S1#' % (motion, motion, m, pause, pause, p, t)
+
+    t = 0
+
+    for _ in range(numCycles):
+        for m, p in [(m, 0) for m in range(motion, 0, -2)] + [(0, p) for p in range(pause, 0, -2)]:
+            messages.append( Report(m, p, t) )
+            t += 2
+
+    return messages
+
+
+def SplitIntoChunks(data, seed=0, maxChunk=24):
+    rng    = random.Random(seed)
+    chunks = []
+    idx    = 0
+
+    while idx < len(data):
+        size = rng.randint(1, maxChunk)
+        chunks.append( data[idx:idx+size] )
+        idx += size
+
+    return chunks
+
+
+def RunSelfChecks(tilter):
+
+    msg = 'ID1;A+65;A-60;M+18;M-17;m5;P+130;P-18;p0;H0;T12;t7;S1'
+
+    # all keys, same values as before
+    expected = {'ID': 1, 'A+': 65, 'A-': 60, 'M+': 18, 'M-': 17, 'm': 5, 'P+': 130, 'P-': 18, 'p': 0, 'H': 0, 'T': 12, 't': 7, 'S': 1}
+    old      = {}
+    ExtractParametersOld(msg, old)
+    assert tilter.ParseParameters(msg) == expected == old, 'Parameters differ!'
+
+    # white space and negative numbers
+    assert tilter.ParseParameters(' A+ 5 ;\r\nm-1 ') == {'A+': 5, 'm': -1}, 'White space not handled!'
+
+    # keys are matched exactly, e.g. 'p' and 'S' are part of 'Sp3', which is no parameter
+    old = {}
+    ExtractParametersOld('Sp3;m1', old)
+    assert old.get('p') == 3, 'Former implementation should have failed here'
+    assert tilter.ParseParameters('Sp3;m1') == {'m': 1}, 'Unknown field was parsed!'
+
+    # incomplete and empty fields
+    assert tilter.ParseParameters(';;A+;M') == {}, 'Empty fields were parsed!'
+
+    # frames split at arbitrary positions
+    messages = GenerateTraffic(2)
+    data     = ''.join(messages).encode('latin-1')
+
+    for seed in range(20):
+        chunks = SplitIntoChunks(data, seed, maxChunk=seed+1)
+        buf    = FrameBuffer(b'#')
+        frames = []
+
+        for chunk in chunks:
+            buf.Feed(chunk)
+            frames += buf.PopFrames()
+
+        assert [f.decode('latin-1')+'#' for f in frames] == messages, 'Framing failed for seed %s!' % seed
+
+    # events of the tilter are the same, no matter how the bytes arrive
+    events = []
+
+    for chunks in [[m.encode('latin-1') for m in messages], [data[i:i+1] for i in range(len(data))]]:
+
+        t = ChipTilterCore(logLevel='ERROR')
+
+        for event in t.__supportedEvents__:
+            t.SetTilterEvent(event, lambda event=event, t=t: t.GetEventTime(event))
+
+        called = []
+        t._EventHandler = lambda event, arrival, called=called: called.append(event)
+
+        for chunk in chunks:
+            t.HandleInMessageQueue(chunk)
+
+        events.append(called)
+
+    assert events[0] == events[1] and len(events[0]) > 0, 'Events differ!'
+
+    print('self checks passed')
+
+
+if __name__ == '__main__':
+
+    numCycles = 100
+    numRepeat = 5
+
+    tilter = ChipTilterCore(logLevel='ERROR')
+
+    RunSelfChecks(tilter)
+
+    messages = GenerateTraffic(numCycles)
+    data     = ''.join(messages).encode('latin-1')
+    chunks   = SplitIntoChunks(data)
+    chunkStr = [c.decode('latin-1') for c in chunks]
+
+    # former implementation also handles the partial message behind the last '#'
+    # and the empty one when a chunk ends with '#', so only the complete ones are compared
+    resultsNew = HandleChunksNew(tilter, chunks)
+
+    assert len(resultsNew) == len(messages), 'Messages were lost!'
+
+    tOld = min(repeat(lambda: HandleChunksOld(chunkStr)       , number=1, repeat=numRepeat))
+    tNew = min(repeat(lambda: HandleChunksNew(tilter, chunks), number=1, repeat=numRepeat))
+
+    msgs = [m[:-1] for m in messages]
+
+    tParseOld = min(repeat(lambda: [ExtractParametersOld(m, {}) for m in msgs], number=1, repeat=numRepeat))
+    tParseNew = min(repeat(lambda: [tilter.ParseParameters(m)   for m in msgs], number=1, repeat=numRepeat))
+
+    print('%s messages in %s chunks (%s tilt cycles)' % (len(messages), len(chunks), numCycles))
+    print('parse only  former: %8.2f us/msg   new: %8.2f us/msg   speedup: %5.1f x' % (tParseOld/len(msgs)*1e6, tParseNew/len(msgs)*1e6, tParseOld/tParseNew))
+    print('with framing former: %8.2f us/msg   new: %8.2f us/msg   speedup: %5.1f x' % (tOld/len(msgs)*1e6, tNew/len(msgs)*1e6, tOld/tNew))
@@ -5,7 +5,11 @@ Created on Tue May  9 18:44:04 2017
 @author: Martin Leonhardt (martin.leonhardt87@gmail.com)
 """
 
+import re
+import logging as log
+
 from time import sleep
+from collections import OrderedDict
 
 # in case this guy is used somewhere else
 # we need different loading of modules
@@ -19,6 +23,11 @@ try:
 except ImportError:
     import coreUtilities as coreUtils
     
+try:
+    from libs import ArduinoProtocol as proto
+except ImportError:
+    import ArduinoProtocol as proto
+    
 
 
 
@@ -34,12 +43,36 @@ class ArduinoCore(CoreDevice):
     # message for detection
     __detMsg__ = 'Try to detect Arduino Uno...'
     
+    # ascii: 'START <checksum> <command> END\r', binary: see ArduinoProtocol
+    __protocols__ = ['ascii', 'binary']
+    
+    # first firmware version understanding the binary protocol, see DetectProtocol
+    __binaryVersion__ = (0, 7)
+    
+    # debug mode of the firmware after power on or reset
+    __firmwareDebugMode__ = False
+    
+    # slot 0 is used by 'setelectrodes', the others keep named schemes (binary protocol only)
+    __schemeSlots__ = list(range(1, proto.MAX_STORED_SCHEMES))
+    
     def __init__(self, chipConfig='', switchConfig='', selectElectrodePairs=None, **flags):
             
         # setup com port
         flags['baudrate']     = self.__baudrate__
         flags['dtr']          = self.__dtr__
         
+        # protocol has to match the firmware
+        # 'auto' asks the firmware for its version after detection, ascii is used till then
+        protocol = flags.get('protocol', 'auto')
+        
+        if protocol not in self.__protocols__ + ['auto']:
+            raise Exception('Unknown protocol \'%s\'! Use one of %s or \'auto\'.' % (protocol, self.__protocols__))
+        
+        self._protocol = 'ascii' if protocol == 'auto' else protocol
+        
+        if protocol == 'auto':
+            flags['initAfterDetectFunc'] = self.DetectProtocol
+        
         CoreDevice.__init__(self, **flags)
         
         # use given chipConfig file or use default one
@@ -50,6 +83,15 @@ class ArduinoCore(CoreDevice):
         # callback function for selecting and sorting previously defined electrode pairs
         self._selectElectrodePairs = selectElectrodePairs
         
+        self._chipConfig         = {}
+        self._switchConfig       = {}
+        self.chipConfigStatus    = False
+        self.switchConfigStatus  = False
+        
+        # ePairId -> (sorted switch indices, switch bytes + electrode coding)
+        # built from both config files, see _BuildSwitchIndex
+        self._switchIndex = None
+        
         # contains chamber-electrode connections, counting from 0 to 29
         # each two are one chamber with two different electrode pairs for counting and measuring viability
         # so 60 entries are in this file
@@ -71,6 +113,15 @@ class ArduinoCore(CoreDevice):
             }
             
         self._debugMode = False
+        
+        # debug mode the Arduino was set to, None if unknown
+        self._sentDebugMode = None
+        
+        # compiled setups, (selection, flags) -> (number of electrode pairs, byte stream)
+        self._setupStreams = {}
+        
+        # schemes stored on the Arduino, name -> (slot, byte stream), least recently used first
+        self._storedSchemes = OrderedDict()
 
 ### -------------------------------------------------------------------------------------------------------------------------------
 
@@ -109,8 +160,114 @@ class ArduinoCore(CoreDevice):
                 success = False
                 self.logger.error('Could not find switch config file: %s' % switchConfig)
                 
+        if chipConfig or switchConfig:
+            # index and compiled setups depend on both files
+            self._switchIndex  = None
+            self._setupStreams = {}
+            
+            if self.chipConfigStatus and self.switchConfigStatus:
+                success = self._BuildSwitchIndex() and success
+                
         return success
         
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SendCommand(self, command, value=None, data=b''):
+        """ Send command with an optional value (0..255) and binary data,
+            using the protocol given by the flag 'protocol'.
+        """
+        
+        if self._protocol == 'ascii':
+            
+            msg = [command]
+            
+            if value is not None:
+                msg.append( str(value) )
+            if data:
+                msg.append( data.decode('latin-1') )
+                
+            return self.SendMessage( ' '.join(msg) )
+        
+        payload = bytes([value]) if value is not None else b''
+        
+        return self.SendFrame( proto.OPCODES[command], payload + data )
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def SendFrame(self, opcode, payload=b''):
+        """ Send binary frame to Arduino Uno and wait for its reply.
+            Returns as soon as the reply frame is complete.
+        """
+        
+        frame = proto.EncodeFrame(opcode, payload)
+        
+        inData = self.Request(frame, mode='waiting', waitFor=1, bePatient=25, until=lambda data: proto.FindFrameEnd(data) != -1)
+        
+        if inData is None:
+            return False
+        
+        decoder = proto.FrameDecoder()
+        replies = [p for o, p in decoder.Feed(inData) if o == opcode | proto.REPLY_FLAG]
+        
+        # e.g. debug prints
+        skipped = decoder.PopSkippedBytes()
+        if skipped:
+            self.logger.debug('Received message from Arduino: %s' % skipped.decode('latin-1').replace('\n', ', '))
+        
+        if not replies or not replies[0]:
+            self.logger.error('No valid answer from Arduino for command 0x%02X!' % opcode)
+            return False
+        
+        status = replies[0][0]
+        text   = replies[0][1:].decode('latin-1')
+        
+        if text:
+            self.logger.debug('Received message from Arduino: %s' % text)
+            
+        if status != proto.STATUS_OK:
+            self.logger.error( 'Arduino: %s' % proto.STATUS.get(status, 'Unknown status 0x%02X' % status) )
+            return False
+        
+        return True
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def OpenAsyncTransport(self, delimiter=None, loop=None, findEnd=None):
+        """ Binary replies have no delimiter, they are cut into frames by their length.
+            Frames are returned as received, decode them with ArduinoProtocol.FrameDecoder.
+        """
+        
+        if self._protocol == 'binary' and not findEnd:
+            findEnd = proto.FindFrameEnd
+        
+        return CoreDevice.OpenAsyncTransport(self, delimiter, loop, findEnd)
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def DetectProtocol(self):
+        """ Ask the firmware for its version in ASCII, which is understood by every firmware,
+            and use the binary protocol in case it is supported.
+            Returns the protocol used from now on.
+        """
+        
+        answer  = self._RequestMessage('getversion')
+        version = re.search(r'V(\d+)\.(\d+)', answer) if answer else None
+        
+        if not version:
+            self._protocol = 'ascii'
+            self.logger.warning('Could not read the firmware version, using ASCII protocol!')
+            
+        elif ( int(version.group(1)), int(version.group(2)) ) < self.__binaryVersion__:
+            self._protocol = 'ascii'
+            self.logger.warning('Firmware %s does not support the binary protocol, flash V%d.%d to speed up setups!' % ((version.group(0),) + self.__binaryVersion__))
+            
+        else:
+            self._protocol = 'binary'
+        
+        self.logger.info('Using %s protocol.' % self._protocol)
+        
+        return self._protocol
+    
 ### -------------------------------------------------------------------------------------------------------------------------------
 
     def SendMessage(self, msg):
@@ -119,7 +276,18 @@ class ArduinoCore(CoreDevice):
             Serial port is kept open in case debug is enabled till answer from Arduino was received.
         """
         
-        success = False
+        inMsg = self._RequestMessage(msg)
+        
+        # in case message is not empty something probably went wrong
+        return inMsg is not None and 'ERROR' not in inMsg
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _RequestMessage(self, msg):
+        """ Send ASCII message and return the answer of the Arduino, None in case sending failed
+        """
+        
+        inMsg = None
         
         if self.SafeOpenComPort():
             
@@ -133,79 +301,123 @@ class ArduinoCore(CoreDevice):
             # NOTE: flush is deprecated with pySerial > v3.0
             msg = 'START %s %s END\r' % (checkSum, msg)
             
-            success = self.SafeWriteToComPort(msg.encode('latin-1'), leaveOpen=True)
+            # write and wait for the answer at once, so a listening thread cannot catch it
+            inMsg = self.Request(msg.encode('latin-1'), mode='waiting', waitFor=1, bePatient=25, decode=True)
             
-            if success:
+            if inMsg is not None:
                 
-                inMsg = self.SafeReadFromComPort(mode='waiting', waitFor=1, bePatient=25, decode=True).replace('\n', ', ')
+                inMsg = inMsg.replace('\n', ', ')
                 
                 self.logger.debug('Received message from Arduino: %s' % inMsg)
-                
-                # in case message is not empty something probably went wrong
-                if 'ERROR' in inMsg:
-                    success = False
                         
-        return success
+        return inMsg
     
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def GetActiveSwitchIndices(self, activeElectrodePair):
-        '''gets the switch indices which are to be activated when the indicated chamber is active'''
+    def _BuildSwitchIndex(self):
+        '''maps every electrode pair of the chip config to its switch indices and stream bytes,
+           logs duplicate and missing pads
+        '''
         
-        # init return value
-        switchesToActivate = []
-        oldFileType = False
+        success = True
         
-        if isinstance(activeElectrodePair, str):
+        # (padId, padType) -> switch indices
+        switches = {}
+        
+        for switchId, switch in enumerate(self._switchConfig):
+            switches.setdefault( (switch['padId'], switch['padType']), [] ).append(switchId)
             
-            if 'res' in activeElectrodePair:
-                switchesToActivate = [62, 63]
-            elif 'short' in activeElectrodePair:
-                switchesToActivate = [60, 61]
-        else:
-            # find corresponding electrode pair in chip config file
-            padIdx = 0
-            while padIdx < len(self._chipConfig['chamberToPad']):
-                # get next pad setup
-                pads = self._chipConfig['chamberToPad'][padIdx]
-                # stop loop when correct electrode pair setup was found
-                # use pads in subsequent code
-                if 'ePairId' in pads.keys():
-                    if pads['ePairId'] == activeElectrodePair:
-                        break
-                    else:
-                        padIdx += 1
-                # probably old file type .. use number as index to access pads
-                else:
-                    oldFileType = True
-                    break
-                
-            # in case loop left withput any results
-            # e.g. an old file setup was used
-            # just use the given variable as index
-            if oldFileType:
-                pads = self._chipConfig['chamberToPad'][activeElectrodePair]
+        for (padId, padType), switchIds in switches.items():
+            if len(switchIds) > 1 and padId >= 0:
+                self.logger.error('Switch config: %s pad %s is connected to several switches %s!' % (padType, padId, switchIds))
+                success = False
+        
+        index = {}
+        
+        for padIdx, pads in enumerate(self._chipConfig['chamberToPad']):
             
-            self.logger.debug('pads: %s' % pads)
+            # probably old file type .. use number as index to access pads
+            ePairId = pads.get('ePairId', padIdx)
+            
+            if ePairId in index:
+                self.logger.error('Chip config: electrode pair %s is defined several times!' % ePairId)
+                success = False
+                continue
             
             # get switch index to close connection to stimulation/recording pad
-            for switchId in range(len(self._switchConfig)):
-                if (self._switchConfig[switchId]['padId'] == pads['stimPadId'] and self._switchConfig[switchId]['padType'] == 'stim'):
-                    switchesToActivate.append(switchId)
-                if (self._switchConfig[switchId]['padId'] == pads['recPadId']  and self._switchConfig[switchId]['padType'] == 'rec'):
-                    switchesToActivate.append(switchId)
-
-                ############################################
-                ###    --- PUT YOUR EXTENSION HERE ---   ###
-                ###                                      ###
-                ### switchesToActivate.append(...)       ###
-                ############################################
-                    
-        # make sure Arduino receives sorted list
-        # otherwise daisy chaining might not work
-        switchesToActivate.sort()
+            switchesToActivate = []
+            missingPad         = False
+            
+            for key in [(pads['stimPadId'], 'stim'), (pads['recPadId'], 'rec')]:
+                
+                if key not in switches:
+                    self.logger.error('Chip config: %s pad %s of electrode pair %s is missing in switch config! Electrode pair is skipped.' % (key[1], key[0], ePairId))
+                    success    = False
+                    missingPad = True
                     
-        return switchesToActivate
+                switchesToActivate += switches.get(key, [])
+                
+            # stream would be shorter than the Arduino expects and shift all following chambers
+            if missingPad:
+                continue
+            
+            ############################################
+            ###    --- PUT YOUR EXTENSION HERE ---   ###
+            ###                                      ###
+            ### switchesToActivate.append(...)       ###
+            ############################################
+            
+            # make sure Arduino receives sorted list
+            # otherwise daisy chaining might not work
+            switchesToActivate = tuple(sorted(switchesToActivate))
+            
+            # chamber number, electrode pair as MSB (NOTE: only five bits are used)
+            index[ePairId] = ( switchesToActivate, bytes(switchesToActivate) + bytes([ePairId & 0x1F]) )
+        
+        # support the two debugging switches on current PCB (v4.0 Ketki)
+        # one with a resister (1k)
+        # and the other with a short
+        # NOTE: set DIO lines to zero
+        index['res']   = ( (62, 63), bytes([62, 63, 0x00]) )
+        index['short'] = ( (60, 61), bytes([60, 61, 0x00]) )
+        
+        self._switchIndex = index
+        
+        return success
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _LookupElectrodePair(self, activeElectrodePair):
+        '''returns (switch indices, stream prefix) or None for unknown electrode pairs'''
+        
+        if not (self.chipConfigStatus and self.switchConfigStatus):
+            return None
+        
+        if self._switchIndex is None:
+            self._BuildSwitchIndex()
+        
+        if isinstance(activeElectrodePair, str):
+            
+            if 'res' in activeElectrodePair:
+                activeElectrodePair = 'res'
+            elif 'short' in activeElectrodePair:
+                activeElectrodePair = 'short'
+        
+        entry = self._switchIndex.get(activeElectrodePair)
+        
+        if entry is None:
+            self.logger.error('Electrode pair %s is not defined in chip config!' % (activeElectrodePair,))
+            
+        return entry
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetActiveSwitchIndices(self, activeElectrodePair):
+        '''gets the switch indices which are to be activated when the indicated chamber is active'''
+        
+        entry = self._LookupElectrodePair(activeElectrodePair)
+        
+        return list(entry[0]) if entry else []
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -214,116 +426,225 @@ class ArduinoCore(CoreDevice):
            NOTE: all switches are updated at once (8 bytes + 1 byte for chamber and electrode encoding)
         '''
         
-        sendBytes = bytes()
+        entry = self._LookupElectrodePair(activeElectrodePair)
         
-        if self.chipConfigStatus and self.switchConfigStatus:
+        if not entry:
+            return ''
         
-            # support the two debugging switches on current PCB (v4.0 Ketki)
-            # one with a resister (1k)
-            # and the other with a short
-            # NOTE: set DIO lines and residence time to zero
-            if isinstance(activeElectrodePair, str):
-                activeSwitches  = self.GetActiveSwitchIndices(activeElectrodePair)
-                electrodeCoding = (0x00).to_bytes(1, 'big')
-                
-            elif isinstance(activeElectrodePair, int):
-                
-                # index in PcbConfig file, starting from 0 independent from routing
-                activeSwitches = self.GetActiveSwitchIndices(activeElectrodePair)
-                
-                # chamber and electrode coding
-                electrodeCoding = (activeElectrodePair & 0x1F).to_bytes(1, 'big')
-                
-            # first switch bytes
-            # use switch index and convert to bytes
-            for sw in activeSwitches:
-                sendBytes += sw.to_bytes(1, 'big')
-            
-            # then chamber number, electrode pair as MSB (NOTE: only five bits are used)
-            # append residence time encoded in four bytes
-            sendBytes += electrodeCoding 
-            sendBytes += residenceTime.to_bytes(4, 'big')
-            
+        activeSwitches, prefix = entry
+        
+        # switch bytes and chamber coding come from the index
+        # append residence time encoded in four bytes
+        sendBytes = prefix + residenceTime.to_bytes(4, 'big')
+        
+        if self.logger.isEnabledFor(log.DEBUG):
             self.logger.debug( 'Active electrode pair: %s' % activeElectrodePair                                                     )
-            self.logger.debug( 'Active switches (abs): %s' % activeSwitches                                                          )
+            self.logger.debug( 'Active switches (abs): %s' % list(activeSwitches)                                                    )
             self.logger.debug( 'Active switches: %s on device: %s' % ([i%8 for i in activeSwitches], [i//8 for i in activeSwitches]) )
             
             # wrap the text generated from sendBytes every two half-bytes and print it
-            self.logger.debug( 'Prepare %s bytes for storing on Arduino: %s' % (len(activeSwitches)+5, coreUtils.GetTextFromByteStream(sendBytes)) )
+            self.logger.debug( 'Prepare %s bytes for storing on Arduino: %s' % (len(sendBytes), coreUtils.GetTextFromByteStream(sendBytes)) )
     
         return sendBytes.decode('latin-1')
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def SetupArduino(self, selectFunc=None, **flags):
+    def CompileSetup(self, selectFunc=None, **flags):
+        '''returns (number of electrode pairs, byte stream) for the selected electrode pairs or None,
+           results are cached per selection and flags till the electrode pairs or configs change
+        '''
         
-        success = True
+        key = self._GetSetupKey(selectFunc, **flags)
+        
+        if key is not None and key in self._setupStreams:
+            return self._setupStreams[key]
+        
+        ePairs = self.SelectElectrodePairs(selectFunc, **flags)
+        
+        if len(ePairs) == 0:
+            return None
+        
+        sendStream = []
+        
+        # generate byte stream for all electrode pairs
+        for ePair in ePairs:
+                
+            stream = self.GenerateSendStream(ePair['ePair'], ePair['int'])
+            
+            # check for valid stream
+            if len(stream) == 0:
+                return None
+            
+            sendStream.append( stream )
+            
+        setup = ( len(ePairs), ''.join(sendStream).encode('latin-1') )
+        
+        if key is not None:
+            self._setupStreams[key] = setup
+            
+        return setup
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetupArduino(self, selectFunc=None, **flags):
+        '''sends the selected electrode pairs to the Arduino,
+           with the binary protocol every setup is stored once and just activated when requested again
+        '''
         
         # check debug flag
         # it's also possible to set self.debugMode directly
         self._debugMode = flags.get('debugMode', self._debugMode)
         
-        # empty stream
-        sendStream = []
-
-        ePairs = self.SelectElectrodePairs(selectFunc, **flags)
+        key   = self._GetSetupKey(selectFunc, **flags)
+        setup = self.CompileSetup(selectFunc, **flags)
         
-        if len(ePairs) == 0:
-            success = False
+        if not setup:
+            return False
+            
+        if not self._UpdateDebugMode():
+            return False
         
+        numPairs, sendStream = setup
+        
+        if self._protocol == 'binary' and key is not None:
             
-        if success:
+            # setup is stored under its key
+            success = self.StoreScheme(key, selectFunc, **flags) and self.ActivateScheme(key)
             
-            # generate byte stream for all electrode pairs
-            for ePair in ePairs:
-                    
-                stream = self.GenerateSendStream(ePair['ePair'], ePair['int'])
-                
-                # check for valid stream
-                # otherwise stop loop
-                if len(stream) != 0:
-                    sendStream.append( stream )
-                else:
-                    success = False
-                    break
+            # Arduino was probably reset and lost its schemes and debug mode, send again
+            if not success:
+                self._storedSchemes = OrderedDict()
+                self._sentDebugMode = self.__firmwareDebugMode__
+                success = self._UpdateDebugMode() and self.StoreScheme(key, selectFunc, **flags) and self.ActivateScheme(key)
+        
+        else:
+            # send byte stream for setting electrode pair setup
+            # Arduino will just call the setups one by one
+            # according to the defined timings
+            self.logger.debug('Sending %s bytes to Arduino... %s' % (len(sendStream), coreUtils.GetTextFromByteStream(sendStream)))
+            
+            success = self.SendCommand('setelectrodes', numPairs, sendStream)
             
-                
         if success:
+            self.logger.info('Arduino setup was updated.')
+        else:
+            self.logger.error('Failed.')
+        
+        return success
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _UpdateDebugMode(self):
+        '''enables/disables debug for Arduino, only if it changed
+        '''
+        
+        if self._sentDebugMode != self._debugMode:
+            if not self.SendCommand('debug', 1 if self._debugMode else 0):
+                return False
+            self._sentDebugMode = self._debugMode
             
-            # enable/disable debug for Arduino
-            if self._debugMode:
-                success = self.SendMessage('debug 1')
-            else:
-                success = self.SendMessage('debug 0')
-                    
+        return True
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def PrepareSetup(self, selectFunc=None, **flags):
+        '''stores the setup on the Arduino without activating it,
+           so SetupArduino with the same arguments just sends a one byte command later on
+        '''
+        
+        key = self._GetSetupKey(selectFunc, **flags)
+        
+        if self._protocol != 'binary' or key is None:
+            # nothing to store, but the stream is compiled at least
+            return self.CompileSetup(selectFunc, **flags) is not None
+        
+        return self.StoreScheme(key, selectFunc, **flags)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def StoreScheme(self, name, selectFunc=None, **flags):
+        '''stores the selected electrode pairs on the Arduino under the given name (binary protocol only),
+           the least recently used scheme is replaced when all slots are in use
+        '''
+        
+        if self._protocol != 'binary':
+            self.logger.error('Storing schemes requires the binary protocol!')
+            return False
+        
+        setup = self.CompileSetup(selectFunc, **flags)
+        
+        if not setup:
+            return False
+        
+        numPairs, sendStream = setup
+        
+        if name in self._storedSchemes:
+            slot, stream = self._storedSchemes.pop(name)
             
-            # check if something is in stream
-            if success and len(sendStream) != 0:
-                # send byte stream for setting electrode pair setup
-                # Arduino will just call the setups one by one
-                # according to the defined timings
-                sendStream = ''.join(sendStream)
-                
-                self.logger.debug('Sending %s bytes to Arduino... %s' % (len(sendStream), coreUtils.GetTextFromByteStream(sendStream)))
-                
-                success = self.SendMessage('setelectrodes %s %s' % (len(ePairs), sendStream))
-                
-                if success:
-                    self.logger.info('Arduino setup was updated.')
-                else:
-                    self.logger.error('Failed.')
+            # already on the Arduino
+            if stream == sendStream:
+                self._storedSchemes[name] = (slot, stream)
+                return True
+        else:
+            usedSlots = [slot for slot, _ in self._storedSchemes.values()]
+            freeSlots = [slot for slot in self.__schemeSlots__ if slot not in usedSlots]
+            
+            if freeSlots:
+                slot = freeSlots[0]
+            else:
+                # replace least recently used one
+                _, (slot, _) = self._storedSchemes.popitem(last=False)
         
-        return success
+        self.logger.debug('Storing scheme %s in slot %s, %s bytes... %s' % (name, slot, len(sendStream), coreUtils.GetTextFromByteStream(sendStream)))
+        
+        if not self.SendCommand('storescheme', slot, bytes([numPairs]) + sendStream):
+            return False
+        
+        self._storedSchemes[name] = (slot, sendStream)
+        
+        return True
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def ActivateScheme(self, name):
+        '''switches the Arduino to a previously stored scheme, just one byte of payload'''
+        
+        if name not in self._storedSchemes:
+            self.logger.error('Scheme %s was not stored!' % (name,))
+            return False
+        
+        # mark as recently used
+        slot, stream = self._storedSchemes.pop(name)
+        self._storedSchemes[name] = (slot, stream)
+        
+        return self.SendCommand('activatescheme', slot)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _GetSetupKey(self, selectFunc=None, **flags):
+        '''key for caching setups or None if flags can't be hashed'''
+        
+        # debug mode does not change the stream
+        flags = tuple( sorted( (k, v) for k, v in flags.items() if k != 'debugMode' ) )
+        
+        key = ( selectFunc if selectFunc else self._selectElectrodePairs, flags )
+        
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        
+        return key
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def Start(self):
-        return self.SendMessage('start')
+        return self.SendCommand('start')
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def Stop(self):
-        return self.SendMessage('stop')
+        return self.SendCommand('stop')
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -332,7 +653,11 @@ class ArduinoCore(CoreDevice):
         # locally enable debug mode
         self._debugMode = True
         # enable debug mode for Arduino
-        return self.SendMessage('debug 1')
+        self._sentDebugMode = None
+        if self.SendCommand('debug', 1):
+            self._sentDebugMode = True
+            return True
+        return False
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -341,7 +666,11 @@ class ArduinoCore(CoreDevice):
         # locally disable debug mode
         self._debugMode = False
         # disable debug mode for Arduino
-        return self.SendMessage('debug 0')
+        self._sentDebugMode = None
+        if self.SendCommand('debug', 0):
+            self._sentDebugMode = False
+            return True
+        return False
             
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -359,6 +688,9 @@ class ArduinoCore(CoreDevice):
         
         self._definedElectrodePairs[key]['ePair'] = ePair
         self._definedElectrodePairs[key]['int']   = interval
+        
+        # compiled setups are outdated
+        self._setupStreams = {}
 
         self.logger.debug('Selected electrode pair %s with interval %s us.' % (ePair, interval))
         
@@ -366,6 +698,7 @@ class ArduinoCore(CoreDevice):
     
     def UndefineAllElectrodePairs(self):
         self._definedElectrodePairs = {}
+        self._setupStreams          = {}
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -519,7 +852,7 @@ if __name__ == '__main__':
     
     stream = arduino.GenerateSendStream(0,500000) + arduino.GenerateSendStream(2,500000)
     
-    arduino.SendMessage("setelectrodes 2 %s"%stream)
+    arduino.SendCommand('setelectrodes', 2, stream.encode('latin-1'))
 
 #    arduino.DefineElectrodePair(0, 1e6)
 #    arduino.DefineElectrodePair(1, 1e6)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:47 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+
+Binary command protocol between ArduinoCore and the Arduino Uno firmware.
+
+Frame layout, all numbers big endian:
+
+    SYNC0 SYNC1 | LEN (2 bytes) | OPCODE | PAYLOAD (LEN bytes) | CRC16 (2 bytes)
+
+CRC16-CCITT (poly 0x1021, init 0xFFFF) is calculated over LEN, OPCODE and PAYLOAD.
+The firmware answers every command with a frame of opcode | REPLY_FLAG and
+a payload of one status byte, optionally followed by an ASCII text.
+"""
+
+import struct
+
+
+SYNC       = b'\xAA\x55'
+REPLY_FLAG = 0x80
+
+# LEN + OPCODE and CRC
+HEADER_LEN = len(SYNC) + 3
+FOOTER_LEN = 2
+
+# max payload the firmware can store, see MAX_DATA_LENGTH in Arduino_Uno.ino
+MAX_PAYLOAD_LEN = 512
+
+# command name -> opcode, names are the same as for the ASCII protocol
+OPCODES = {
+        'camera'       : 0x01,
+        'debug'        : 0x02,
+        'getversion'   : 0x03,
+        'setelectrodes': 0x05,
+        'setdio'       : 0x06,
+        'setframerate' : 0x07,
+        'start'        : 0x08,
+        'stop'         : 0x09,
+        'test'         : 0x0A,
+        'tilt'         : 0x0B,
+        'tilter'       : 0x0C,
+        'storescheme'   : 0x0D,
+        'activatescheme': 0x0E
+    }
+
+# slots for switching schemes kept on the board, see MAX_STORED_SCHEMES in Arduino_Uno.ino
+MAX_STORED_SCHEMES = 4
+
+# status byte of the reply frames
+STATUS = {
+        0x00: 'OK',
+        0x01: 'ERROR: Invalid checksum.',
+        0x02: 'ERROR: Invalid frame length.',
+        0x03: 'ERROR: Unknown command.',
+        0x04: 'ERROR: Invalid value.',
+        0x05: 'ERROR: Could not allocate memory for storing switching scheme!'
+    }
+
+STATUS_OK            = 0x00
+STATUS_CRC           = 0x01
+STATUS_LENGTH        = 0x02
+STATUS_UNKNOWN       = 0x03
+STATUS_INVALID_VALUE = 0x04
+STATUS_NO_MEMORY     = 0x05
+
+
+
+def _CrcTable():
+
+    table = []
+
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+
+    return table
+
+_crcTable = _CrcTable()
+
+### --------------------------------------------------------------------------------------------------
+
+def Crc16(data, crc=0xFFFF):
+    ''' CRC16-CCITT as calculated by the firmware (crc16Update)
+    '''
+
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _crcTable[(crc >> 8) ^ b]
+
+    return crc
+
+### --------------------------------------------------------------------------------------------------
+
+def EncodeFrame(opcode, payload=b''):
+
+    if len(payload) > MAX_PAYLOAD_LEN:
+        raise Exception('Payload of %d bytes exceeds %d bytes!' % (len(payload), MAX_PAYLOAD_LEN))
+
+    body = struct.pack('>HB', len(payload), opcode) + bytes(payload)
+
+    return SYNC + body + struct.pack('>H', Crc16(body))
+
+### --------------------------------------------------------------------------------------------------
+
+def EncodeReply(opcode, status=STATUS_OK, text=''):
+    return EncodeFrame(opcode | REPLY_FLAG, bytes([status]) + text.encode('latin-1'))
+
+### --------------------------------------------------------------------------------------------------
+
+def FindFrameEnd(data, start=0):
+    ''' Returns the index behind the first complete frame in data or -1.
+        Used to stop reading as soon as a reply is complete, the CRC is not checked here.
+    '''
+
+    idx = data.find(SYNC, start)
+
+    while idx != -1:
+
+        if len(data) - idx < HEADER_LEN:
+            return -1
+
+        length = (data[idx+2] << 8) | data[idx+3]
+
+        # no valid frame, might be a sync pattern inside of text
+        if length > MAX_PAYLOAD_LEN:
+            idx = data.find(SYNC, idx+1)
+            continue
+
+        end = idx + HEADER_LEN + length + FOOTER_LEN
+
+        return end if end <= len(data) else -1
+
+    return -1
+
+
+
+class FrameDecoder:
+    ''' Reference decoder for the binary protocol, works for both directions.
+        Bytes can be fed in arbitrary pieces, bytes outside of frames (e.g. debug
+        prints of the firmware) and frames with invalid CRC are skipped and counted.
+    '''
+
+    def __init__(self):
+
+        self._buffer       = bytearray()
+        self.numCrcErrors  = 0
+        self.skippedBytes  = bytearray()
+        self.crcErrors     = []      # opcodes of frames with invalid CRC
+
+### --------------------------------------------------------------------------------------------------
+
+    def Feed(self, data):
+        ''' Returns a list of (opcode, payload) of all frames completed by data
+        '''
+
+        self._buffer += data
+
+        frames = []
+
+        while True:
+
+            idx = self._buffer.find(SYNC)
+
+            if idx == -1:
+                # last byte might be the beginning of the sync pattern
+                keep = 1 if self._buffer[-1:] == SYNC[:1] else 0
+                self._Skip(len(self._buffer) - keep)
+                break
+
+            self._Skip(idx)
+
+            if len(self._buffer) < HEADER_LEN:
+                break
+
+            length, opcode = struct.unpack_from('>HB', self._buffer, len(SYNC))
+
+            if length > MAX_PAYLOAD_LEN:
+                self._Skip(1)
+                continue
+
+            end = HEADER_LEN + length + FOOTER_LEN
+
+            if len(self._buffer) < end:
+                break
+
+            body = bytes(self._buffer[len(SYNC):end-FOOTER_LEN])
+            crc  = struct.unpack_from('>H', self._buffer, end-FOOTER_LEN)[0]
+
+            if Crc16(body) != crc:
+                # resync behind the current sync pattern
+                self.numCrcErrors += 1
+                self.crcErrors.append(opcode)
+                self._Skip(1)
+                continue
+
+            frames.append( (opcode, body[3:]) )
+
+            del self._buffer[:end]
+
+        return frames
+
+### --------------------------------------------------------------------------------------------------
+
+    def HasPendingBytes(self):
+        ''' True while a frame is incomplete
+        '''
+        return len(self._buffer) > 0
+
+### --------------------------------------------------------------------------------------------------
+
+    def PopCrcErrors(self):
+
+        crcErrors      = self.crcErrors
+        self.crcErrors = []
+
+        return crcErrors
+
+### --------------------------------------------------------------------------------------------------
+
+    def PopSkippedBytes(self):
+
+        skipped           = bytes(self.skippedBytes)
+        self.skippedBytes = bytearray()
+
+        return skipped
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Skip(self, n):
+
+        if n > 0:
+            self.skippedBytes += self._buffer[:n]
+            del self._buffer[:n]
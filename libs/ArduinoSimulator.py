@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:15 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import serial
+import struct
+import threading
+
+from time import monotonic
+
+try:
+    from libs import ArduinoProtocol as proto
+except ImportError:
+    import ArduinoProtocol as proto
+
+
+
+class ArduinoSimulator(serial.SerialBase):
+    ''' Host side stand-in for the Arduino Uno firmware.
+        Behaves like a serial port, so it can be assigned to ArduinoCore.comPort.
+        Commands of the binary and the ASCII protocol are answered like the firmware
+        does and the resulting state (switching schemes, DIO lines, ...) can be inspected.
+        NOTE: timing of the serial line is not simulated, only the pause between
+              two writes is taken as idle time of the line
+    '''
+
+    __version__ = 'Arduino Uno, ArduinoHandler V0.7'
+
+    # bytes per switching scheme, see CHAMBER_BYTE_STREAM_LEN
+    __schemeLen__ = 7
+
+    # incomplete frames are dropped after this idle time in seconds, see RX_IDLE_TIMEOUT
+    __idleTimeout__ = 20e-3
+
+    def __init__(self, *args, **kwargs):
+
+        self._rxLock  = threading.Lock()
+        self._rx      = bytearray()     # bytes waiting for the host
+        self._txAscii = bytearray()     # incomplete ASCII command
+        self._decoder = proto.FrameDecoder()
+        self._lastRx  = monotonic()
+
+        self.debugMode     = False
+        self.triggerCamera = False
+        self.tiltPlatform  = False
+        self.startMeas     = False
+        self.frameRate     = 20
+        self.dio           = 0
+        self.schemes       = []         # schemes of the active slot
+        self.storedSchemes = [None] * proto.MAX_STORED_SCHEMES
+        self.activeSlot    = -1
+
+        # statistics
+        self.numCommands   = 0
+        self.bytesReceived = 0
+        self.bytesSent     = 0
+
+        serial.SerialBase.__init__(self, *args, **kwargs)
+
+### --------------------------------------------------------------------------------------------------
+    #######################################################################
+    ###                    --- SERIAL PORT API ---                      ###
+    #######################################################################
+### --------------------------------------------------------------------------------------------------
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, size=1):
+
+        with self._rxLock:
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+
+        return data
+
+    def write(self, data):
+
+        data = bytes(data)
+
+        self.bytesReceived += len(data)
+
+        # line was idle, so the firmware has dropped the incomplete frame meanwhile
+        if self._decoder.HasPendingBytes() and monotonic() - self._lastRx > self.__idleTimeout__:
+            self._decoder = proto.FrameDecoder()
+
+        self._lastRx = monotonic()
+
+        # binary frames always start with the sync pattern, like in serialEvent()
+        if self._txAscii or not (data.startswith(proto.SYNC[:1]) or self._decoder.HasPendingBytes()):
+            self._HandleAscii(data)
+        else:
+            for opcode, payload in self._decoder.Feed(data):
+                self._HandleFrame(opcode, payload)
+
+            for opcode in self._decoder.PopCrcErrors():
+                self._Send( proto.EncodeReply(opcode, proto.STATUS_CRC) )
+
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._rxLock:
+            self._rx = bytearray()
+
+    def reset_output_buffer(self):
+        pass
+
+### --------------------------------------------------------------------------------------------------
+    #######################################################################
+    ###                      --- FIRMWARE ---                           ###
+    #######################################################################
+### --------------------------------------------------------------------------------------------------
+
+    def _Send(self, data):
+
+        with self._rxLock:
+            self._rx += data
+
+        self.bytesSent += len(data)
+
+### --------------------------------------------------------------------------------------------------
+
+    def _HandleFrame(self, opcode, payload):
+
+        commands = {v: k for k, v in proto.OPCODES.items()}
+
+        if opcode not in commands:
+            status, text = proto.STATUS_UNKNOWN, ''
+        else:
+            status, text = self._Execute(commands[opcode], payload)
+
+        self._Send( proto.EncodeReply(opcode, status, text) )
+
+### --------------------------------------------------------------------------------------------------
+
+    def _HandleAscii(self, data):
+
+        self._txAscii += data
+
+        end = self._txAscii.find(b'END\r')
+
+        if end == -1:
+            return
+
+        stream        = bytes(self._txAscii[:end])
+        self._txAscii = bytearray()
+
+        if not stream.startswith(b'START '):
+            self._Send(b'ERROR: Received invalid stream, could not find header and/or footer!\r\n')
+            return
+
+        # checksum is calculated over everything behind the checksum, except the last space
+        checkSum, _, rest = stream[len(b'START '):].partition(b' ')
+
+        if int(checkSum, 16) != sum(rest[:-1]):
+            self._Send(b'ERROR: Received invalid stream, checksums are not identical!\r\n')
+            return
+
+        command, _, args = rest[:-1].partition(b' ')
+        command          = command.decode('latin-1')
+
+        if command not in proto.OPCODES:
+            return
+
+        payload = b''
+
+        if args:
+            value, _, data = args.partition(b' ')
+            value          = int(value)
+
+            # firmware rejects numbers of chambers which don't fit into a byte
+            if command == 'setelectrodes' and not 0 < value <= 0xFF:
+                self._Send( ('%s\r\n' % proto.STATUS[proto.STATUS_INVALID_VALUE]).encode('latin-1') )
+                return
+
+            payload = bytes([value & 0xFF]) + data
+
+        status, text = self._Execute(command, payload)
+
+        if text:
+            self._Send( ('%s\r\n' % text).encode('latin-1') )
+        elif status != proto.STATUS_OK:
+            self._Send( ('%s\r\n' % proto.STATUS[status]).encode('latin-1') )
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Execute(self, command, payload):
+        ''' Returns status and text like the firmware
+        '''
+
+        self.numCommands += 1
+
+        # commands with one value byte
+        if command in ['camera', 'debug', 'setdio', 'setframerate', 'tilter']:
+
+            if len(payload) != 1:
+                return proto.STATUS_LENGTH, ''
+
+            value = payload[0]
+
+            if command == 'camera':
+                self.triggerCamera = bool(value)
+            elif command == 'debug':
+                self.debugMode = bool(value)
+                return proto.STATUS_OK, 'Debug mode %s' % ('ON' if value else 'OFF')
+            elif command == 'setdio':
+                self.dio = value & 0x1F
+            elif command == 'setframerate':
+                if not value:
+                    return proto.STATUS_INVALID_VALUE, ''
+                self.frameRate = value
+                return proto.STATUS_OK, 'Camera frame rate %d' % value
+            elif command == 'tilter':
+                self.tiltPlatform = bool(value)
+
+        elif command == 'setelectrodes':
+            # stored in the first slot and selected right away
+            status = self._StoreSchemes(0, payload)
+            if status == proto.STATUS_OK:
+                status = self._ActivateSchemes(0)
+            return status, ''
+
+        elif command == 'storescheme':
+            if len(payload) < 1:
+                return proto.STATUS_LENGTH, ''
+            return self._StoreSchemes(payload[0], payload[1:]), ''
+
+        elif command == 'activatescheme':
+            if len(payload) != 1:
+                return proto.STATUS_LENGTH, ''
+            return self._ActivateSchemes(payload[0]), ''
+
+        elif command == 'getversion':
+            return proto.STATUS_OK, self.__version__
+
+        elif command == 'start':
+            self.startMeas = True
+            if self.schemes:
+                self.dio = self.schemes[0]['dio'] & 0x1F
+
+        elif command == 'stop':
+            self.startMeas = False
+
+        elif command == 'test':
+            return proto.STATUS_OK, 'INFO: Test was executed.'
+
+        return proto.STATUS_OK, ''
+
+### --------------------------------------------------------------------------------------------------
+
+    def _StoreSchemes(self, slot, payload):
+
+        if len(payload) < 1:
+            return proto.STATUS_LENGTH
+
+        num    = payload[0]
+        stream = payload[1:]
+
+        if len(stream) != num * self.__schemeLen__:
+            return proto.STATUS_LENGTH
+
+        if slot >= proto.MAX_STORED_SCHEMES or num == 0 or num >= proto.MAX_PAYLOAD_LEN // self.__schemeLen__:
+            return proto.STATUS_INVALID_VALUE
+
+        # slot is in use, switching stops till it gets activated again
+        if slot == self.activeSlot:
+            self.schemes    = []
+            self.activeSlot = -1
+
+        schemes = []
+
+        for i in range(num):
+            sw0, sw1, dio, interval = struct.unpack_from('>BBBI', stream, i*self.__schemeLen__)
+            schemes.append( {'switches': [sw0, sw1], 'dio': dio, 'interval': interval} )
+
+        self.storedSchemes[slot] = schemes
+
+        return proto.STATUS_OK
+
+### --------------------------------------------------------------------------------------------------
+
+    def _ActivateSchemes(self, slot):
+
+        if slot >= proto.MAX_STORED_SCHEMES or not self.storedSchemes[slot]:
+            return proto.STATUS_INVALID_VALUE
+
+        self.schemes    = self.storedSchemes[slot]
+        self.activeSlot = slot
+
+        # first chamber is selected right away
+        self.dio = self.schemes[0]['dio'] & 0x1F
+
+        return proto.STATUS_OK
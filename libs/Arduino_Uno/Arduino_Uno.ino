@@ -45,6 +45,36 @@
 #define INTERVAL_BYTES                4
 #define CHAMBER_BYTE_STREAM_LEN       (DIO_LINE_BYTES + SWITCH_BYTES + INTERVAL_BYTES)
 #define MAX_NUM_SWITCHES              64
+#define MAX_STORED_SCHEMES            4       // switching schemes which can be kept on the board and activated by their slot
+
+/* --- BINARY PROTOCOL --- */
+// frame: SYNC0 SYNC1 LEN_H LEN_L OPCODE PAYLOAD[LEN] CRC_H CRC_L
+// CRC16-CCITT (poly 0x1021, init 0xFFFF) over LEN_H..PAYLOAD, see ArduinoProtocol.py
+#define SYNC0                         0xAA
+#define SYNC1                         0x55
+#define REPLY_FLAG                    0x80
+#define RX_IDLE_TIMEOUT               20      // ms without new bytes after which an incomplete frame is dropped
+
+#define OP_CAMERA                     0x01
+#define OP_DEBUG                      0x02
+#define OP_GETVERSION                 0x03
+#define OP_SETELECTRODES              0x05
+#define OP_SETDIO                     0x06
+#define OP_SETFRAMERATE               0x07
+#define OP_START                      0x08
+#define OP_STOP                       0x09
+#define OP_TEST                       0x0A
+#define OP_TILT                       0x0B
+#define OP_TILTER                     0x0C
+#define OP_STORESCHEME                0x0D
+#define OP_ACTIVATESCHEME             0x0E
+
+#define STATUS_OK                     0x00
+#define STATUS_CRC                    0x01
+#define STATUS_LENGTH                 0x02
+#define STATUS_UNKNOWN                0x03
+#define STATUS_INVALID_VALUE          0x04
+#define STATUS_NO_MEMORY              0x05
 
 
 /* --- SWITCHING SCHEMES --- */
@@ -112,12 +142,28 @@ uint32_t stopTimerDaisy;
 uint32_t daisyTimeFrame      = (uint32_t)(1e6/daisyFrameRate);
 uint8_t  chamberIdx          = 0;
 
+/* --- STORED SWITCHING SCHEMES --- */
+struct   SwitchingScheme *storedSchemes[MAX_STORED_SCHEMES] = {NULL};   // userSwitchingScheme points to the active slot
+uint8_t  numStoredSchemes[MAX_STORED_SCHEMES] = {0};
+int8_t   activeSchemeSlot    = -1;
+
 /* --- TILTER STUFF --- */
 uint8_t tilterTrigHigh = 100;        // high time of trigger pulse in us
 bool tiltPlatform = false;
 
 bool startMeas = false;
 
+/* --- BINARY PROTOCOL --- */
+enum RxState {RX_SYNC0, RX_SYNC1, RX_LEN_H, RX_LEN_L, RX_OPCODE, RX_PAYLOAD, RX_CRC_H, RX_CRC_L};
+
+RxState  rxState     = RX_SYNC0;
+uint16_t rxLen       = 0;             // payload length of the current frame
+uint16_t rxIdx       = 0;             // payload bytes received so far, payload is stored in data[]
+uint8_t  rxOpcode    = 0;
+uint16_t rxCrc       = 0;             // CRC calculated locally
+uint16_t rxRemoteCrc = 0;             // CRC from the frame
+uint32_t rxLastByte  = 0;             // millis() when the last byte of a frame was received
+
 /* --- BENCHMARKING --- */
 //uint32_t startTime = 0;
 //uint32_t endTime = 0;
@@ -156,6 +202,12 @@ void setup() {
 
 void loop() {
 
+  // drop an incomplete frame once the line is idle, e.g. after a corrupted LEN,
+  // so the next frame of the host is received from its sync bytes again
+  if (rxState != RX_SYNC0 && !Serial.available() && (millis() - rxLastByte) > RX_IDLE_TIMEOUT) {
+    rxState = RX_SYNC0;
+  }
+
   if (startMeas) {
     
     // trigger ThorLabs camera with certain frame rate
@@ -229,6 +281,358 @@ bool FindKeyword(const char *const data, const char *const keyword, const uint16
 
 void serialEvent() {
 
+  // binary frames start with the sync byte, everything else is treated as ASCII command
+  if (rxState == RX_SYNC0 && Serial.peek() != SYNC0) {
+    asciiSerialEvent();
+    return;
+  }
+
+  // handle binary frames byte by byte, incomplete frames are continued with the next event
+  while (Serial.available()) {
+    processBinaryByte( (uint8_t)Serial.read() );
+    rxLastByte = millis();
+
+    // leave remaining bytes to the next event, might be an ASCII command
+    if (rxState == RX_SYNC0) {
+      break;
+    }
+  }
+}
+
+uint16_t crc16Update(uint16_t crc, uint8_t b) {
+  // CRC16-CCITT, poly 0x1021
+  
+  crc ^= (uint16_t)b << 8;
+  
+  for (uint8_t i = 0; i < 8; ++i) {
+    crc = (crc & 0x8000) ? ((crc << 1) ^ 0x1021) : (crc << 1);
+  }
+  
+  return crc;
+}
+
+void processBinaryByte(uint8_t b) {
+  // state machine for receiving binary frames
+  
+  switch (rxState) {
+    case RX_SYNC0:
+      if (b == SYNC0) {
+        rxState = RX_SYNC1;
+      }
+      break;
+      
+    case RX_SYNC1:
+      rxState = (b == SYNC1) ? RX_LEN_H : RX_SYNC0;
+      break;
+      
+    case RX_LEN_H:
+      rxCrc   = crc16Update(0xFFFF, b);
+      rxLen   = (uint16_t)b << 8;
+      rxState = RX_LEN_L;
+      break;
+      
+    case RX_LEN_L:
+      rxCrc    = crc16Update(rxCrc, b);
+      rxLen   |= b;
+      rxState  = RX_OPCODE;
+      break;
+      
+    case RX_OPCODE:
+      rxCrc    = crc16Update(rxCrc, b);
+      rxOpcode = b;
+      rxIdx    = 0;
+      
+      if (rxLen > MAX_DATA_LENGTH) {
+        sendReply(rxOpcode, STATUS_LENGTH, NULL);
+        rxState = RX_SYNC0;
+      }
+      else {
+        rxState = rxLen ? RX_PAYLOAD : RX_CRC_H;
+      }
+      break;
+      
+    case RX_PAYLOAD:
+      rxCrc         = crc16Update(rxCrc, b);
+      data[rxIdx++] = b;
+      
+      if (rxIdx == rxLen) {
+        rxState = RX_CRC_H;
+      }
+      break;
+      
+    case RX_CRC_H:
+      rxRemoteCrc = (uint16_t)b << 8;
+      rxState     = RX_CRC_L;
+      break;
+      
+    case RX_CRC_L:
+      rxRemoteCrc |= b;
+      rxState      = RX_SYNC0;
+      
+      if (rxRemoteCrc == rxCrc) {
+        executeBinaryCommand(rxOpcode, (const uint8_t *)data, rxLen);
+      }
+      else {
+        sendReply(rxOpcode, STATUS_CRC, NULL);
+      }
+      break;
+  }
+}
+
+void sendReply(uint8_t opcode, uint8_t status, const char *text) {
+  // answer to binary command: status byte followed by optional text
+  
+  uint16_t textLen = text ? strlen(text) : 0;
+  uint16_t len     = 1 + textLen;
+  uint8_t  header[] = {SYNC0, SYNC1, (uint8_t)(len >> 8), (uint8_t)(len & 0xFF), (uint8_t)(opcode | REPLY_FLAG), status};
+  uint16_t crc     = 0xFFFF;
+  
+  for (uint8_t i = 2; i < SIZE_OF_ARRAY(header); ++i) {
+    crc = crc16Update(crc, header[i]);
+  }
+  for (uint16_t i = 0; i < textLen; ++i) {
+    crc = crc16Update(crc, (uint8_t)text[i]);
+  }
+  
+  Serial.write(header, SIZE_OF_ARRAY(header));
+  
+  if (textLen) {
+    Serial.write((const uint8_t *)text, textLen);
+  }
+  
+  Serial.write((uint8_t)(crc >> 8));
+  Serial.write((uint8_t)(crc & 0xFF));
+}
+
+void executeBinaryCommand(uint8_t opcode, const uint8_t *payload, uint16_t len) {
+  // same commands as the ASCII ones, values are passed as bytes
+  
+  uint8_t status = STATUS_OK;
+  
+  switch (opcode) {
+    case OP_CAMERA:
+    case OP_DEBUG:
+    case OP_SETDIO:
+    case OP_SETFRAMERATE:
+    case OP_TILTER:
+      // all of them expect exactly one value byte
+      if (len != 1) {
+        sendReply(opcode, STATUS_LENGTH, NULL);
+        return;
+      }
+      
+      if (opcode == OP_CAMERA) {
+        triggerCamera = payload[0] != 0;
+      }
+      else if (opcode == OP_DEBUG) {
+        debugMode = payload[0] != 0;
+        sendReply(opcode, STATUS_OK, debugMode ? "Debug mode ON" : "Debug mode OFF");
+        return;
+      }
+      else if (opcode == OP_SETDIO) {
+        updateHf2DioLines(payload[0]);
+      }
+      else if (opcode == OP_SETFRAMERATE) {
+        if (payload[0]) {
+          cameraFrameRate = payload[0];
+          cameraTimeFrame = 1e6/cameraFrameRate;
+        }
+        else {
+          status = STATUS_INVALID_VALUE;
+        }
+      }
+      else if (opcode == OP_TILTER) {
+        tiltPlatform = payload[0] != 0;
+      }
+      break;
+      
+    case OP_GETVERSION:
+      sendReply(opcode, STATUS_OK, "Arduino Uno, ArduinoHandler V0.7");
+      return;
+      
+    case OP_SETELECTRODES:
+      // number of schemes followed by the byte stream of all schemes
+      if (len < 1 || len != 1 + (uint16_t)payload[0] * CHAMBER_BYTE_STREAM_LEN) {
+        status = STATUS_LENGTH;
+      }
+      else {
+        // stored in the first slot and selected right away
+        status = storeSwitchingSchemes(0, payload[0], &payload[1]);
+        
+        if (status == STATUS_OK) {
+          status = activateSwitchingScheme(0);
+        }
+      }
+      break;
+      
+    case OP_STORESCHEME:
+      // slot, number of schemes and the byte stream of all schemes, same layout as for OP_SETELECTRODES
+      if (len < 2 || len != 2 + (uint16_t)payload[1] * CHAMBER_BYTE_STREAM_LEN) {
+        status = STATUS_LENGTH;
+      }
+      else {
+        status = storeSwitchingSchemes(payload[0], payload[1], &payload[2]);
+      }
+      break;
+      
+    case OP_ACTIVATESCHEME:
+      // slot of a previously stored scheme
+      if (len != 1) {
+        status = STATUS_LENGTH;
+      }
+      else {
+        status = activateSwitchingScheme(payload[0]);
+      }
+      break;
+      
+    case OP_START:
+      startSwitching();
+      break;
+      
+    case OP_STOP:
+      startMeas = false;
+      break;
+      
+    case OP_TEST:
+      for (int blinkCnt = 0; blinkCnt < 5; ++blinkCnt) {
+        blinkingScheme();
+      }
+      sendReply(opcode, STATUS_OK, "INFO: Test was executed.");
+      return;
+      
+    case OP_TILT:
+      if (tiltPlatform) {
+        TILTING_TRIGGER_PULSE;
+      }
+      break;
+      
+    default:
+      status = STATUS_UNKNOWN;
+  }
+  
+  sendReply(opcode, status, NULL);
+}
+
+uint8_t storeSwitchingSchemes(uint8_t slot, uint8_t num, const uint8_t *stream) {
+  /* Store num switching schemes from the byte stream in the given slot, CHAMBER_BYTE_STREAM_LEN bytes per scheme:
+   *  - 2 bytes active switches
+   *  - 1 byte for HF2 DIO line coding
+   *  - 4 bytes waiting time in us after the chamber was selected (max. 1.19 h).
+   * The schemes are used after activateSwitchingScheme was called for the slot.
+   */
+  
+  uint32_t valBuf;
+  
+  if (slot >= MAX_STORED_SCHEMES || num == 0 || num >= ( MAX_DATA_LENGTH / CHAMBER_BYTE_STREAM_LEN )) {
+    return STATUS_INVALID_VALUE;
+  }
+
+  // stop timer ... otherwise data structure might be messed up
+  // just enable when you encounter problems
+  // does not allow you to switch electrode pairs while timer is enabled
+  // could be fixed by another variable that stores the initial value and rewrites it at the end of this function
+  //startMeas = false;
+  
+  // slot is in use by the loop, stop switching till it gets activated again
+  if (slot == activeSchemeSlot) {
+    userSwitchingScheme = NULL;
+    chamberIdx          = 0;
+    numSwitchingSchemes = 0;
+    activeSchemeSlot    = -1;
+  }
+  
+  // check if old data is available, delete it first
+  if (storedSchemes[slot] != NULL) {
+    delete [] storedSchemes[slot];
+    
+    storedSchemes[slot]    = NULL;
+    numStoredSchemes[slot] = 0;
+  }
+  
+  // allocate array with given size for storing bytes accordingly
+  storedSchemes[slot] = new struct SwitchingScheme[num];
+  
+  // only proceed if sucessfully allocated
+  if (storedSchemes[slot] == NULL) {
+    return STATUS_NO_MEMORY;
+  }
+  
+  // update number of electrode pairs, if successful
+  numStoredSchemes[slot] = num;
+
+  // store bytes for each chamber setup accordingly
+  for (uint8_t schemeIdx = 0; schemeIdx < num; ++schemeIdx) {
+
+    const uint8_t *scheme = &stream[schemeIdx * CHAMBER_BYTE_STREAM_LEN];
+    struct SwitchingScheme *target = &storedSchemes[slot][schemeIdx];
+    
+    // first bytes for the switches
+    for (byteIdx = 0; byteIdx < SWITCH_BYTES; ++byteIdx) {
+      target->activeSwitches[byteIdx] = scheme[byteIdx];   // max 255 switches possible
+    }
+    
+    // DIO lines are always stored after the switch bytes
+    target->hf2DioByte = scheme[SWITCH_BYTES];
+
+    // make sure nothing strange is in the memory
+    target->chamberInterval = 0;
+    
+    // multiplying with pow is too imprecise
+    for (byteIdx = 0; byteIdx < INTERVAL_BYTES; ++byteIdx) {
+      valBuf = scheme[DIO_LINE_BYTES + SWITCH_BYTES + byteIdx];
+      
+      target->chamberInterval += valBuf << (8 * (INTERVAL_BYTES-byteIdx-1));
+    }
+  }
+  
+  return STATUS_OK;
+}
+
+uint8_t activateSwitchingScheme(uint8_t slot) {
+  /* Use the schemes stored in the given slot, the first chamber is selected right away.
+   * In case the measurement is running, switching continues with the new schemes.
+   */
+  
+  if (slot >= MAX_STORED_SCHEMES || storedSchemes[slot] == NULL) {
+    return STATUS_INVALID_VALUE;
+  }
+  
+  userSwitchingScheme = storedSchemes[slot];
+  numSwitchingSchemes = numStoredSchemes[slot];
+  activeSchemeSlot    = slot;
+
+  // select the first chamber right away
+  chamberIdx = 0;
+  writeDaisyChain();
+  updateHf2DioLines(userSwitchingScheme[chamberIdx].hf2DioByte);
+  
+  // first chamber gets its full residence time
+  startTimerDaisy = micros();
+  
+  return STATUS_OK;
+}
+
+void startSwitching() {
+  // Start switching chambers (with camera triggering and/or tilting, depending on the setup).
+
+  startMeas = true;
+  
+  // select the first chamber
+  if (chamberIdx != 0) {
+    chamberIdx = 0;
+    writeDaisyChain();
+    updateHf2DioLines(userSwitchingScheme[chamberIdx].hf2DioByte);
+  }
+  
+  // start timers...
+  startTimerCamera = micros();
+  startTimerDaisy  = startTimerCamera;
+}
+
+
+
+void asciiSerialEvent() {
+
   value       = 0;
   dataIdx     = 0;
   headerFound = false;
@@ -340,7 +744,7 @@ void serialEvent() {
       }
 // -----------------------------------------------------------------------------
       else if (!strcmp(commandString, "getversion")) {
-        Serial.println("Arduino Uno, ArduinoHandler V0.5");
+        Serial.println("Arduino Uno, ArduinoHandler V0.7");
       }
 // -----------------------------------------------------------------------------
       else if (!strcmp(commandString, "help")) {
@@ -363,92 +767,35 @@ void serialEvent() {
         */
         
         
-        // calc incrementers and offsets for easy counting
-        uint8_t dioOffset      = SWITCH_BYTES;
-        uint8_t intervalOffset = DIO_LINE_BYTES + SWITCH_BYTES;
-    
-        uint16_t inDioIdx;
-        uint16_t inByteIdx;
-        uint16_t inResIdx;
-    
-        uint32_t valBuf;
-
         // cut value from stream
         valueString = strtok( NULL, delimiter );
 
-        if (sscanf(valueString, "%d", &value)) {
-          if ( value > 0 && value < ( MAX_DATA_LENGTH / CHAMBER_BYTE_STREAM_LEN ) ) {
-    
-            // stop timer ... otherwise data structure might be messed up
-            // just enable when you encounter problems
-            // does not allow you to switch electrode pairs while timer is enabled
-            // could be fixed by another variable that stores the initial value and rewrites it at the end of this function
-            //startMeas = false;
-            
-            // check if old data is available, delete it first
-            if (userSwitchingScheme != NULL) {
-              delete [] userSwitchingScheme;
-              
-              userSwitchingScheme = NULL;
-              chamberIdx          = 0;
-              numSwitchingSchemes = 0;
-            }
-            
-            // allocate array with given size for storing bytes accordingly
-            userSwitchingScheme = new struct SwitchingScheme[value];
-            
-            // only proceed if sucessfully allocated
-            if (userSwitchingScheme != NULL) {
-            
-              // update number of electrode pairs, if successful
-              numSwitchingSchemes = value;
-
-              // calculate byte stream offset, so where in the whole data stream start the byte stream
-              // NOTE: since valueString points to the beginning of the string we need to add the lenght and +1 cause there is a space character
-              uint8_t byteStreamOffset = valueString - data + strlen(valueString) + 1;
-            
-              // store bytes for each chamber setup accordingly
-              for (chamberIdx = 0; chamberIdx < numSwitchingSchemes; ++chamberIdx) {
-    
-                inByteIdx = byteStreamOffset + chamberIdx * CHAMBER_BYTE_STREAM_LEN;
-                inDioIdx  = byteStreamOffset + chamberIdx * CHAMBER_BYTE_STREAM_LEN + dioOffset;
-                inResIdx  = byteStreamOffset + chamberIdx * CHAMBER_BYTE_STREAM_LEN + intervalOffset;
-                
-                // first bytes for the switches
-                for (byteIdx = 0; byteIdx < SWITCH_BYTES; ++byteIdx) {
-                  userSwitchingScheme[chamberIdx].activeSwitches[byteIdx] = (uint8_t)(data[inByteIdx+byteIdx]);   // max 255 switches possible
-                }
-                
-                // DIO lines are always stored after the switch bytes
-                userSwitchingScheme[chamberIdx].hf2DioByte = data[inDioIdx];
-    
-                //Serial.println(data[inDioIdx]);
-    
-                // make sure nothing strange is in the memory
-                userSwitchingScheme[chamberIdx].chamberInterval = 0;
-                
-                // multiplying with pow is too imprecise
-                for (byteIdx = 0; byteIdx < INTERVAL_BYTES; ++byteIdx) {
-                  valBuf = data[inResIdx+byteIdx];
-                  
-                  for (uint8_t shiftIdx = 0; shiftIdx < INTERVAL_BYTES-byteIdx-1; ++shiftIdx) {
-                    valBuf = (valBuf << 8);
-                  }
-                  userSwitchingScheme[chamberIdx].chamberInterval += valBuf;
-                }
-              }
-            
-            // select the first chamber right away
-            chamberIdx = 0;
-            writeDaisyChain();
-            updateHf2DioLines(userSwitchingScheme[chamberIdx].hf2DioByte);
-            }
-            else {
-            Serial.println("ERROR: Could not allocate memory for storing switching scheme!");
-            }
+        // number of chambers is parsed as int, values which don't fit into a byte are rejected instead of wrapping around
+        int numChambers = 0;
+        
+        if (sscanf(valueString, "%d", &numChambers)) {
+          
+          // calculate byte stream offset, so where in the whole data stream start the byte stream
+          // NOTE: since valueString points to the beginning of the string we need to add the lenght and +1 cause there is a space character
+          uint16_t byteStreamOffset = valueString - data + strlen(valueString) + 1;
+          
+          uint8_t status = STATUS_INVALID_VALUE;
+          
+          if (numChambers > 0 && numChambers <= UINT8_MAX) {
+            status = storeSwitchingSchemes(0, (uint8_t)numChambers, (const uint8_t *)&data[byteStreamOffset]);
           }
-          else {
-            Serial.println("ERROR: Given number of bytes is invalid.");
+          
+          if (status == STATUS_OK) {
+            status = activateSwitchingScheme(0);
+          }
+          
+          switch (status) {
+            case STATUS_INVALID_VALUE:
+              Serial.println("ERROR: Given number of bytes is invalid.");
+              break;
+            case STATUS_NO_MEMORY:
+              Serial.println("ERROR: Could not allocate memory for storing switching scheme!");
+              break;
           }
         }
         else {
@@ -490,19 +837,7 @@ void serialEvent() {
 // -----------------------------------------------------------------------------
       else if (!strcmp(commandString, "start")) {
         // Start switching chambers (with camera triggering and/or tilting, depending on the setup).
-    
-        startMeas = true;
-        
-        // select the first chamber
-        if (chamberIdx != 0) {
-          chamberIdx = 0;
-          writeDaisyChain();
-          updateHf2DioLines(userSwitchingScheme[chamberIdx].hf2DioByte);
-        }
-        
-        // start timers...
-        startTimerCamera = micros();
-        startTimerDaisy  = startTimerCamera;
+        startSwitching();
       }
 // -----------------------------------------------------------------------------
       else if (!strcmp(commandString, "stop")) {
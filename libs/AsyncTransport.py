@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:20:31 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import asyncio
+import threading
+import concurrent.futures as futures
+
+try:
+    from libs.ComDevice import FrameBuffer
+except ImportError:
+    from ComDevice import FrameBuffer
+
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+
+
+class AsyncTransport:
+    ''' asyncio transport on top of the serial port of a ComDevice.
+        Incoming bytes are read when the event loop reports the port as readable
+        (loop.add_reader), cut into frames at the delimiter (or by findEnd, see FrameBuffer)
+        and queued for Request and Stream.
+        NOTE: while the transport is open it holds the port (see ComDevice.HoldPort)
+              and is the only reader, stop threaded readers of the device before
+        NOTE: Open and Close have to be called from the event loop thread
+        NOTE: blocking writes and requests of the device are routed through the transport
+              (see ComDevice.AttachTransport), they must not be called from the event loop thread
+    '''
+
+    # in case the port has no file descriptor, e.g. on Windows
+    __pollInterval__ = 1e-3
+
+    # max seconds a blocking write of another thread waits for the event loop
+    __sendTimeout__  = 5.
+
+    def __init__(self, comDevice, delimiter=b'\n', loop=None, findEnd=None):
+
+        self._comDevice   = comDevice
+        self._loop        = loop
+        self._frameBuffer = FrameBuffer(delimiter, findEnd=findEnd)
+        self._frames      = None
+        self._reply       = None     # future of the running Request, takes the next frame
+        self._requestLock = None
+        self._fd          = None
+        self._pollTask    = None
+        self._isOpen      = False
+        self._loopThread  = None
+        
+        # writing blocks, so it is done by a single thread, which keeps the order of the writes
+        self._writer      = None
+
+### --------------------------------------------------------------------------------------------------
+
+    def Open(self):
+
+        if self._isOpen:
+            return True
+
+        if not self._comDevice.HoldPort():
+            return False
+
+        if not self._loop:
+            self._loop = asyncio.get_event_loop()
+
+        # created here, so they belong to the running loop
+        self._frames      = asyncio.Queue()
+        self._requestLock = asyncio.Lock()
+
+        self._frameBuffer.Clear()
+
+        self._loopThread = threading.current_thread()
+        self._writer     = futures.ThreadPoolExecutor(max_workers=1)
+
+        try:
+            self._fd = self._comDevice.comPort.fileno()
+            self._loop.add_reader(self._fd, self._OnReadable)
+        except (AttributeError, NotImplementedError, OSError):
+            # no file descriptor or loop does not support readers
+            self._fd       = None
+            self._pollTask = self._loop.create_task(self._Poll())
+
+        self._isOpen = True
+
+        self._comDevice.AttachTransport(self)
+
+        return True
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        if not self._isOpen:
+            return
+
+        self._isOpen = False
+
+        self._comDevice.DetachTransport()
+
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+        if self._pollTask:
+            self._pollTask.cancel()
+            self._pollTask = None
+
+        # stops running streams
+        self._frames.put_nowait(None)
+
+        # pending writes are still done, but nobody waits for them
+        self._writer.shutdown(wait=False)
+        self._writer = None
+
+        self._comDevice.ReleasePort()
+
+### --------------------------------------------------------------------------------------------------
+
+    def IsOpen(self):
+        return self._isOpen
+
+### --------------------------------------------------------------------------------------------------
+
+    async def Send(self, data):
+        ''' Write data to the port, returns False in case it failed
+        '''
+
+        if not self._isOpen:
+            return False
+
+        try:
+            await self._loop.run_in_executor(self._writer, self._comDevice.comPort.write, data)
+        except OSError:
+            coreUtils.SafeLogger('error', 'Could not write: \'%s\'!' % data, self._comDevice)
+            return False
+
+        return True
+
+### --------------------------------------------------------------------------------------------------
+
+    async def Request(self, data, timeout=1.):
+        ''' Send data and wait for the next frame, it is not handed over to Stream.
+            Returns the frame (without delimiter) or None after timeout seconds.
+        '''
+
+        async with self._requestLock:
+
+            # the answer is not handed over to Stream, frames which arrived before are
+            self._reply = self._loop.create_future()
+
+            try:
+                if not await self.Send(data):
+                    return None
+
+                return await asyncio.wait_for(self._reply, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._reply = None
+
+### --------------------------------------------------------------------------------------------------
+
+    def SendFromThread(self, data):
+        ''' Blocking Send for any thread except the one of the event loop
+        '''
+        return self._RunFromThread( self.Send(data), self.__sendTimeout__ )
+
+### --------------------------------------------------------------------------------------------------
+
+    def RequestFromThread(self, data, timeout=1.):
+        ''' Blocking Request for any thread except the one of the event loop
+        '''
+        return self._RunFromThread( self.Request(data, timeout), timeout + self.__sendTimeout__ )
+
+### --------------------------------------------------------------------------------------------------
+
+    def _RunFromThread(self, coro, timeout):
+        ''' Returns the result of coro or None in case the transport was closed or the loop did not answer in time
+        '''
+
+        # waiting here would block the loop which has to run coro
+        if threading.current_thread() is self._loopThread:
+            coro.close()
+            raise Exception('Blocking serial I/O from the event loop thread, use ParaLyzerCore.RunBlocking!')
+
+        if not self._isOpen:
+            coro.close()
+            return None
+
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+        except RuntimeError:
+            # loop was closed meanwhile
+            coro.close()
+        except futures.TimeoutError:
+            coreUtils.SafeLogger('error', 'Event loop did not handle serial I/O in time!', self._comDevice)
+
+        return None
+
+### --------------------------------------------------------------------------------------------------
+
+    async def Stream(self):
+        ''' Asynchronous generator over incoming frames, ends when the transport is closed
+        '''
+
+        while self._isOpen:
+
+            frame = await self._frames.get()
+
+            if frame is None:
+                break
+
+            yield frame
+
+### --------------------------------------------------------------------------------------------------
+
+    def _OnReadable(self):
+
+        port = self._comDevice.comPort
+
+        try:
+            numBytes = port.in_waiting
+
+            if numBytes:
+                self._frameBuffer.ReadInto(port, numBytes)
+
+        except OSError:
+            coreUtils.SafeLogger('error', 'Could not read from serial port!', self._comDevice)
+            self.Close()
+            return
+
+        for frame in self._frameBuffer.PopFrames():
+
+            self._comDevice.OnTransportFrame(frame)
+
+            if self._reply and not self._reply.done():
+                self._reply.set_result(frame)
+            else:
+                self._frames.put_nowait(frame)
+
+### --------------------------------------------------------------------------------------------------
+
+    async def _Poll(self):
+
+        while self._isOpen:
+            self._OnReadable()
+            await asyncio.sleep(self.__pollInterval__)
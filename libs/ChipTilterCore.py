@@ -5,9 +5,11 @@ Created on Wed Apr 26 09:49:58 2017
 @author: Martin Leonhardt (martin.leonhardt87@gmail.com)
 """
 
+import re
 import threading
 
-from time import sleep
+from time import sleep, monotonic
+from collections import OrderedDict
 
 # in case this guy is used somewhere else
 # we need different loading of modules
@@ -16,6 +18,16 @@ try:
 except ImportError:
     from CoreDevice import CoreDevice
     
+try:
+    from libs.ComDevice import FrameBuffer
+except ImportError:
+    from ComDevice import FrameBuffer
+    
+try:
+    from libs.EventScheduler import EventScheduler
+except ImportError:
+    from EventScheduler import EventScheduler
+    
 try:
     from libs import coreUtilities as coreUtils
 except ImportError:
@@ -63,6 +75,10 @@ class ChipTilterCore(CoreDevice):
         
     # parameters received from the tilter
     __parameters__ = ['ID', 'A+', 'A-', 'M+', 'M-', 'm', 'P+', 'P-', 'p', 'H', 'T', 't', 'S']
+    
+    # fields of the parameter message, e.g. 'A+65', separated by ';'
+    # keys have to match the whole field name, so unknown fields like 'Sp3' are skipped
+    __parameterPattern__ = re.compile( r'(?:^|;)\s*(%s)\s*(-?\d+)\s*(?=;|$)' % '|'.join( map(re.escape, sorted(__parameters__, key=len, reverse=True)) ) )
 
     # supported events for callback functions
     __supportedEvents__ = ['onPosDown', 'onPosUp', 'onNegDown', 'onNegUp', 'onPosWait', 'onNegWait']
@@ -76,6 +92,31 @@ class ChipTilterCore(CoreDevice):
     # define number for force writing
     __numForces__ = 3
     
+    # reported parameters for confirming written registers
+    # parameters made up of two registers are reported as MMSS or HHMM
+    __confirmParameters__ = {
+            'A+': ['posAngle'],
+            'A-': ['negAngle'],
+            'M+': ['posMotion'],
+            'M-': ['negMotion'],
+            'P+': ['posPauseMin', 'posPauseSec'],
+            'P-': ['negPauseMin', 'negPauseSec'],
+            'H' : ['horPauseMin', 'horPauseSec'],
+            'T' : ['totTimeHrs' , 'totTimeMin' ]
+        }
+    
+    # parameters are reported every 2 s
+    __reportTimeout__ = 3
+    
+    # a report might have been on its way while writing, so wait for another one before writing again
+    __reportsPerAttempt__ = 2
+    
+    # max. seconds the reading thread blocks for incoming bytes, before checking if it should stop
+    __readTimeout__ = 0.1
+    
+    # threads for running event callbacks
+    __eventWorkers__ = 4
+    
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def __init__(self, **flags):
@@ -84,7 +125,9 @@ class ChipTilterCore(CoreDevice):
         self._isReading       = False
         self._inMessageThread = None
         self._isTilting       = False
-        self._eventThreads    = {}          # contains a list of event threads that are started in parallel
+        
+        # runs event callbacks, so reading is never blocked by them
+        self._eventScheduler  = EventScheduler(self.__eventWorkers__, 'TilterEvents', self)
         
         # structure with default values
         self._setup = self._GetDefaultSetup()
@@ -94,8 +137,8 @@ class ChipTilterCore(CoreDevice):
         # in case multiple setups have to be written
         self._setups = []
         
-        # list for messages received from the tilter
-        self._inMessageQueue = []
+        # messages received from the tilter are framed by '#'
+        self._frameBuffer = FrameBuffer(b'#')
         
         # for counting the performed cycles and detecting the position
         self._tilterState = self._GetDefaultTilterState()
@@ -104,8 +147,15 @@ class ChipTilterCore(CoreDevice):
         # internally handled as list to enable multiple function calls for one event (see SetEventHandler)
         self._tilterEvents = self._GetDefaultEventDescriptors()
         
+        # arrival time (monotonic clock) of the message which triggered the event last
+        self._eventTimes = {}
+        
         self._currentParameterSet = self._GetDefaultParameterSet()
         
+        # signals parameter reports to the batched writer
+        self._reportCondition = threading.Condition()
+        self._numReports      = 0
+        
         
         flags['initAfterDetectFunc'] = self.StartInMessageThread
         
@@ -117,6 +167,8 @@ class ChipTilterCore(CoreDevice):
         
         self.StopInMessageThread()
         
+        self._eventScheduler.Close(wait=False)
+        
         CoreDevice.__del__(self)
         
         
@@ -173,6 +225,9 @@ class ChipTilterCore(CoreDevice):
         
         if not byteStream:
             byteStream = self._setup['byteStream']
+            
+        if mode == 'batch':
+            return self.WriteSetupBatched(byteStream)
         
         if self.SafeOpenComPort():
             
@@ -193,6 +248,143 @@ class ChipTilterCore(CoreDevice):
             
         return success
     
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def WriteSetupBatched(self, byteStream=None):
+        ''' Sends all register frames at once and confirms them with the parameter report of the tilter.
+            Registers already reported with the requested value are skipped, only unconfirmed ones are
+            written again (up to __numForces__ times).
+            Falls back to normal writing when no reports are read.
+        '''
+        
+        if not byteStream:
+            byteStream = self._setup['byteStream']
+            
+        # reports are only available while the in message thread is running
+        if not self._isReading:
+            self.logger.debug('No parameter reports available, write setup stream by stream.')
+            return self.WriteSetup(byteStream, 'normal')
+        
+        # last value of a register wins
+        registers = OrderedDict()
+        
+        for b in byteStream:
+            register, value = self._DecodeByteStream(b)
+            
+            if not register:
+                self.logger.error('Unknown tilter address in %s!' % coreUtils.GetTextFromByteStream(b))
+                return False
+            
+            registers[register] = value
+            
+        confirmable = [r for group in self.__confirmParameters__.values() for r in group]
+        
+        # registers without report are just written once
+        unconfirmed = [r for r in registers if r not in confirmable]
+        
+        expected = self._GetExpectedParameters(registers)
+        pending  = { p: v for p, v in expected.items() if self._currentParameterSet[p] != v }
+        
+        self.logger.debug('Skip confirmed parameters: %s' % [p for p in expected if p not in pending])
+        
+        for attempt in range(self.__numForces__):
+            
+            toWrite = unconfirmed + [r for p in pending for r in self.__confirmParameters__[p] if r in registers]
+            
+            if not toWrite:
+                break
+            
+            with self._reportCondition:
+                numReports = self._numReports
+            
+            stream = b''.join( self.GenerateByteStream(self.__addresses__[r], registers[r]) for r in toWrite )
+            
+            # port belongs to the in message thread, leave it open
+            if not self.SafeWriteToComPort(stream, leaveOpen=True):
+                return False
+            
+            self.logger.debug( 'Sent %s to tilter' % coreUtils.GetTextFromByteStream(stream) )
+            
+            unconfirmed = []
+            
+            for _ in range(self.__reportsPerAttempt__):
+                
+                numReports += 1
+                
+                if not self._WaitForReport(numReports):
+                    break
+                
+                pending = { p: v for p, v in pending.items() if self._currentParameterSet[p] != v }
+                
+                if not pending:
+                    break
+            
+        if pending:
+            self.logger.error('Tilter did not confirm %s!' % ', '.join(sorted(pending)))
+            return False
+        
+        self.logger.info('Tilter setup updated.')
+        
+        return True
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _DecodeByteStream(self, b):
+        ''' returns register name and value of a stream generated by GenerateByteStream
+        '''
+        
+        for register, address in self.__addresses__.items():
+            if int(address[0], 16) == b[0] and int(address[1], 16) == b[1]:
+                return register, b[2]
+            
+        return None, None
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _GetExpectedParameters(self, registers):
+        ''' parameter values the tilter should report after writing the registers
+        '''
+        
+        expected = {}
+        
+        for param, group in self.__confirmParameters__.items():
+            
+            if not any(r in registers for r in group):
+                continue
+            
+            reported = self._currentParameterSet[param]
+            value    = 0
+            
+            for idx, register in enumerate(group):
+                
+                scale = 100 ** (len(group)-idx-1)
+                
+                # keep reported value of registers which are not written
+                if register in registers:
+                    digits = registers[register]
+                elif reported >= 0:
+                    digits = (reported // scale) % 100
+                else:
+                    digits = 0
+                    
+                value += digits * scale
+                
+            expected[param] = value
+            
+        return expected
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _WaitForReport(self, numReports, timeout=None):
+        ''' wait till numReports parameter reports were received, False after timeout
+        '''
+        
+        if timeout is None:
+            timeout = self.__reportTimeout__
+        
+        with self._reportCondition:
+            return self._reportCondition.wait_for(lambda: self._numReports >= numReports or not self._isReading, timeout) and self._isReading
+    
 ### -------------------------------------------------------------------------------------------------------------------------------
 
     def _GetResetStream(self):
@@ -246,153 +438,184 @@ class ChipTilterCore(CoreDevice):
 ### -------------------------------------------------------------------------------------------------------------------------------
 
     def ReadStream(self):
+        ''' Reads the messages of the tilter as soon as they arrive.
+            Blocks until bytes are waiting instead of sleeping, so events are triggered right away.
+        '''
         
-        if self.SafeOpenComPort():
+        # writing setups or starting/stopping the tilter must not close the port meanwhile
+        if self.HoldPort():
             
             # reset tilter state for new run
             self._tilterState = self._GetDefaultTilterState()
+            self._eventTimes  = {}
+            self._frameBuffer.Clear()
             
             while self._isReading:
                 
-                # after splitting last entry in list is always emtpy, if character was in stream
-                # check for this, otherwise wait for new input
-                inMsg = self.SafeReadFromComPort('line', decode=True, leaveOpen=True)
-                
-                if len(inMsg) != 0:
-                    self.HandleInMessageQueue(inMsg)
+                # port might have been closed anyways, e.g. after an error
+                if not self.comPort.isOpen() and not self.SafeOpenComPort():
+                    sleep(self.__readTimeout__)
+                    
+                # returns after __readTimeout__ at the latest, so stopping the loop is still possible
+                elif self._WaitForIncomingBytes(self.__readTimeout__):
+                    
+                    # time stamp of the messages, before reading takes place
+                    arrival = monotonic()
+                    
+                    inMsg = self.SafeReadFromComPort('waiting', leaveOpen=True)
+                    
+                    if len(inMsg) != 0:
+                        self.HandleInMessageQueue(inMsg, arrival)
                     
                 # there must be something wrong with the serial port
                 # kill task...
                 elif not self.comPortStatus:
                     self._isReading = False
-                        
+                    
+            # properly close port
+            self.ReleasePort()
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def HandleInMessageQueue(self, msg, arrival=None):
+        ''' Collects incoming bytes and handles every message completed by '#'.
+            arrival: monotonic time the bytes were received, used as time stamp for the events
+        '''
+        
+        if arrival is None:
+            arrival = monotonic()
             
-                # message are sent every 2s by the tilter
-                sleep(1)
+        if isinstance(msg, str):
+            msg = msg.encode('latin-1')
         
-            # properly close port
-            self.SafeCloseComPort()
+        # incomplete messages stay in the buffer
+        self._frameBuffer.Feed(msg)
+        
+        for frame in self._frameBuffer.PopFrames():
+            if frame:
+                self._HandleMessage(frame.decode('latin-1'), arrival)
     
 ### -------------------------------------------------------------------------------------------------------------------------------
 
-    def HandleInMessageQueue(self, msg):
+    def OnTransportFrame(self, frame):
+        ''' The async transport owns the port, the parameters are still tracked for WriteSetupBatched.
+            Events are not triggered here, frames are handed over to the consumer of the transport.
+        '''
         
-        # store for later handling, if no delimiter was found
-        self._inMessageQueue.append(msg)
+        if frame:
+            self._HandleReport(frame.decode('latin-1'))
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _HandleReport(self, msg):
         
-        msgStr = ''.join(self._inMessageQueue)
+        # read parameter values from last message and fill variable
+        self._ExtractParameters(msg)
         
-        # is '#' in stream? -> complete message
-        if '#' in msgStr:
-            
-            # in case multiple readings where necessary flatten list to string
-            # split again at correct positions with '#'
-            # also multiple messages can be handled
-            self._inMessageQueue = msgStr.split('#')
+        # wake up batched writer
+        with self._reportCondition:
+            self._numReports += 1
+            self._reportCondition.notify_all()
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def _HandleMessage(self, msg, arrival):
+        
+        self._HandleReport(msg)
+        
+        # check pause time
+        if self._currentParameterSet['p'] > 0 and self._currentParameterSet['m'] == 0:
             
-            while len(self._inMessageQueue) != 0:
-                
-                # get first message
-                msg = self._inMessageQueue.pop(0)
-                
-                # read parameter values from last message and fill variable
-                self._ExtractParameters(msg)
-                
-                # check pause time
-                if self._currentParameterSet['p'] > 0 and self._currentParameterSet['m'] == 0:
+            # only then update the waiting position
+            if not self._tilterState['isWaiting']:
+                # first wait is on positive side
+                if not self._tilterState['posWait']:
+                    self._tilterState['posWait'] = True
                     
-                    # only then update the waiting position
-                    if not self._tilterState['isWaiting']:
-                        # first wait is on positive side
-                        if not self._tilterState['posWait']:
-                            self._tilterState['posWait'] = True
-                            
-                            self._EventHandler('onPosWait')
-                        
-                        # then on the negative side
-                        elif self._tilterState['posWait']:
-                            self._tilterState['posWait'] = False
-                            self._tilterState['negWait'] = True
-
-                            self._EventHandler('onNegWait')
-                            
-                        self._tilterState['isMoving']  = False
-                        self._tilterState['isWaiting'] = True
-                        
-                # check motion time
-                elif self._currentParameterSet['m'] > 0 and self._currentParameterSet['p'] == 0:
+                    self._EventHandler('onPosWait', arrival)
+                
+                # then on the negative side
+                elif self._tilterState['posWait']:
+                    self._tilterState['posWait'] = False
+                    self._tilterState['negWait'] = True
+
+                    self._EventHandler('onNegWait', arrival)
                     
-                    # only then update the moving direction
-                    if not self._tilterState['isMoving']:
-                        # start with the first movement -> always the positive angle
-                        if not any( [self._tilterState['posDown'], self._tilterState['posUp'], self._tilterState['negDown'], self._tilterState['negUp']] ):
-                            self._tilterState['posDown'] = True
+                self._tilterState['isMoving']  = False
+                self._tilterState['isWaiting'] = True
+                
+        # check motion time
+        elif self._currentParameterSet['m'] > 0 and self._currentParameterSet['p'] == 0:
+            
+            # only then update the moving direction
+            if not self._tilterState['isMoving']:
+                # start with the first movement -> always the positive angle
+                if not any( [self._tilterState['posDown'], self._tilterState['posUp'], self._tilterState['negDown'], self._tilterState['negUp']] ):
+                    self._tilterState['posDown'] = True
 
-                            self._EventHandler('onPosDown')
-                        
-                        # return from waiting on positive side
-                        elif self._tilterState['posDown']:
-                            self._tilterState['posDown'] = False
-                            self._tilterState['posUp']   = True
+                    self._EventHandler('onPosDown', arrival)
+                
+                # return from waiting on positive side
+                elif self._tilterState['posDown']:
+                    self._tilterState['posDown'] = False
+                    self._tilterState['posUp']   = True
 
-                            self._EventHandler('onPosUp')
-                        
-                        # return from waiting on negative side
-                        elif self._tilterState['negDown']:
-                            self._tilterState['negDown'] = False
-                            self._tilterState['negUp']   = True
+                    self._EventHandler('onPosUp', arrival)
+                
+                # return from waiting on negative side
+                elif self._tilterState['negDown']:
+                    self._tilterState['negDown'] = False
+                    self._tilterState['negUp']   = True
 
-                            self._EventHandler('onNegUp')
-                            
+                    self._EventHandler('onNegUp', arrival)
                     
-                        # update states
-                        self._tilterState['isMoving']  = True
-                        self._tilterState['isWaiting'] = False
-                            
-                    # there might be a transition from up to down if there's not horizontal waiting...
-                    # can be detected if the new time if larger than the old one
-                    elif self._tilterState['isMoving'] and self._currentParameterSet['m'] > self._tilterState['moveTime']:
-                        
-                        # transition from posUp to negDown
-                        if self._tilterState['posUp']:
-                            self._tilterState['posUp']   = False
-                            self._tilterState['negDown'] = True
+            
+                # update states
+                self._tilterState['isMoving']  = True
+                self._tilterState['isWaiting'] = False
+                    
+            # there might be a transition from up to down if there's not horizontal waiting...
+            # can be detected if the new time if larger than the old one
+            elif self._tilterState['isMoving'] and self._currentParameterSet['m'] > self._tilterState['moveTime']:
+                
+                # transition from posUp to negDown
+                if self._tilterState['posUp']:
+                    self._tilterState['posUp']   = False
+                    self._tilterState['negDown'] = True
 
-                            self._EventHandler('onNegDown')
-                        
-                        # transition from negUp to posDown
-                        # also we have a full cycle
-                        elif self._tilterState['negUp']:
-                            self._tilterState['negUp']      = False
-                            self._tilterState['posDown']    = True
-                            self._tilterState['numCycles'] += 1
-
-                            self._EventHandler('onPosDown')
-                        
+                    self._EventHandler('onNegDown', arrival)
+                
+                # transition from negUp to posDown
+                # also we have a full cycle
+                elif self._tilterState['negUp']:
+                    self._tilterState['negUp']      = False
+                    self._tilterState['posDown']    = True
+                    self._tilterState['numCycles'] += 1
 
-                    # set new 'old' value for next comparision
-                    self._tilterState['moveTime']  = self._currentParameterSet['m']
+                    self._EventHandler('onPosDown', arrival)
+                
+
+            # set new 'old' value for next comparision
+            self._tilterState['moveTime']  = self._currentParameterSet['m']
     
 ### -------------------------------------------------------------------------------------------------------------------------------
 
     def _ExtractParameters(self, msg):
-        
-        for key in self.__parameters__:
-            paramSet = msg.split(';')
-            for param in paramSet:
-                if key in param:
-                    val = param.split(key)[-1]
-                    
-                    try:
-                        val = int(val)
-                    except ValueError:
-                        self.logger.error('Could not extract number from %s' % val)
-                    else:
-                        self._currentParameterSet[key] = val
+        self._currentParameterSet.update( self.ParseParameters(msg) )
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def ParseParameters(self, msg):
+        ''' Returns the parameters of one message, e.g. 'ID1;A+65;...;S1', as dict.
+            The message is scanned once, unknown or incomplete fields are ignored.
+        '''
+        return { key: int(val) for key, val in self.__parameterPattern__.findall(msg) }
     
 ### -------------------------------------------------------------------------------------------------------------------------------
 
-    def _EventHandler(self, event):
+    def _EventHandler(self, event, arrival):
+        
+        self._eventTimes[event] = arrival
         
         # call user defined function
         if self._tilterEvents[event]['defined']:
@@ -404,29 +627,16 @@ class ChipTilterCore(CoreDevice):
 
                 if self._tilterEvents[event]['itercnt'][funcIdx] == self._tilterEvents[event]['iter'][funcIdx]:
                     
-                    # callback function
-                    # push all event function to another thread
-                    # NOTE: use dictionary to store different threads and access them later to join
-                    eventKey = '%s%s' % (event, funcIdx)
+                    cb = self._tilterEvents[event]['cb'][funcIdx]
                     
-                    # so first try to join it
-                    if eventKey in self._eventThreads.keys() and self._eventThreads[eventKey]:
-                        self._eventThreads[eventKey].join()
-                        
-                    self._eventThreads[eventKey] = threading.Thread( target=lambda event=event, func=funcIdx: self._DelayEvent(event, func) )
-                    self._eventThreads[eventKey].start()
+                    # callback function
+                    # delay counts from the arrival of the message
+                    # NOTE: calls of the same function for the same event never overlap
+                    self._eventScheduler.Schedule( arrival + self._tilterEvents[event]['delay'][funcIdx], cb, key=(event, cb) )
                     
                     # reset iteration counter
                     self._tilterEvents[event]['itercnt'][funcIdx] = 0
     
-### -------------------------------------------------------------------------------------------------------------------------------
-
-    def _DelayEvent(self, event, func):
-        # wait for delay
-        sleep(self._tilterEvents[event]['delay'][func])
-        # execute after waiting time
-        self._tilterEvents[event]['cb'][func]()
-    
 ### -------------------------------------------------------------------------------------------------------------------------------
 
     def StartTilter(self):
@@ -504,10 +714,11 @@ class ChipTilterCore(CoreDevice):
         # to stop while loop for reading tilter stream
         self._isReading = False
         
-        if self.comPort:
-            while self.comPort.isOpen():
-                sleep(1e-3)
+        # release waiting writers
+        with self._reportCondition:
+            self._reportCondition.notify_all()
         
+        # reading thread releases the port when finished
         if self._inMessageThread:
             # join concurrent and main thread
             self._inMessageThread.join()
@@ -686,6 +897,12 @@ class ChipTilterCore(CoreDevice):
     def UnsetTilterEvent(self, event, func=None):
         
         if event in self._tilterEvents.keys():
+            
+            # drop callbacks which are still waiting for their delay
+            for cb in self._tilterEvents[event]['cb']:
+                if not func or cb == func:
+                    self._eventScheduler.Cancel(key=(event, cb))
+            
             if func:
                 for idx in range(self._tilterEvents[event]['numFuncs']):
                     if self._tilterEvents[event]['cb'][idx] == func:
@@ -708,6 +925,25 @@ class ChipTilterCore(CoreDevice):
 
     def IsTilting(self):
         return self._isTilting
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def IsReading(self):
+        return self._isReading
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetEventMetrics(self, event=None):
+        ''' number of calls and lateness (s) of the callbacks for the event, or for all events
+        '''
+        return self._eventScheduler.GetMetrics( lambda key: event is None or key[0] == event )
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def GetEventTime(self, event):
+        ''' monotonic time stamp of the message that triggered the event last, None if not triggered yet
+        '''
+        return self._eventTimes.get(event)
             
             
             
@@ -10,9 +10,13 @@ import serial
 import serial.tools.list_ports
 
 import threading
+import select
+import queue
 import types
 
-from time import sleep, time
+from concurrent.futures import Future
+
+from time import sleep, time, monotonic
 
 try:
     from libs import coreUtilities as coreUtils
@@ -21,8 +25,210 @@ except ImportError:
         
         
 
+class FrameBuffer:
+    ''' Growing byte buffer for incoming serial data.
+        New bytes are read directly into the free space (see ReadInto) and
+        complete frames are cut at the delimiter, e.g. b'\n', b'#' or b'END\r'.
+        Only new bytes are searched for the delimiter, not the whole buffer.
+        Frames without delimiter, e.g. with a length field, are cut by findEnd instead:
+        findEnd(data) returns the index behind the first complete frame in data or -1.
+    '''
+    
+    __initSize__ = 4096
+    
+    def __init__(self, delimiter=b'\n', size=None, findEnd=None):
+        
+        self._delimiter = delimiter.encode('latin-1') if isinstance(delimiter, str) else delimiter
+        self._findEnd   = findEnd
+        self._buffer    = bytearray(size if size else self.__initSize__)
+        self._view      = memoryview(self._buffer)
+        self._start     = 0         # first byte not yet returned
+        self._end       = 0         # end of valid data
+        self._scanPos   = 0         # delimiter search continues here
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def __len__(self):
+        return self._end - self._start
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetDelimiter(self, delimiter):
+        
+        if isinstance(delimiter, str):
+            delimiter = delimiter.encode('latin-1')
+            
+        if delimiter != self._delimiter:
+            self._delimiter = delimiter
+            self._scanPos   = self._start
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def Clear(self):
+        self._start   = 0
+        self._end     = 0
+        self._scanPos = 0
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def Feed(self, data):
+        ''' Copy data to the end of the buffer
+        '''
+        
+        n = len(data)
+        
+        self._Reserve(n)
+        self._view[self._end:self._end+n] = data
+        self._end += n
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def ReadInto(self, port, numBytes):
+        ''' Read max numBytes from port (anything with readinto) into the free space.
+            Returns the number of bytes read.
+        '''
+        
+        self._Reserve(numBytes)
+        
+        n = port.readinto(self._view[self._end:self._end+numBytes])
+        
+        if n:
+            self._end += n
+        
+        return n if n else 0
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def HasFrame(self):
+        
+        if self._findEnd:
+            return self._findEnd( self._buffer[self._start:self._end] ) != -1
+        
+        return self._FindDelimiter() != -1
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def PopFrame(self):
+        ''' Return the next complete frame without delimiter or None
+            With findEnd the frame is returned as it is, including bytes in front of it.
+        '''
+        
+        if self._findEnd:
+            
+            end = self._findEnd( self._buffer[self._start:self._end] )
+            
+            if end == -1:
+                return None
+            
+            frame = bytes(self._view[self._start:self._start+end])
+            
+            self._start  += end
+            self._scanPos = self._start
+            
+            return frame
+        
+        idx = self._FindDelimiter()
+        
+        if idx == -1:
+            return None
+        
+        frame = bytes(self._view[self._start:idx])
+        
+        self._start   = idx + len(self._delimiter)
+        self._scanPos = self._start
+        
+        return frame
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def PopFrames(self):
+        ''' Return all complete frames, incomplete data stays in the buffer
+        '''
+        
+        frames = []
+        
+        frame = self.PopFrame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.PopFrame()
+            
+        return frames
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def Peek(self):
+        ''' Copy of everything in the buffer, the buffer stays unchanged
+        '''
+        return bytes(self._view[self._start:self._end])
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def PopAll(self):
+        ''' Return everything in the buffer, no matter if complete or not
+        '''
+        
+        data = bytes(self._view[self._start:self._end])
+        
+        self.Clear()
+        
+        return data
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _FindDelimiter(self):
+        
+        idx = self._buffer.find(self._delimiter, self._scanPos, self._end)
+        
+        # next search starts where a delimiter could begin, at the earliest
+        if idx == -1:
+            self._scanPos = max(self._start, self._end - len(self._delimiter) + 1)
+            
+        return idx
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _Reserve(self, numBytes):
+        ''' Make sure numBytes fit behind the valid data
+        '''
+        
+        if self._end + numBytes <= len(self._buffer):
+            return
+        
+        n = self._end - self._start
+        
+        # grow in case moving the data to the front is not enough
+        if n + numBytes > len(self._buffer):
+            size = len(self._buffer)
+            while n + numBytes > size:
+                size *= 2
+                
+            buffer = bytearray(size)
+            buffer[:n] = self._view[self._start:self._end]
+            
+            self._view.release()
+            
+            self._buffer = buffer
+            self._view   = memoryview(self._buffer)
+        else:
+            self._view[:n] = self._view[self._start:self._end]
+            
+        self._scanPos -= self._start
+        self._start    = 0
+        self._end      = n
+        
+        
+        
 class ComDevice:
     
+    # max time in seconds to wait for access to the serial port
+    __portTimeout__ = 5
+    
+    # max time in seconds the listener blocks before checking if it should stop
+    __listenTimeout__ = 0.1
+    
+    # in case the port has no file descriptor to wait for, e.g. on Windows
+    __listenPollInterval__ = 1e-3
+    
     def __init__(self, detectFunc=None, initAfterDetectFunc=None, listenFunc=None, **flags):
         
         self._comPortList         = []
@@ -40,22 +246,56 @@ class ComDevice:
         self._listening           = False
         self._listenStart         = None
         self._listenFor           = None
+        self._listenTimeout       = flags.get('listenTimeout', self.__listenTimeout__)
         
+        # complete messages from the listener go either to the callback or the queue
         self._inMessages          = []
+        self._listenQueue         = queue.Queue()
+        self._messageCallback     = flags.get('messageCallback')
         self._keepMessages        = flags.get('keepMessages', True)
         self._messageDelimiter    = flags.get('delimiter', '\n')
         
-        self._isReadingWriting    = False
-        self._isAboutToOpenClose  = False
+        # preallocated buffers for reading, see FrameBuffer
+        # one read buffer per thread, so the listener and other readers never share one
+        self._readBuffers         = threading.local()
+        self._listenBuffer        = FrameBuffer( self._messageDelimiter.encode('latin-1') )
+        
+        # access to the serial port is serialized by a reentrant lock
+        # the condition is notified whenever the port was opened or closed
+        self._portLock            = threading.RLock()
+        self._portCondition       = threading.Condition(self._portLock)
+        self._portTimeout         = flags.get('portTimeout', self.__portTimeout__)
+        
+        # number of threads which need the port to stay open, e.g. the listener, see HoldPort
+        self._portHolders         = 0
+        
+        # open async transport, it owns the port and all writes and replies go through it, see AttachTransport
+        self._asyncTransport      = None
+        
+        # in a persistent session the port stays open and is owned by a single I/O thread
+        # all reads and writes are submitted to this thread, see StartSession
+        self._persistentSession   = flags.get('persistentSession', False)
+        self._sessionActive       = False
+        self._sessionThread       = None
+        self._sessionRequests     = queue.Queue()
+        # checking the session state and queueing a request is done at once, see Submit and StopSession
+        self._sessionLock         = threading.Lock()
         
         self.SetListenFunction(listenFunc)
         
+        # port settings are kept for detecting the device again later
+        # a snapshot of the ports ('comPorts') is only valid for this first detection
+        self._portFlags           = {k: v for k, v in flags.items() if k not in ['comPorts', 'deferDetection']}
+        
+        # detection can be done later by calling DetectDeviceAndSetupPort, e.g. in parallel for several devices
+        if flags.get('deferDetection', False):
+            coreUtils.SafeLogger('debug', 'Detection deferred.', self)
         # use own function to detect device
-        if self._comPortName:
+        elif self._comPortName:
             self.DetectDeviceAndSetupPort(**flags)
         # function to be called for device detection and initialization
         elif detectFunc:
-            detectFunc()
+            detectFunc(**flags)
            
         # directly start listening thread after proper init
 #        if self._listenAlways and self.comPortStatus:
@@ -68,14 +308,23 @@ class ComDevice:
         # in case we are still listening
         self.StopListening()
         
+        self.StopSession()
+        
         self.SafeCloseComPort()
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def DetectDeviceAndSetupPort(self, **flags):
+    def DetectDeviceAndSetupPort(self, comPorts=None, **flags):
+        ''' comPorts: list of ports as returned by serial.tools.list_ports.comports(),
+                      enumerated here if not given
+            flags:    override the port settings given to the constructor
+        '''
+        
+        self.DetectDevice(comPorts)
+        self.SetupSerialPort( dict(self._portFlags, **flags) )
         
-        self.DetectDevice()
-        self.SetupSerialPort(flags)
+        if self.comPortStatus and self._persistentSession:
+            self.StartSession()
         
         if self.comPortStatus and self._initAfterDetectFunc:
             self._initAfterDetectFunc()
@@ -84,7 +333,7 @@ class ComDevice:
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
-    def DetectDevice(self):
+    def DetectDevice(self, comPorts=None):
         # try to detect com device
         
         # reset com port status
@@ -94,8 +343,12 @@ class ComDevice:
         if self._detMsg:
             coreUtils.SafeLogger('info', self._detMsg, self)
         
+        # enumerating takes a while, so a snapshot can be shared by several devices
+        if comPorts is None:
+            comPorts = serial.tools.list_ports.comports()
+        
         # NOTE: serial.tools.list_ports.grep(name) does not seem to work...
-        for p in serial.tools.list_ports.comports():
+        for p in comPorts:
             if self._comPortName in p.description:
                 self._comPortList.append(p)
                 
@@ -147,39 +400,102 @@ class ComDevice:
     
     def _ListenFunction(self):
         ''' listen to incoming messages and process them according to user flag 'keepMessages'
+            Blocks until bytes arrive (select on the port's file descriptor, if available)
+            instead of polling, complete messages are handed over by _DispatchMessage.
         '''
         
-        if self.SafeOpenComPort():
+        # nobody else can close the port while listening
+        if self.HoldPort():
+            
+            # incomplete messages stay in the buffer till the next read
+            self._listenBuffer.Clear()
             
             while self._listening:
                 
-                inMsg = self.SafeReadFromComPort('waiting', decode=True, leaveOpen=True)
-                
-#                print('\''+inMsg+'\'')
-                
-                if len(inMsg) > 0:
-                    inMsg = inMsg.split(self._messageDelimiter)
+                # port might have been closed anyways, e.g. after an error
+                if not self.comPort.isOpen() and not self.SafeOpenComPort():
+                    sleep(self._listenTimeout)
                     
+                # returns after listenTimeout at the latest, so stopping the loop is still possible
+                elif self._WaitForIncomingBytes(self._listenTimeout):
+                
+                    inMsg = self.SafeReadFromComPort('waiting', leaveOpen=True)
                     
-                    # if user wants to handle messages
-                    # append new messages to class member
-                    # user can access later via GetMessages()
-                    if self._keepMessages:
-                        self._inMessages += inMsg
-                    else:
-                        while len(inMsg) > 0:
-                            msg = inMsg.pop(0)
-                            if msg:
-                                coreUtils.SafeLogger('info', msg.strip(chr(241)), self)
+                    if len(inMsg) > 0:
+                        self._listenBuffer.Feed(inMsg)
+                        
+                        for msg in self._listenBuffer.PopFrames():
+                            self._DispatchMessage( msg.decode('latin-1') )
                                 
+                # there must be something wrong with the serial port
+                elif not self.comPortStatus:
+                    self._listening = False
+                    
                 # automatically stop loop
                 if self._listenFor:
                     if (time() - self._listenStart) > self._listenFor:
                         self._listening = False
-                        
-                sleep(1e-4)
                 
-            self.SafeCloseComPort()
+            self.ReleasePort()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _WaitForIncomingBytes(self, timeout):
+        ''' Sleep until the port has bytes waiting or timeout seconds passed.
+        '''
+        
+        # closed ports have no file descriptor anymore
+        if not self.comPort.isOpen():
+            return False
+        
+        try:
+            if self.comPort.in_waiting > 0:
+                return True
+            
+            # not available on Windows, poll instead
+            fd = self.comPort.fileno()
+            
+        except TypeError:
+            # port was closed meanwhile
+            return False
+            
+        except (AttributeError, NotImplementedError, OSError):
+            sleep(self.__listenPollInterval__)
+            
+            try:
+                return self.comPort.in_waiting > 0
+            except (serial.SerialException, TypeError):
+                return False
+        
+        try:
+            readable, _, _ = select.select([fd], [], [], timeout)
+        except (OSError, ValueError):
+            # port was closed meanwhile
+            return False
+        
+        return len(readable) > 0
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _DispatchMessage(self, msg):
+        ''' Hand over a complete message to the callback or keep it in the message queue
+        '''
+        
+        msg = msg.strip(chr(241))
+        
+        if not msg:
+            return
+        
+        if self._messageCallback:
+            self._messageCallback(msg)
+            
+        # if user wants to handle messages
+        # user can access later via GetMessages() or GetMessage()
+        elif self._keepMessages:
+            self._listenQueue.put(msg)
+            
+        else:
+            coreUtils.SafeLogger('info', msg, self)
             
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -192,6 +508,16 @@ class ComDevice:
         self.comPortInfo     = None
         self.comPortStatus   = False
             
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def DiscardDetection(self):
+        ''' Undo a detection whose result is not used: stop the session, close the port and reset the port status
+        '''
+        
+        self.StopSession()
+        self.SafeCloseComPort()
+        self.ResetComPort()
+            
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def StartListening(self, listenFunc=None):
@@ -219,6 +545,11 @@ class ComDevice:
         if self._listenThread:
             self._listenThread.join()
             
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def IsListening(self):
+        return self._listening
+            
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def ListenFor(self, secs):
@@ -255,18 +586,15 @@ class ComDevice:
         
         success = False
         
-        if self.comPortStatus:
-            # wait until reading/writing was finished
-            # or the port is opened/closed by somebody else
-            while self._isReadingWriting or self._isAboutToOpenClose:
-                sleep(50e-6)
-                
-            # try to open now, if not already...
-            self._isAboutToOpenClose = True
+        # wait until reading/writing was finished
+        # or the port is opened/closed by somebody else
+        if self.comPortStatus and self._AcquirePort():
             
             try:
+                # try to open now, if not already...
                 if not self.comPort.isOpen():
                     self.comPort.open()
+                    self._portCondition.notify_all()
             except serial.SerialException:
                 
                 # to avoid any contact afterwards
@@ -274,9 +602,9 @@ class ComDevice:
             
                 coreUtils.SafeLogger('error', 'Could not open serial port!', self)
             else:
-                # opening finished
-                self._isAboutToOpenClose = False
                 success = True
+            finally:
+                self._portLock.release()
             
         return success
             
@@ -286,18 +614,19 @@ class ComDevice:
         
         success = False
         
-        if self.comPortStatus and isinstance(self.comPort, serial.serialwin32.Serial):
-            # wait until reading/writing was finished
-            # or the port is opened/closed by somebody else
-            while self._isReadingWriting or self._isAboutToOpenClose:
-                sleep(50e-6)
-                
-            # try to close now
-            self._isAboutToOpenClose = True
+        # port stays open till the session is stopped or the last holder released it
+        if self._sessionActive or self._portHolders:
+            return self.comPortStatus
+        
+        # wait until reading/writing was finished
+        # or the port is opened/closed by somebody else
+        if self.comPortStatus and isinstance(self.comPort, serial.SerialBase) and self._AcquirePort():
             
             try:
+                # try to close now
                 if self.comPort.isOpen():
                     self.comPort.close()
+                    self._portCondition.notify_all()
             except serial.SerialException:
                 
                 # to avoid any contact afterwards
@@ -305,110 +634,377 @@ class ComDevice:
                 
                 coreUtils.SafeLogger('error', 'Could not close serial port!', self)
             else:
-                # closing finished
-                self._isAboutToOpenClose = False
                 success = True
+            finally:
+                self._portLock.release()
                 
         return success
             
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def HoldPort(self):
+        ''' Open the port and keep it open till ReleasePort is called,
+            SafeCloseComPort has no effect meanwhile. Calls can be nested.
+        '''
+        
+        if not self._AcquirePort():
+            return False
+        
+        try:
+            if not self.SafeOpenComPort():
+                return False
+            
+            self._portHolders += 1
+            
+            return True
+        finally:
+            self._portLock.release()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def AttachTransport(self, transport):
+        ''' Route writes and requests through the transport while it is open,
+            otherwise its reader would take the replies of blocking requests.
+        '''
+        self._asyncTransport = transport
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def DetachTransport(self):
+        self._asyncTransport = None
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def OnTransportFrame(self, frame):
+        ''' Called by the attached transport for every incoming frame,
+            intended to be overridden to keep the device state up to date.
+        '''
+        pass
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def ReleasePort(self):
+        ''' Counterpart of HoldPort, the last holder closes the port.
+        '''
+        
+        with self._portLock:
+            self._portHolders = max(0, self._portHolders - 1)
+            
+        return self.SafeCloseComPort()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def WaitForPortClosed(self, timeout=None):
+        ''' Block until the serial port was closed, e.g. by a listening thread.
+            Returns False in case the port is still open after timeout seconds.
+        '''
+        
+        if not self.comPort:
+            return True
+        
+        with self._portCondition:
+            return self._portCondition.wait_for(lambda: not self.comPort.isOpen(), timeout)
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _AcquirePort(self):
+        ''' Wait for exclusive access to the serial port.
+            Reentrant, so the owner can still open/close while reading or writing.
+        '''
+        
+        if not self._portLock.acquire(timeout=self._portTimeout):
+            coreUtils.SafeLogger('error', 'Timeout while waiting for access to serial port!', self)
+            return False
+        
+        return True
+            
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def SafeWriteToComPort(self, outData, **flags):
         
+        # the transport owns the port
+        if self._asyncTransport:
+            return self._asyncTransport.SendFromThread(outData)
+        
+        # hand over to the I/O thread
+        if self._IsForeignThread():
+            return self.Submit(self.SafeWriteToComPort, outData, **flags).result()
+        
         success   = True
         leaveOpen = flags.get('leaveOpen', False)
         
-        if self.SafeOpenComPort():
-            
-            # just lock for anybody else
-            self._isReadingWriting = True
-            
-            try:
-                if not self._isAboutToOpenClose:
+        # just lock for anybody else
+        if not self._AcquirePort():
+            return False
+        
+        try:
+            if self.SafeOpenComPort():
+                
+                try:
                     self.comPort.write(outData)
-            except (serial.SerialException, serial.SerialTimeoutException):
-                self.comPortStatus = False
+                except (serial.SerialException, serial.SerialTimeoutException):
+                    self.comPortStatus = False
+                    success = False
+                    
+                    coreUtils.SafeLogger('error', 'Could not write: \'%s\' to port \'%s\'!' % (outData, self.comPortInfo[0]), self)
+                    
+                finally:
+                    if not leaveOpen:
+                        success = self.SafeCloseComPort() and success
+            else:
                 success = False
-                
-                coreUtils.SafeLogger('error', 'Could not write: \'%s\' to port \'%s\'!' % (outData, self.comPortInfo[0]), self)
-                
-            finally:
-                # release lock
-                self._isReadingWriting = False
-                
-                if not leaveOpen:
-                    success = self.SafeCloseComPort()
+        finally:
+            # release lock
+            self._portLock.release()
                 
         return success
             
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def SafeReadFromComPort(self, mode='', waitFor=0, bePatient=0, **flags):
+        ''' mode:      '' one byte, 'line' till '\n' or 'waiting' all available bytes
+            waitFor:   seconds to wait for the first byte in 'waiting' mode
+            bePatient: ms to wait for further bytes in 'waiting' mode
+            flags:     leaveOpen, decode, delimiter and until, in 'waiting' mode reading
+                       returns right away when delimiter was received or until(data) is True
+        '''
+        
+        # incoming bytes belong to the transport, see Request
+        if self._asyncTransport:
+            return '' if flags.get('decode', False) else b''
+        
+        # hand over to the I/O thread
+        if self._IsForeignThread():
+            return self.Submit(self.SafeReadFromComPort, mode, waitFor, bePatient, **flags).result()
         
         inData    = bytes()
         leaveOpen = flags.get( 'leaveOpen', False )
         decode    = flags.get( 'decode'   , False )
+        delimiter = flags.get( 'delimiter', None  )
+        until     = flags.get( 'until'    , None  )
         
-        if self.SafeOpenComPort():
-            
-            # just lock for anybody else
-            self._isReadingWriting = True
-            
-            try:
-                if mode == '':
-                    
-                    # check if comport is not going to be killed
-                    if not self._isAboutToOpenClose:
+        # just lock for anybody else
+        if not self._AcquirePort():
+            return inData.decode('latin-1') if decode else inData
+        
+        try:
+            if self.SafeOpenComPort():
+                
+                try:
+                    if mode == '':
                         inData = self.comPort.read()
-                        
-                elif mode == 'line':
-                    # check if comport is not going to be killed
-                    if not self._isAboutToOpenClose:
-                        inData = self.comPort.readline()
-                        
-                elif mode == 'waiting':
-                    
-                    if waitFor > 0 and bePatient > 0:
-                        
-                        waitingFor = 0
-                        
-                        while self.comPort.in_waiting == 0 and waitingFor < waitFor*1e3:
-                            waitingFor += 1
-                            sleep(1e-3)
-                            
-                        # collecting incoming bytes and wait max 'bePatient' ms for the next one
-                        waitingFor = 0
-                            
-                        while self.comPort.in_waiting != 0 or waitingFor < bePatient:
-                            # check if comport is not going to be killed
-                            if not self._isAboutToOpenClose:
-                                inData += self.comPort.read(self.comPort.in_waiting)
                             
-                            # in case there's something more just wait a bit...
-                            if self.comPort.in_waiting == 0:
-                                waitingFor += 1
-                                sleep(1e-3)
-                            
-                    else:
-                        while self.comPort.in_waiting != 0:
-                            inData += self.comPort.read(self.comPort.in_waiting)
+                    elif mode == 'line':
+                        inData = self.comPort.readline()
                             
-            except (serial.SerialException, serial.SerialTimeoutException):
-                self.comPortStatus = False
+                    elif mode == 'waiting':
+                        inData = self._ReadWaiting(waitFor, bePatient*1e-3, delimiter, until)
+                                
+                except (serial.SerialException, serial.SerialTimeoutException):
+                    self.comPortStatus = False
+                    
+                    coreUtils.SafeLogger('error', 'Could not read bytes from port \'%s\'!' % self.comPortInfo[0], self)
                 
-                coreUtils.SafeLogger('error', 'Could not read bytes from port \'%s\'!' % self.comPortInfo[0], self)
+                finally:
+                    if not leaveOpen:
+                        self.SafeCloseComPort()
+        finally:
+            # release lock
+            self._portLock.release()
             
-            finally:
-                # release lock
-                self._isReadingWriting = False
+        if decode:
+            inData = inData.decode('latin-1')
                 
-                if not leaveOpen:
-                    self.SafeCloseComPort()
+        return inData
             
-            if decode:
-                inData = inData.decode('latin-1')
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _ReadWaiting(self, waitFor, patience, delimiter=None, until=None):
+        ''' Collect incoming bytes in the read buffer.
+            Waits max waitFor seconds for the first byte and patience seconds for the next one,
+            both are only applied when given.
+        '''
+        
+        port = self.comPort
+        
+        if not hasattr(self._readBuffers, 'buffer'):
+            self._readBuffers.buffer = FrameBuffer()
+            
+        buf = self._readBuffers.buffer
+        buf.Clear()
+        
+        if delimiter:
+            buf.SetDelimiter(delimiter)
+        
+        if waitFor > 0 and patience > 0:
+            
+            # NOTE: the port lock is held the whole time, so nobody else can use the port meanwhile,
+            #       waiting blocks on the file descriptor, see _WaitForIncomingBytes
+            deadline = monotonic() + waitFor
+            
+            while port.isOpen() and port.in_waiting == 0 and monotonic() < deadline:
+                self._WaitForIncomingBytes( max(0, deadline - monotonic()) )
                 
-        return inData
+            # collecting incoming bytes and wait max 'patience' seconds for the next one
+            deadline = monotonic() + patience
+            
+            while port.isOpen() and monotonic() < deadline:
+                
+                numBytes = port.in_waiting
+                
+                if numBytes:
+                    buf.ReadInto(port, numBytes)
+                    
+                    if delimiter and buf.HasFrame():
+                        break
+                    
+                    if until and until(buf.Peek()):
+                        break
+                    
+                    deadline = monotonic() + patience
+                else:
+                    self._WaitForIncomingBytes( max(0, deadline - monotonic()) )
+                    
+        else:
+            numBytes = port.in_waiting
+            
+            while numBytes:
+                buf.ReadInto(port, numBytes)
+                numBytes = port.in_waiting
+                
+        return buf.PopAll()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def Request(self, outData, **flags):
+        ''' Write outData and read the answer in one go, flags are passed to SafeReadFromComPort.
+            The port lock is held till the answer was read, so nobody else can access the port in between, e.g. a listening thread.
+            Returns None in case writing failed.
+            While an async transport is attached, the answer is its next frame.
+        '''
+        
+        if self._asyncTransport:
+            return self._TransportRequest(outData, **flags)
+        
+        # hand over to the I/O thread
+        if self._IsForeignThread():
+            return self.Submit(self.Request, outData, **flags).result()
+        
+        if not self._AcquirePort():
+            return None
+        
+        try:
+            if not self.SafeWriteToComPort(outData, leaveOpen=True):
+                return None
+            
+            return self.SafeReadFromComPort(flags.pop('mode', 'waiting'), **flags)
+        finally:
+            self._portLock.release()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _TransportRequest(self, outData, **flags):
+        ''' Request through the attached transport, waits as long as SafeReadFromComPort would at most
+        '''
+        
+        timeout = flags.get('waitFor', 0) + flags.get('bePatient', 0) * 1e-3
+        inData  = self._asyncTransport.RequestFromThread(outData, timeout if timeout > 0 else 1.)
+        
+        # no answer
+        if inData is None:
+            inData = b''
+        
+        return inData.decode('latin-1') if flags.get('decode', False) else inData
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def StartSession(self):
+        ''' Open the port for the lifetime of the device and start the I/O thread owning it.
+        '''
+        
+        with self._sessionLock:
+            
+            if self._sessionActive:
+                return True
+            
+            if not self.SafeOpenComPort():
+                return False
+            
+            # every session gets its own queue, so a new one cannot take the stop signal of the last one
+            self._sessionRequests = queue.Queue()
+            self._sessionActive   = True
+            self._sessionThread   = threading.Thread(target=self._SessionLoop, args=(self._sessionRequests,), daemon=True)
+            self._sessionThread.start()
+        
+        return True
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def StopSession(self):
+        ''' Finish all pending requests, stop the I/O thread and close the port.
+        '''
+        
+        with self._sessionLock:
+            
+            if not self._sessionActive:
+                return
+            
+            # no new requests from here on, pending ones are still handled
+            self._sessionActive = False
+            
+            # stop signal, queued behind the pending requests
+            self._sessionRequests.put(None)
+        
+        self._sessionThread.join()
+        self._sessionThread = None
+        
+        self.SafeCloseComPort()
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def Submit(self, func, *args, **kwargs):
+        ''' Execute func in the I/O thread of the session.
+            Returns a concurrent.futures.Future holding the result.
+        '''
+        
+        future = Future()
+        
+        # a request must not end up behind the stop signal, it would never be handled
+        with self._sessionLock:
+            if not self._sessionActive:
+                future.set_exception(Exception('No active session on serial port!'))
+            else:
+                self._sessionRequests.put( (future, func, args, kwargs) )
+        
+        return future
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _SessionLoop(self, requests):
+        
+        while True:
+            
+            request = requests.get()
+            
+            if request is None:
+                break
+            
+            future, func, args, kwargs = request
+            
+            if not future.set_running_or_notify_cancel():
+                continue
+            
+            try:
+                future.set_result( func(*args, **kwargs) )
+            except Exception as e:
+                future.set_exception(e)
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _IsForeignThread(self):
+        ''' True in case a session is running and the caller is not its I/O thread
+        '''
+        return self._sessionActive and threading.current_thread() is not self._sessionThread
             
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -423,5 +1019,31 @@ class ComDevice:
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def GetMessages(self):
+        ''' Return all messages received so far, except the ones taken by GetMessage()
+        '''
+        
+        while not self._listenQueue.empty():
+            self._inMessages.append( self._listenQueue.get() )
+            
         return self._inMessages
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetMessage(self, timeout=None):
+        ''' Wait for the next message from the listener.
+            Returns None in case no message arrived within timeout seconds.
+        '''
+        
+        try:
+            return self._listenQueue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+            
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def SetMessageCallback(self, callback):
+        ''' Function called by the listener for every complete message, None to disable
+        '''
+        
+        self._messageCallback = callback
                 
\ No newline at end of file
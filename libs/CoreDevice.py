@@ -22,6 +22,11 @@ try:
     from libs import coreUtilities as coreUtils
 except ImportError:
     import coreUtilities as coreUtils
+
+try:
+    from libs.AsyncTransport import AsyncTransport
+except ImportError:
+    from AsyncTransport import AsyncTransport
     
     
 
@@ -51,4 +56,19 @@ class CoreDevice(ComDevice, Logger):
     def __del__(self):
         
         ComDevice.__del__(self)
-        Logger.__del__(self)
\ No newline at end of file
+        Logger.__del__(self)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+
+    def OpenAsyncTransport(self, delimiter=None, loop=None, findEnd=None):
+        ''' Alternative to the threaded listener, has to be called from the event loop thread.
+            findEnd: cuts frames without delimiter, see FrameBuffer
+            Returns the opened AsyncTransport or None in case the port could not be opened.
+        '''
+        
+        if not delimiter:
+            delimiter = self._messageDelimiter
+        
+        transport = AsyncTransport(self, delimiter, loop, findEnd)
+        
+        return transport if transport.Open() else None
@@ -5,11 +5,12 @@ Created on Sat Jun 17 00:42:53 2017
 @author: Martin
 """
 
+import os
+import pickle
 import threading
 import queue
-from scipy import io
-from collections import OrderedDict, defaultdict
-import scipy as sp
+from collections import OrderedDict, defaultdict, deque
+import numpy as np
 
 from time import sleep, time, perf_counter
 
@@ -18,11 +19,348 @@ try:
 except ImportError:
     import coreUtilities as coreUtils
     
+try:
+    from libs.Hdf5Storage import Hdf5Storage
+except ImportError:
+    from Hdf5Storage import Hdf5Storage
+    
 
 
 
     
     
+class ColumnBuffer:
+    ''' Growable one dimensional array for streamed data.
+        Capacity is doubled whenever new data does not fit anymore, so
+        appending a chunk costs O(chunk) amortized instead of copying
+        everything that was stored so far.
+    '''
+    
+    # minimum number of elements allocated at the first append
+    __minCapacity__ = 1024
+    
+    def __init__(self, dtype=np.float64):
+        
+        self._dtype  = np.dtype(dtype)
+        self._buffer = None
+        self._size   = 0
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def __len__(self):
+        return self._size
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Append(self, values):
+        ''' Append values and return the number of bytes added.
+        '''
+        
+        n = len(values)
+        
+        if self._buffer is None:
+            self._buffer = np.empty(max(n, self.__minCapacity__), dtype=self._dtype)
+            
+        # not enough space left, so grow at least by a factor of two
+        elif self._size + n > len(self._buffer):
+            newBuffer = np.empty(max(2*len(self._buffer), self._size + n), dtype=self._dtype)
+            newBuffer[:self._size] = self._buffer[:self._size]
+            self._buffer = newBuffer
+            
+        self._buffer[self._size:self._size+n] = values
+        self._size += n
+        
+        return n * self._dtype.itemsize
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def GetArray(self):
+        ''' Return a view on the filled part of the buffer.
+        '''
+        if self._buffer is None:
+            return np.array([], dtype=self._dtype)
+        
+        return self._buffer[:self._size]
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def GetSize(self):
+        ''' Return the number of bytes that are actually in use.
+        '''
+        return self._size * self._dtype.itemsize
+        
+        
+        
+class ChunkQueue:
+    ''' FIFO for incoming data chunks with a maximum depth.
+        When the queue is full, new chunks are handled according to the policy:
+            'block'      : wait till the processor took a chunk
+            'dropOldest' : throw away the oldest chunk in memory
+            'spillToDisk': pickle the chunk to spillFolder and load it again when it's processed
+        Every chunk carries its enqueue time for the statistics, see GetStats.
+    '''
+    
+    __policies__ = ['block', 'dropOldest', 'spillToDisk']
+    
+    # number of recent chunks used for the time statistics
+    __numStatSamples__ = 1000
+    
+    def __init__(self, maxDepth=0, policy='block', spillFolder='./spill/'):
+        
+        if policy not in self.__policies__:
+            raise Exception('Unsupported queue policy: %s' % policy)
+        
+        self._maxDepth    = maxDepth        # 0 means unbounded
+        self._policy      = policy
+        self._spillFolder = spillFolder
+        
+        # entries are [enqueueTime, chunk, spillFile, spilled]
+        self._items       = deque()
+        self._inMemory    = 0
+        self._unfinished  = 0
+        self._closed      = False
+        self._condition   = threading.Condition()
+        
+        self._spillCounter = 0
+        
+        self.ResetStats()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Put(self, chunk):
+        
+        with self._condition:
+            
+            full = self._maxDepth > 0 and self._inMemory >= self._maxDepth
+            
+            if full and self._policy == 'block':
+                self._condition.wait_for(lambda: self._inMemory < self._maxDepth or self._closed)
+                
+            elif full and self._policy == 'dropOldest':
+                for idx, item in enumerate(self._items):
+                    if not item[3]:
+                        del self._items[idx]
+                        break
+                self._inMemory   -= 1
+                self._unfinished -= 1
+                self._stats['numDropped'] += 1
+                
+            item  = [perf_counter(), chunk, None, False]
+            fName = None
+            
+            # chunk is pickled after the lock was released, so Get is not blocked meanwhile
+            if full and self._policy == 'spillToDisk':
+                item[3] = True
+                fName   = self._spillFolder + 'chunk%08d.pkl' % self._spillCounter
+                self._spillCounter += 1
+                self._stats['numSpilled'] += 1
+            else:
+                self._inMemory += 1
+                
+            self._items.append(item)
+            self._unfinished += 1
+            
+            self._stats['maxDepth'] = max(self._stats['maxDepth'], len(self._items))
+            
+            self._condition.notify_all()
+            
+        if fName:
+            self._Spill(item, fName)
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Get(self):
+        ''' Block till the next chunk is available.
+            Returns the chunk with its enqueue time or None when the queue was closed.
+        '''
+        
+        with self._condition:
+            
+            self._condition.wait_for(lambda: self._items or self._closed)
+            
+            if not self._items:
+                return None
+            
+            item = self._items.popleft()
+            
+            enqueueTime, chunk, spillFile, spilled = item
+            
+            if not spilled:
+                self._inMemory -= 1
+                
+            # mark as taken, in case it is still being spilled
+            item[1] = None
+                
+            # somebody might wait for free space
+            self._condition.notify_all()
+        
+        # load outside the lock, so producers are not blocked meanwhile
+        if chunk is None:
+            chunk = self._Unspill(spillFile)
+            
+        return chunk, enqueueTime
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def TaskDone(self, waitTime, procTime):
+        ''' Indicate that a chunk received by Get was processed.
+        '''
+        
+        with self._condition:
+            
+            self._unfinished -= 1
+            
+            self._stats['numProcessed'] += 1
+            self._waitTimes.append(waitTime)
+            self._procTimes.append(procTime)
+            
+            self._condition.notify_all()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Join(self):
+        ''' Block till all chunks were processed.
+        '''
+        
+        with self._condition:
+            self._condition.wait_for(lambda: self._unfinished <= 0 or self._closed)
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Open(self):
+        with self._condition:
+            self._closed = False
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def Close(self):
+        ''' Wake up everybody waiting in Get, Put or Join.
+        '''
+        
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def GetDepth(self):
+        return len(self._items)
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def ResetStats(self):
+        
+        self._stats = {
+                'maxDepth'    : 0,
+                'numProcessed': 0,
+                'numDropped'  : 0,
+                'numSpilled'  : 0
+            }
+        
+        self._waitTimes = deque(maxlen=self.__numStatSamples__)
+        self._procTimes = deque(maxlen=self.__numStatSamples__)
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def GetStats(self):
+        ''' Return queue depth, counters and wait/processing time per chunk in seconds
+            (mean, median, 95th percentile and max of the recent chunks).
+        '''
+        
+        with self._condition:
+            stats = dict(self._stats)
+            stats['depth']    = len(self._items)
+            stats['onDisk']   = len(self._items) - self._inMemory
+            stats['waitTime'] = self._TimeStats(self._waitTimes)
+            stats['procTime'] = self._TimeStats(self._procTimes)
+            
+        return stats
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def _TimeStats(self, times):
+        
+        if len(times) == 0:
+            return {'mean': 0, 'median': 0, 'p95': 0, 'max': 0}
+        
+        times = np.array(times)
+        
+        return {
+                'mean'  : times.mean(),
+                'median': np.percentile(times, 50),
+                'p95'   : np.percentile(times, 95),
+                'max'   : times.max()
+            }
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def _Spill(self, item, fName):
+        ''' Pickle the chunk of a queued item and swap the file in afterwards.
+            The chunk stays in the item meanwhile, so Get can still take it.
+        '''
+        
+        coreUtils.SafeMakeDir(self._spillFolder)
+        
+        with open(fName, 'wb') as f:
+            pickle.dump(item[1], f, pickle.HIGHEST_PROTOCOL)
+            
+        with self._condition:
+            
+            # already taken by Get
+            if item[1] is None:
+                os.remove(fName)
+                
+            else:
+                item[1] = None
+                item[2] = fName
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def _Unspill(self, fName):
+        
+        with open(fName, 'rb') as f:
+            chunk = pickle.load(f)
+            
+        os.remove(fName)
+        
+        return chunk
+        
+        
+        
+def ConvertColumnBuffers(data):
+    ''' Copy of the data structure demod -> key -> (ePair ->) value
+        with all column buffers converted to arrays.
+    '''
+    
+    converted = {}
+    
+    for demod, container in list(data.items()):
+        
+        if not isinstance(container, dict):
+            converted[demod] = container
+            continue
+        
+        converted[demod] = OrderedDict()
+        
+        for key, val in container.items():
+            if isinstance(val, dict):
+                converted[demod][key] = { k: v.GetArray() if isinstance(v, ColumnBuffer) else v for k,v in val.items() }
+            else:
+                converted[demod][key] = val
+                
+    return converted
+    
+    
+    
+def SaveMat(fName, data):
+    ''' scipy.io.savemat, scipy takes long to load so it is imported on first call
+    '''
+    from scipy import io
+    
+    io.savemat(fName, data)
+    
+    
+    
 class DataSaver:
     
     # default parameters for storing determination
@@ -34,8 +372,15 @@ class DataSaver:
     # supported stream modes
     __storageModes__     = ['fileSize', 'recordTime', 'eventSync']
     
+    # supported storage backends
+    __storageBackends__  = ['mat', 'hdf5']
+    
+    # max number of files (or hdf5 chunks) waiting for the writer thread
+    # saving blocks when the writer is that far behind to keep memory bounded
+    __maxPendingWrites__ = 4
+    
     def __init__(self, matlabKey='Simulator', baseFolder='./mat_files/', 
-                 filePrefix='stream', storageMode='fileSize', 
+                 filePrefix='stream', storageMode='fileSize', storageBackend='mat',
                  streamFileSize=None, streamTime=None, 
                  fileSizeScaler=None, timeLenScaler=None, **flags):
         
@@ -48,6 +393,13 @@ class DataSaver:
         else:
             raise Exception('Unsupported storage mode: %s' % storageMode)
         
+        # check for valid storage backend
+        # mat files are written as a whole, hdf5 is appended chunk by chunk
+        if storageBackend in self.__storageBackends__:
+            self._storageBackend = storageBackend
+        else:
+            raise Exception('Unsupported storage backend: %s' % storageBackend)
+        
         self._maxStreamFileSize = 0
         self._maxStreamTime     = 0
         
@@ -63,6 +415,7 @@ class DataSaver:
         
         # store mat files under this path
         self._baseFolder    = ''
+        self._sessionFolder = ''
         self._streamFolder  = ''
         self._folderCounter = 0
         # store data under name
@@ -70,6 +423,18 @@ class DataSaver:
         # use a counter to store multiple files
         self._fileCounter   = 0
         
+        # files are written by a separate thread, so file rotation does not stall data processing
+        self._writeInBackground = flags.get('writeInBackground', True)
+        self._pendingWrites      = queue.Queue(maxsize=flags.get('maxPendingWrites', self.__maxPendingWrites__))
+        self._numPendingWrites   = 0
+        self._writerCondition   = threading.Condition()
+        self._writerThread      = None
+        
+        # hdf5 file is created on first write, one per session
+        self._hdf5Storage       = None
+        self._hdf5Compression   = flags.get('hdf5Compression', None)
+        self._hdf5ChunkSize     = flags.get('hdf5ChunkSize'  , None)
+        
         self.SetBaseFolder(baseFolder)
         
 ### --------------------------------------------------------------------------------------------------
@@ -78,8 +443,9 @@ class DataSaver:
         assert isinstance(baseFolder, str), 'Expect string, not %r' % type(baseFolder)
         
         if self._CreateBaseFolder(baseFolder):
-            self._baseFolder   = baseFolder
-            self._streamFolder = baseFolder
+            self._baseFolder    = baseFolder
+            self._sessionFolder = baseFolder
+            self._streamFolder  = baseFolder
         else:
             Exception('Cannot access \'%s\' for writing!')
         
@@ -99,20 +465,146 @@ class DataSaver:
         
 ### --------------------------------------------------------------------------------------------------
         
-    def SaveData(self):
+    def SaveData(self, data, inBackground=None):
+        ''' Store data as mat file, by default handed over to the writer thread.
+            Column buffers in data are converted to arrays, see ConvertColumnBuffers.
+        '''
         
         fName = self._streamFolder + self._filePrefix + '%05d.mat'%self._fileCounter
         
+        # column buffers cannot be stored as they are
+        data = ConvertColumnBuffers(data)
+        
 #        print(fName)
 #        print(self._matlabKey)
 #        print(self._data)
         
-        # store the file
-        io.savemat(fName, {self._matlabKey: self._data})
+        if inBackground is None:
+            inBackground = self._writeInBackground
+        
+        # hand the file over to the writer thread
+        if inBackground:
+            
+            self._StartWriter()
+            
+            with self._writerCondition:
+                self._numPendingWrites += 1
+            
+            # blocks in case too many files are pending
+            self._pendingWrites.put( (SaveMat, (fName, {self._matlabKey: data})) )
+            
+        # or store the file right away
+        else:
+            SaveMat(fName, {self._matlabKey: data})
         
         # increment file counter
         self._fileCounter += 1
         
+### --------------------------------------------------------------------------------------------------
+        
+    def AppendData(self, chunk, attrs=None):
+        ''' Append a processed chunk to the hdf5 file of the current session.
+            See Hdf5Storage.Append for the structure of chunk and attrs.
+        '''
+        
+        if not self._hdf5Storage:
+            fName = self._sessionFolder + self._filePrefix + '.h5'
+            self._hdf5Storage = Hdf5Storage(fName, self._hdf5Compression, self._hdf5ChunkSize)
+            
+        self._StartWriter()
+        
+        with self._writerCondition:
+            self._numPendingWrites += 1
+        
+        # blocks in case too many chunks are pending
+        self._pendingWrites.put( (self._hdf5Storage.Append, (chunk, attrs)) )
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def FlushData(self, inBackground=None):
+        ''' Write the data collected by the hdf5 storage to the file,
+            waits till it is stored unless it is done in the background.
+        '''
+        
+        if inBackground is None:
+            inBackground = self._writeInBackground
+        
+        if self._hdf5Storage:
+            
+            self._StartWriter()
+            
+            with self._writerCondition:
+                self._numPendingWrites += 1
+            
+            self._pendingWrites.put( (self._hdf5Storage.Flush, ()) )
+        
+        if not inBackground:
+            self.WaitForPendingWrites()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def _StartWriter(self):
+        
+        if not self._writerThread:
+            self._writerThread = threading.Thread(target=self._Writer)
+            self._writerThread.start()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def _Writer(self):
+        ''' Writer loop.
+            Executes the write tasks handed over by SaveData or AppendData till None is received.
+        '''
+        
+        while True:
+            
+            task = self._pendingWrites.get()
+            
+            # stop signal
+            if task is None:
+                break
+            
+            func, args = task
+            
+            # any error must not end the writer, otherwise everybody handing over data waits forever
+            try:
+                func(*args)
+            except Exception as e:
+                coreUtils.SafeLogger('error', 'Could not write data: %s' % e, self)
+            finally:
+                # wake up everybody who is waiting for the files
+                with self._writerCondition:
+                    self._numPendingWrites -= 1
+                    self._writerCondition.notify_all()
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def WaitForPendingWrites(self, timeout=None):
+        ''' Block till all data handed over to the writer thread is stored.
+            Returns False in case the timeout expired before.
+        '''
+        
+        with self._writerCondition:
+            return self._writerCondition.wait_for(lambda: self._numPendingWrites == 0, timeout)
+        
+### --------------------------------------------------------------------------------------------------
+        
+    def StopWriter(self):
+        ''' Store all pending data and stop the writer thread.
+            The hdf5 file is closed, so it can be read till the next write.
+        '''
+        
+        if self._writerThread:
+            self.WaitForPendingWrites()
+            
+            self._pendingWrites.put(None)
+            self._writerThread.join()
+            
+            self._writerThread = None
+            
+        if self._hdf5Storage:
+            self._hdf5Storage.Close()
+        
 ### --------------------------------------------------------------------------------------------------
         
     def CreateNewStreamFolder(self):
@@ -123,6 +615,14 @@ class DataSaver:
         if coreUtils.SafeMakeDir(sF, self):
             sF += 'session_' + self.coreStartTime + '/'
             if coreUtils.SafeMakeDir(sF, self):
+                # hdf5 file of the session is stored here
+                if sF != self._sessionFolder:
+                    # file of the last session is completed and closed first
+                    self.StopWriter()
+                    
+                    self._sessionFolder = sF
+                    self._hdf5Storage   = None
+                    
                 sF += 'stream%04d/' % self._folderCounter
                 if coreUtils.SafeMakeDir(sF, self):
                     # set new stream folder to class var
@@ -171,14 +671,118 @@ class DataSaver:
 ### --------------------------------------------------------------------------------------------------
         
 ### --------------------------------------------------------------------------------------------------
+    
+
+# electrode pair for every possible combination of the five DIO bits
+# Arduino writes them MSB first, HF2 reads them LSB first, so bit order is reversed
+ePairLut = np.array([int(format(i, '05b')[::-1], 2) for i in range(32)], dtype=np.int64)
+
+### --------------------------------------------------------------------------------------------------
+
+def DioToElectrodePairs(dio):
+    ''' HF2 DIO lines are stored in a 32 bit number
+        cut relevant bits and switch order
+        DIO24 - Pin8 ... DIO20 - Pin12
+        so MSB in Arduino is LSB for HF2
+        return decimal numbers from the cut 5 bits as integer array
+    '''
+    dio = np.asarray(dio).astype(np.int64, copy=False)
+    
+    return ePairLut[ (dio >> 20) & 0x1F ]
+
+### --------------------------------------------------------------------------------------------------
 
-globalTimeList = []
+def GroupElectrodePairs(ePairs):
+    ''' groups the samples by electrode pair with a single stable sort
+        returns the sort order (None if ePairs is already sorted) and an
+        ordered dictionary with the electrode pairs as key and their
+        corresponding slice in the sorted data
+    '''
+    
+    ePairs = np.asarray(ePairs)
+    slices = OrderedDict()
+    
+    if len(ePairs) == 0:
+        return None, slices
+    
+    # only sort if necessary, e.g. when the Arduino switched to a lower electrode pair
+    if np.all(ePairs[1:] >= ePairs[:-1]):
+        order = None
+    else:
+        order  = np.argsort(ePairs, kind='stable')
+        ePairs = ePairs[order]
+    
+    # every change of the value starts a new electrode pair
+    starts = np.flatnonzero(ePairs[1:] != ePairs[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    stops  = np.concatenate((starts[1:], [len(ePairs)]))
+    
+    for start, stop in zip(starts, stops):
+        slices['ePair_%s' % ePairs[start]] = slice(start, stop)
+    
+    return order, slices
+
+### --------------------------------------------------------------------------------------------------
+
+def PartitionDemodData(data, tRef, clock, out=None):
+    ''' split the samples of one demodulator into electrode pairs
+        returns the slices per electrode pair and the columns x, y, r and t
+        sorted by electrode pair, so slicing them afterwards only returns views
+        out: optional arrays x, y, r and t the columns are written to, e.g. shared memory
+    '''
+    
+    # partition the chunk once by electrode pair
+    # all keys of this demodulator share the same sort order and slices
+    order, slices = GroupElectrodePairs( DioToElectrodePairs(data['dio']) )
+    
+    if out is None:
+        columns = OrderedDict()
+        
+        # bring sampled columns in electrode pair order
+        for key in ['x', 'y']:
+            columns[key] = data[key] if order is None else data[key][order]
+        
+        timestamp = data['timestamp'] if order is None else data['timestamp'][order]
+        
+        # data that is not originally there
+        columns['r'] = np.sqrt( columns['x']**2 + columns['y']**2 )
+        columns['t'] = (timestamp - tRef) / clock
+        
+        return slices, columns
+    
+    # same as above, but written to the given arrays
+    for key in ['x', 'y']:
+        if order is None:
+            out[key][:] = data[key]
+        else:
+            np.take(data[key], order, out=out[key])
+    
+    timestamp = data['timestamp'] if order is None else data['timestamp'][order]
+    
+    np.square(out['x'], out=out['r'])
+    out['r'] += np.square(out['y'])
+    np.sqrt(out['r'], out=out['r'])
+    
+    # integer difference like above, converted when stored
+    np.subtract(timestamp, tRef, out=out['t'], casting='unsafe')
+    out['t'] /= clock
+    
+    return slices, out
+
+### --------------------------------------------------------------------------------------------------
     
 
 class DataProcessor(DataSaver):
     
     __lockInAmpClock__ = 210e6
     
+    # see DioToElectrodePairs
+    __ePairLut__ = ePairLut
+    
+    # max number of chunks waiting for the processor, see ChunkQueue
+    __maxQueueDepth__ = 100
+    __queuePolicy__   = 'block'
+    
     def __init__(self, **flags):
         
         DataSaver.__init__(self, **flags)
@@ -195,12 +799,16 @@ class DataProcessor(DataSaver):
         
         # pipeline for new incoming data
         # gets processed in an ordered fashion in _DataProcessor
-        self._newDataQueue = queue.Queue()
+        self._newDataQueue = ChunkQueue( flags.get( 'maxQueueDepth', self.__maxQueueDepth__ ),
+                                         flags.get( 'queuePolicy'  , self.__queuePolicy__   ),
+                                         self._baseFolder + 'spill/' )
 
         self._queueThread = None
-
-        # thread condition to sleep while no data is available
-        self._newDataEvent = threading.Event()
+        
+        # split demodulators in parallel worker processes, see DemodWorkerPool
+        # NOTE: only pays off for several demodulators and large polls, so it's off by default
+        self._useDemodWorkers = flags.get('demodWorkers', False)
+        self._demodWorkerPool = None
         
         # initially no data processor is running
         self._activeProcessor = False
@@ -211,12 +819,23 @@ class DataProcessor(DataSaver):
         
         # call stop to make sure all data chunks in the queue have been processed
         self.Stop()
+        
+        if self._demodWorkerPool:
+            self._demodWorkerPool.Close()
+            self._demodWorkerPool = None
 
 ### --------------------------------------------------------------------------------------------------
     
-    def _SaveData(self):
-        self.SaveData()
-        self._ResetData()
+    def _SaveData(self, inBackground=None):
+        
+        # hdf5 data is already on its way to the file
+        # keep the data structure, so tRef stays the same for the whole session
+        if self._storageBackend == 'hdf5':
+            self.FlushData(inBackground)
+            self._dataSize = 0
+        else:
+            self.SaveData(self._data, inBackground)
+            self._ResetData()
         
 ### --------------------------------------------------------------------------------------------------
     
@@ -237,37 +856,35 @@ class DataProcessor(DataSaver):
         while self._activeProcessor:
              
             # get next task from queue
-            try:
-                newData = self._newDataQueue.get(block=False)
-            except queue.Empty:
-                # in case queue is empty wait for more data        
-                self._newDataEvent.clear()
-                self._newDataEvent.wait()#timeout=1e-4)
-            else:
-                st = perf_counter()
+            # blocks till new data is available or the queue was closed
+            task = self._newDataQueue.Get()
+            
+            if task is None:
+                continue
+            
+            newData, enqueueTime = task
+            
+            st = perf_counter()
 
-                self.DataProcessor(newData)
-                
-                # estimate size
-                # NOTE: several parts are missing here, like r, psd and motility - add them later to make it faster
-                self._dataSize = coreUtils.GetTotalSize(self._data)
-                
-                # indicate that current task was done
-                self._newDataQueue.task_done()
-                
-                globalTimeList.append(perf_counter()-st)
+            # NOTE: data size is updated while appending the new data
+            self.DataProcessor(newData)
+            
+            # check, according to strorage mode, if it's necessary to store a new file
+            if self._storageMode == 'fileSize':
+                if self.GetDataSize(self._fileSizeScaler) > self._maxStreamFileSize:
+                    self._SaveData()
+                    
+            elif self._storageMode == 'recordTime':
+                if self.GetRunTime(self._timeLenScaler) > self._maxStreamTime:
+                    self._SaveData()
+                    # next file covers the next period
+                    self._startTime = time()
+
+            elif self._storageMode == 'eventSync':
+                None
                 
-                # check, according to strorage mode, if it's necessary to store a new file
-                if self._storageMode == 'fileSize':
-                    if self.GetDataSize(self._fileSizeScaler) > self._maxStreamFileSize:
-                        self._SaveData()
-                        
-                elif self._storageMode == 'recTime':
-                    if self.GetRunTime(self._timeLenScaler) > self._maxStreamTime:
-                        self._SaveData()
-                        
-                elif self._storageMode == 'eventSync':
-                    None
+            # indicate that current task was done
+            self._newDataQueue.TaskDone(st - enqueueTime, perf_counter() - st)
         
 ### --------------------------------------------------------------------------------------------------
                     
@@ -277,6 +894,12 @@ class DataProcessor(DataSaver):
             handling is desired.
         '''
         
+        # in case of streaming to hdf5 new data is collected here and appended to the file at once
+        chunk = {}
+        attrs = {}
+        
+        demods = []
+        
         for demod,data in newData.items():
             
             # extract demod number from string
@@ -287,66 +910,65 @@ class DataProcessor(DataSaver):
             if demod not in self._data.keys():
                 self._data[demod] = self._DefaultDataContainer()
             
-            # copy new data to local structure and change a bit the appearance
-            # we need to slice some of the data and also add electrode pairs calculated from 'dio'
-            # so first get new ePairs
-            ePairs = self.DioToElectrodePair( data['dio'] )
+            # single values that need the first index
+            if self._data[demod]['frequency'] == -1:
+                self._data[demod]['frequency'] = data['frequency'][0]
+                
+            if self._data[demod]['tRef'] == -1:
+                self._data[demod]['tRef'] = data['timestamp'][0]
+                
+            demods.append( (demod, data, self._data[demod]['tRef']) )
             
-            # get slice indices from electrode pairs to slice special values
-            sliceIdices = self.SliceIdices(ePairs)
+        # copy new data to local structure and change a bit the appearance
+        # we need to slice the data according to the electrode pairs calculated from 'dio'
+        # either in parallel worker processes or one after another
+        if self._demodWorkerPool:
+            partitions = self._demodWorkerPool.Process(demods)
+        else:
+            partitions = [self.PartitionDemodData(data, tRef) for _, data, tRef in demods]
             
-            # go through all the keys in the class member
-            for key in self._data[demod].keys():
+        for (demod, _, _), (sliceIdices, columns) in zip(demods, partitions):
             
-                # OR single value that need the first index
-                if key == 'frequency':
-                    if self._data[demod][key] == -1:
-                        self._data[demod][key] = data[key][0]
+            # go through all the keys in the class member
+            for key, val in self._data[demod].items():
                 
-                # OR single value that need the first index from another key
-                elif key == 'tRef':
-                    if self._data[demod][key] == -1:
-                        self._data[demod][key] = data['timestamp'][0]
+                # single values were already set
+                if not isinstance(val, dict):
+                    continue
                 
-                # OR slicing is necessary
-                else:
-                    # slice x,y and others with given slice indices
-                    # NOTE: uniques always returns a sorted list
-                    for k,slices in sliceIdices.items():
-                        
-                        # get new np array in case electrode pairs was never used before
-                        if k not in self._data[demod][key].keys():
-                            self._data[demod][key][k] = sp.array([])
-                            
-                        # data that is originally there but needs to be sliced
-                        if key in data.keys():
-                            self._data[demod][key][k] = sp.concatenate( [self._data[demod][key][k], data[key][slices]] )
+                # NOTE: motility, counts, psd and spectrum are not calculated so far
+                column = columns.get(key)
+                
+                # worker results live in shared memory which is reused with the next poll,
+                # so the hdf5 writer needs its own copy
+                if column is not None and self._demodWorkerPool and self._storageBackend == 'hdf5':
+                    column = column.copy()
+                    
+                # slice x,y and others with given slice indices
+                for k,slices in sliceIdices.items():
+                    
+                    # bytes are counted till the next flush, see _SaveData
+                    if self._storageBackend == 'hdf5':
+                        if column is not None:
+                            chunk[(demod, k, key)] = column[slices]
+                            self._dataSize        += chunk[(demod, k, key)].nbytes
+                        continue
+                    
+                    # get new column buffer in case electrode pairs was never used before
+                    if k not in val.keys():
+                        val[k] = ColumnBuffer()
                         
-                        # data that is not originally there but still has to be slices
-                        # NOTE: x and y get sliced a second time here...can be improved
-                        elif key == 'r':
+                    # keep track of the buffered bytes
+                    if column is not None:
+                        self._dataSize += val[k].Append( column[slices] )
                             
-                            r = sp.sqrt( data['x'][slices]**2 + data['y'][slices]**2 )
-                            self._data[demod]['r'][k] = sp.concatenate( [self._data[demod]['r'][k], r] )
-                            
-                            # and don't forget to update size
-#                            self._dataSize += coreUtils.GetTotalSize(r)
-
-                        # OR values that need a reference first
-                        elif key == 't':
-                            if self._data[demod]['tRef'] != -1:
-                                t = (data['timestamp'][slices] - self._data[demod]['tRef']) / self.__lockInAmpClock__
-                                self._data[demod][key][k] = sp.concatenate( [self._data[demod][key][k], t] )
-                                     
-
-                        elif key == 'motility':
-                            None
-                        elif key == 'counts':
-                            None
-                        elif key == 'psd':
-                            None
-                        elif key == 'spectrum':
-                            None
+            attrs[demod] = {
+                    'frequency': self._data[demod]['frequency'],
+                    'tRef'     : self._data[demod]['tRef']
+                }
+        
+        if chunk:
+            self.AppendData(chunk, attrs)
         
 ### --------------------------------------------------------------------------------------------------
                     
@@ -357,16 +979,29 @@ class DataProcessor(DataSaver):
         if newData:
             # user data is pushed into parallel thread to ensure fast return
             # actual processing takes place in _DataProcessor
-            self._newDataQueue.put(newData, False)
-            
-            self._newDataEvent.set()
+            # NOTE: in case the queue is full this might block, drop or spill data, see ChunkQueue
+            self._newDataQueue.Put(newData)
         
 ### --------------------------------------------------------------------------------------------------
     
     def Start(self):
         
+        # workers are kept alive between runs, starting processes takes a while
+        if self._useDemodWorkers and not self._demodWorkerPool and (os.cpu_count() or 1) <= 1:
+            coreUtils.SafeLogger('warning', 'Only one CPU available, demodulators are processed without workers.', self)
+            self._useDemodWorkers = False
+            
+        if self._useDemodWorkers and not self._demodWorkerPool:
+            try:
+                from libs.DemodWorkerPool import DemodWorkerPool
+            except ImportError:
+                from DemodWorkerPool import DemodWorkerPool
+                
+            self._demodWorkerPool = DemodWorkerPool(self.__lockInAmpClock__)
+        
         # enable data procesor to run
         self._activeProcessor = True
+        self._newDataQueue.Open()
         # get new thread instance
         self._queueThread = threading.Thread(target=self._Dequeuer)
         # start thread
@@ -380,23 +1015,27 @@ class DataProcessor(DataSaver):
     def Stop(self):
         
         # test if something is still in the pipe
-        # join waits until last task_done was called
-        self._newDataQueue.join()
+        # join waits until last TaskDone was called
+        if self._activeProcessor:
+            self._newDataQueue.Join()
         # so here we're safe to kill the process loop
         self._activeProcessor = False
-        # call a last time set although no data will be available
+        # wake up the processor loop although no data will be available
         # only to exit the while loop and finish the thread
-        self._newDataEvent.set()
-        self._newDataEvent.clear()
+        self._newDataQueue.Close()
 
         # wait for process watcher
         if self._queueThread:
             self._queueThread.join()
+            self._queueThread = None
+        
+        # make sure all files are on disk before leaving
+        self.StopWriter()
         
         # here we are sure nothing is running
-        # so we can save the rest of the data
+        # so we can save the rest of the data right away
         if self.GetDataSize() > 0:
-            self._SaveData()
+            self._SaveData(inBackground=False)
 
         self.ResetFileCounter()
         
@@ -427,18 +1066,18 @@ class DataProcessor(DataSaver):
         
 ### --------------------------------------------------------------------------------------------------
                     
-    def SliceIdices(self, lst):
-        ''' returns a dictionary with all unique elements in lst as key
-            with their corresponding indices in lst
+    def PartitionDemodData(self, data, tRef):
+        ''' returns the slices per electrode pair and the sorted columns, see PartitionDemodData
         '''
+        return PartitionDemodData(data, tRef, self.__lockInAmpClock__)
         
-        items = self.Uniques(lst)
-        ind   = defaultdict(list)
-        
-        for i, v in enumerate(lst):
-            if v in items: ind['ePair_%s'%v].append(i)
-        
-        return ind
+### --------------------------------------------------------------------------------------------------
+                    
+    def SliceIdices(self, ePairs):
+        ''' returns the sort order and the slice of every electrode pair in
+            the sorted data, see GroupElectrodePairs
+        '''
+        return GroupElectrodePairs(ePairs)
     
 ### --------------------------------------------------------------------------------------------------
                     
@@ -473,22 +1112,20 @@ class DataProcessor(DataSaver):
 ### --------------------------------------------------------------------------------------------------
                     
     def DioToElectrodePair(self, dio):
-        ''' HF2 DIO lines are stored in a 32 bit number
-            cut relevant bits and switch order
-            DIO24 - Pin8 ... DIO20 - Pin12
-            so MSB in Arduino is LSB for HF2
-            return decimal number from the cut 5 bits
+        ''' returns the electrode pair of every DIO sample, see DioToElectrodePairs
         '''
-        return [ int(format(int(i), '032b')[7:12][::-1], 2) for i in dio]
+        return DioToElectrodePairs(dio)
         
 ### --------------------------------------------------------------------------------------------------
                     
     def GetData(self):
-        ''' Return the current data structure.
+        ''' Return the current data structure with all column buffers
+            converted to arrays, e.g. for storing it as mat file.
             NOTE: Can already be changed while it is returned
                   when processor is running!
         '''
-        return self._data
+        
+        return ConvertColumnBuffers(self._data)
     
 ### --------------------------------------------------------------------------------------------------
                     
@@ -507,6 +1144,14 @@ class DataProcessor(DataSaver):
         else:
             Exception('Unknown scaler: %s' % scale)
             
+### --------------------------------------------------------------------------------------------------
+                    
+    def GetQueueStats(self):
+        ''' Return depth, drop/spill counters and the wait and processing
+            time per chunk of the incoming data queue, see ChunkQueue.GetStats
+        '''
+        return self._newDataQueue.GetStats()
+            
 ### --------------------------------------------------------------------------------------------------
                     
     def GetRunTime(self, scale='min'):
@@ -552,8 +1197,12 @@ if __name__ == '__main__':
             
     dataProcessor.Stop()
     
-    print('avg time expired: %3.5f ms' % (sp.mean(t)*1000))
-    print('avg time for proc: %3.5f ms' % (sp.mean(globalTimeList)*1000))
+    print('avg time expired: %3.5f ms' % (np.mean(t)*1000))
+    stats = dataProcessor.GetQueueStats()
+    
+    print('avg time for proc: %3.5f ms' % (stats['procTime']['mean']*1000))
+    print('avg time waiting: %3.5f ms'  % (stats['waitTime']['mean']*1000))
+    print('max queue depth: %s'         % stats['maxDepth'])
     
 #    print('size: %2.3f MB' % (dataProcessor.GetDataSize()/1024**2))
     
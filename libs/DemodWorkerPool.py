@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:41:05 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import traceback
+import multiprocessing as mp
+import numpy as np
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+try:
+    from libs.DataProcessor import PartitionDemodData
+except ImportError:
+    from DataProcessor import PartitionDemodData
+
+
+
+# layout of the shared memory blocks, one block per field
+__inFields__  = [('x', '<f8'), ('y', '<f8'), ('timestamp', '<u8'), ('dio', '<u8')]
+__outFields__ = [('x', '<f8'), ('y', '<f8'), ('r', '<f8'), ('t', '<f8')]
+
+### --------------------------------------------------------------------------------------------------
+
+def _GetViews(shm, fields, capacity):
+    ''' return one array per field on top of the shared memory block
+    '''
+
+    views  = OrderedDict()
+    offset = 0
+
+    for field, dtype in fields:
+        views[field] = np.ndarray((capacity,), dtype=dtype, buffer=shm.buf, offset=offset)
+        offset      += capacity * np.dtype(dtype).itemsize
+
+    return views
+
+### --------------------------------------------------------------------------------------------------
+
+def _Worker(conn, clock):
+    ''' Worker loop for a single demodulator.
+        Receives the number of samples and the shared memory names, splits
+        the data into electrode pairs and writes the sorted columns back.
+    '''
+
+    inShm  = None
+    outShm = None
+
+    while True:
+
+        task = conn.recv()
+
+        # stop signal
+        if task is None:
+            break
+
+        numSamples, tRef, capacity, inName, outName = task
+
+        try:
+            # parent allocated bigger blocks
+            if not inShm or inShm.name != inName:
+                if inShm:
+                    inShm.close()
+                    outShm.close()
+
+                inShm  = shared_memory.SharedMemory(name=inName)
+                outShm = shared_memory.SharedMemory(name=outName)
+
+                inViews  = _GetViews(inShm , __inFields__ , capacity)
+                outViews = _GetViews(outShm, __outFields__, capacity)
+
+            data = { key: view[:numSamples] for key, view in inViews.items() }
+            out  = { key: view[:numSamples] for key, view in outViews.items() }
+
+            # sorted columns are written straight into shared memory
+            slices, _ = PartitionDemodData(data, tRef, clock, out)
+
+            conn.send( [(k, s.start, s.stop) for k, s in slices.items()] )
+
+        except Exception:
+            conn.send( traceback.format_exc() )
+
+    if inShm:
+        inShm.close()
+        outShm.close()
+
+
+
+class DemodWorkerPool:
+    ''' One persistent worker process per demodulator.
+        Input arrays and sorted results are exchanged via shared memory,
+        only the electrode pair slices are sent through the pipe.
+        Every poll costs a round trip to each worker of a few ms, so this
+        only pays off when partitioning a poll takes longer than that, i.e.
+        for several demodulators with thousands of samples per poll each
+        and one free core per demodulator. For typical polls of a few
+        hundred samples processing in the data processor thread is faster.
+        NOTE: workers always use PartitionDemodData, overriding the
+              corresponding DataProcessor methods has no effect here
+    '''
+
+    # initial number of samples per shared memory block, grows when necessary
+    __initCapacity__ = 2**15
+
+    # seconds to wait for a worker to finish when closing
+    __joinTimeout__ = 5
+
+    def __init__(self, clock):
+
+        self._clock   = clock
+        self._workers = {}
+
+        # spawn instead of fork, since the data processor is already running threads
+        self._context = mp.get_context('spawn')
+
+### --------------------------------------------------------------------------------------------------
+
+    def __del__(self):
+        self.Close()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Process(self, demods):
+        ''' Process a list of (demod, data, tRef) in parallel.
+            Returns (slices, columns) for each demodulator in the same order,
+            columns are views on shared memory and only valid till the next call.
+        '''
+
+        # hand out all demodulators first
+        for demod, data, tRef in demods:
+
+            worker     = self._GetWorker(demod)
+            numSamples = len(data['timestamp'])
+
+            self._EnsureCapacity(worker, numSamples)
+
+            for key, view in worker['inViews'].items():
+                view[:numSamples] = data[key]
+
+            worker['conn'].send( (numSamples, tRef, worker['capacity'], worker['inShm'].name, worker['outShm'].name) )
+
+        results = []
+
+        # and collect the results in order
+        for demod, data, _ in demods:
+
+            worker     = self._workers[demod]
+            numSamples = len(data['timestamp'])
+
+            try:
+                reply = worker['conn'].recv()
+            except (EOFError, OSError):
+                raise Exception('Worker for %s died!' % demod)
+
+            if isinstance(reply, str):
+                raise Exception('Worker for %s failed:\n%s' % (demod, reply))
+
+            # worker is attached to the new blocks, so old ones can be released
+            self._ReleaseRetired(worker)
+
+            slices  = OrderedDict( (k, slice(start, stop)) for k, start, stop in reply )
+            columns = OrderedDict( (key, view[:numSamples]) for key, view in worker['outViews'].items() )
+
+            results.append( (slices, columns) )
+
+        return results
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self):
+        ''' Stop all workers and release the shared memory.
+        '''
+
+        for worker in self._workers.values():
+
+            # worker might already be gone
+            try:
+                worker['conn'].send(None)
+            except OSError:
+                pass
+
+            worker['process'].join(self.__joinTimeout__)
+
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+
+            worker['conn'].close()
+
+            self._ReleaseRetired(worker)
+
+            for shm in [worker['inShm'], worker['outShm']]:
+                if shm:
+                    shm.close()
+                    shm.unlink()
+
+        self._workers = {}
+
+### --------------------------------------------------------------------------------------------------
+
+    def _GetWorker(self, demod):
+
+        if demod not in self._workers:
+
+            conn, workerConn = self._context.Pipe()
+
+            process = self._context.Process(target=_Worker, args=(workerConn, self._clock), daemon=True)
+            process.start()
+
+            self._workers[demod] = {
+                    'process' : process,
+                    'conn'    : conn,
+                    'capacity': 0,
+                    'inShm'   : None,
+                    'outShm'  : None,
+                    'retired' : []
+                }
+
+        return self._workers[demod]
+
+### --------------------------------------------------------------------------------------------------
+
+    def _EnsureCapacity(self, worker, numSamples):
+
+        if numSamples <= worker['capacity']:
+            return
+
+        capacity = max(self.__initCapacity__, 2*worker['capacity'])
+        while capacity < numSamples:
+            capacity *= 2
+
+        # old blocks are still attached by the worker, release them after its next reply
+        if worker['inShm']:
+            worker['retired'] += [worker['inShm'], worker['outShm']]
+
+        worker['capacity'] = capacity
+        worker['inShm']    = shared_memory.SharedMemory(create=True, size=capacity*8*len(__inFields__ ))
+        worker['outShm']   = shared_memory.SharedMemory(create=True, size=capacity*8*len(__outFields__))
+        worker['inViews']  = _GetViews(worker['inShm'] , __inFields__ , capacity)
+        worker['outViews'] = _GetViews(worker['outShm'], __outFields__, capacity)
+
+### --------------------------------------------------------------------------------------------------
+
+    def _ReleaseRetired(self, worker):
+
+        for shm in worker['retired']:
+            shm.close()
+            shm.unlink()
+
+        worker['retired'] = []
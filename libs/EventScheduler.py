@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:46:12 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import heapq
+import itertools
+import threading
+import traceback
+import numpy as np
+
+from time import monotonic
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+
+
+class EventScheduler:
+    ''' Runs callbacks at a given time (monotonic clock) on a bounded pool of worker threads.
+        All pending callbacks are kept in one heap, handled by a single timer thread.
+        Callbacks with the same key run one after another in the order they were due,
+        callbacks with different keys run in parallel.
+        Lateness of every callback (start time - due time) is recorded per key.
+    '''
+
+    # number of lateness values kept per key for the metrics
+    __maxSamples__ = 1000
+
+    def __init__(self, numWorkers=4, name='EventScheduler', caller=None):
+
+        self._name    = name
+        self._caller  = caller                  # its logger is used for errors of the callbacks
+        self._pool    = ThreadPoolExecutor(max_workers=numWorkers, thread_name_prefix=name)
+        self._heap    = []
+        self._counter = itertools.count()       # keeps order of callbacks due at the same time
+        self._lock    = threading.Condition()
+        self._running = True
+
+        # callbacks which are due, per key, first one is running
+        self._keyQueues = {}
+
+        # key -> metrics
+        self._metrics = {}
+
+        self._timerThread = threading.Thread(target=self._TimerLoop, name='%sTimer' % name, daemon=True)
+        self._timerThread.start()
+
+### --------------------------------------------------------------------------------------------------
+
+    def __del__(self):
+        self.Close(wait=False)
+
+### --------------------------------------------------------------------------------------------------
+
+    def Schedule(self, due, func, key=None):
+        ''' Run func at the monotonic time due, right away when due has already passed.
+            Returns the entry, which can be passed to Cancel.
+        '''
+
+        entry = {'due': due, 'func': func, 'key': key, 'cancelled': False}
+
+        with self._lock:
+
+            if not self._running:
+                raise Exception('%s was closed!' % self._name)
+
+            heapq.heappush( self._heap, (due, next(self._counter), entry) )
+
+            # timer might wait for a later callback
+            if self._heap[0][2] is entry:
+                self._lock.notify()
+
+        return entry
+
+### --------------------------------------------------------------------------------------------------
+
+    def Cancel(self, entry=None, key=None):
+        ''' Cancel a single entry or all callbacks of key, which were not started yet.
+            Returns the number of cancelled callbacks.
+        '''
+
+        numCancelled = 0
+
+        with self._lock:
+
+            if entry is not None:
+                candidates = [entry]
+            else:
+                candidates  = [e for _, _, e in self._heap if e['key'] == key]
+                # first one in the queue is already running
+                candidates += list(self._keyQueues.get(key, []))[1:]
+
+            for e in candidates:
+                if not e['cancelled']:
+                    e['cancelled'] = True
+                    numCancelled  += 1
+                    self._GetMetrics(e['key'])['numCancelled'] += 1
+
+        return numCancelled
+
+### --------------------------------------------------------------------------------------------------
+
+    def NumPending(self):
+        ''' Number of callbacks which are not finished yet
+        '''
+
+        with self._lock:
+            return sum( not e['cancelled'] for _, _, e in self._heap ) + sum( len(q) for q in self._keyQueues.values() )
+
+### --------------------------------------------------------------------------------------------------
+
+    def GetMetrics(self, select=None):
+        ''' Metrics of all keys for which select(key) is True (all keys if not given).
+            Lateness is given in seconds.
+        '''
+
+        with self._lock:
+            metrics = [m for k, m in self._metrics.items() if select is None or select(k)]
+
+            lateness = np.array( [l for m in metrics for l in m['lateness']] )
+
+            result = {
+                    'numCalls'    : sum( m['numCalls']     for m in metrics ),
+                    'numCancelled': sum( m['numCancelled'] for m in metrics ),
+                    'numErrors'   : sum( m['numErrors']    for m in metrics ),
+                    'lateMax'     : max( [m['lateMax'] for m in metrics], default=0. )
+                }
+
+        if len(lateness):
+            result.update( {
+                    'lateMean': float( lateness.mean() ),
+                    'late50'  : float( np.percentile(lateness, 50) ),
+                    'late95'  : float( np.percentile(lateness, 95) )
+                } )
+
+        return result
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self, wait=True):
+        ''' Stop the timer, pending callbacks are dropped.
+            wait: wait for running callbacks to finish
+        '''
+
+        with self._lock:
+
+            if not self._running:
+                return
+
+            self._running = False
+            self._heap    = []
+            self._lock.notify()
+
+            # keep running ones, but drop the rest
+            for queue in self._keyQueues.values():
+                for entry in list(queue)[1:]:
+                    entry['cancelled'] = True
+
+        if threading.current_thread() is not self._timerThread:
+            self._timerThread.join()
+
+        self._pool.shutdown(wait=wait)
+
+### --------------------------------------------------------------------------------------------------
+
+    def _TimerLoop(self):
+
+        with self._lock:
+
+            while self._running:
+
+                # drop cancelled callbacks right away
+                while self._heap and self._heap[0][2]['cancelled']:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._lock.wait()
+                    continue
+
+                timeout = self._heap[0][0] - monotonic()
+
+                if timeout > 0:
+                    self._lock.wait(timeout)
+                    continue
+
+                _, _, entry = heapq.heappop(self._heap)
+
+                queue = self._keyQueues.setdefault(entry['key'], deque())
+                queue.append(entry)
+
+                # otherwise the worker running this key picks it up
+                if len(queue) == 1:
+                    self._pool.submit(self._RunKey, entry['key'])
+
+### --------------------------------------------------------------------------------------------------
+
+    def _RunKey(self, key):
+        ''' Runs all due callbacks of key in order
+        '''
+
+        while True:
+
+            with self._lock:
+                queue = self._keyQueues[key]
+                entry = queue[0]
+
+            if not entry['cancelled']:
+
+                late = monotonic() - entry['due']
+
+                try:
+                    entry['func']()
+                    error = False
+                except Exception:
+                    error = True
+                    coreUtils.SafeLogger('error', 'Callback for %s failed:\n%s' % (key, traceback.format_exc()), self._caller)
+
+                with self._lock:
+                    metrics = self._GetMetrics(key)
+
+                    metrics['numCalls']  += 1
+                    metrics['numErrors'] += error
+                    metrics['lateMax']    = max(metrics['lateMax'], late)
+                    metrics['lateness'].append(late)
+
+            with self._lock:
+                queue.popleft()
+
+                if not queue:
+                    del self._keyQueues[key]
+                    return
+
+### --------------------------------------------------------------------------------------------------
+
+    def _GetMetrics(self, key):
+        ''' NOTE: call with lock held
+        '''
+
+        if key not in self._metrics:
+            self._metrics[key] = {
+                    'numCalls'    : 0,
+                    'numCancelled': 0,
+                    'numErrors'   : 0,
+                    'lateMax'     : 0.,
+                    'lateness'    : deque(maxlen=self.__maxSamples__)
+                }
+
+        return self._metrics[key]
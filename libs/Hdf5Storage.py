@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:12:40 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import numpy as np
+
+
+
+def _ImportH5py():
+    ''' h5py is only needed for the hdf5 storage backend and takes a while to load,
+        so it is imported when the first storage is created
+    '''
+    try:
+        import h5py
+    except ImportError:
+        raise Exception('h5py is required for the hdf5 storage backend!')
+
+    return h5py
+
+
+
+class Hdf5Storage:
+    ''' Streaming storage in a single HDF5 file.
+        Data is appended chunk by chunk to resizable datasets with the layout
+        demod_N/ePair_K/{x,y,r,t}, so memory stays flat and the file grows
+        for the whole session. Frequency and tRef are stored as attributes
+        of the demodulator groups.
+        Appended values are collected per dataset and written once a full
+        HDF5 chunk is available, or on Flush and Close.
+    '''
+
+    # number of samples per HDF5 chunk
+    __chunkSize__ = 8192
+
+    def __init__(self, fName, compression=None, chunkSize=None):
+
+        self._h5py        = _ImportH5py()
+
+        self._fName       = fName
+        self._compression = compression
+        self._chunkSize   = chunkSize if chunkSize else self.__chunkSize__
+
+        self._file        = None
+        self._datasets    = {}       # (demod, ePair, key) -> dataset, avoids look ups for every chunk
+        self._buffers     = {}       # (demod, ePair, key) -> [list of arrays, number of samples]
+        self._attrs       = set()    # (demod, key) of attributes already written
+
+### --------------------------------------------------------------------------------------------------
+
+    def Open(self):
+
+        if not self._file:
+            # append to existing file, e.g. when recording was paused
+            # values are collected before writing anyway, HDF5's chunk cache would keep
+            # a second copy of every partially filled chunk, for hundreds of datasets
+            self._file     = self._h5py.File(self._fName, 'a', rdcc_nbytes=0)
+            self._datasets = {}
+            self._attrs    = set()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self):
+
+        if self._file:
+            self._WriteBuffers()
+            self._file.close()
+
+            self._file     = None
+            self._datasets = {}
+
+### --------------------------------------------------------------------------------------------------
+
+    def Flush(self):
+
+        if self._file:
+            self._WriteBuffers()
+            self._file.flush()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Append(self, chunk, attrs=None):
+        ''' Append new data to the file.
+            chunk: dictionary with (demod, ePair, key) as key and the values to append
+            attrs: dictionary with demod as key and a dictionary of attributes,
+                   attributes are only written once
+        '''
+
+        self.Open()
+
+        if attrs:
+            for demod, demodAttrs in attrs.items():
+                for key, val in demodAttrs.items():
+                    if (demod, key) not in self._attrs and val != -1:
+                        group = self._file.require_group(demod)
+
+                        if key not in group.attrs:
+                            group.attrs[key] = val
+
+                        self._attrs.add( (demod, key) )
+
+        # resizing and writing a dataset is expensive compared to the few samples
+        # of a single chunk, so collect them till a full HDF5 chunk is available
+        for dsKey, values in chunk.items():
+
+            if dsKey not in self._buffers:
+                self._buffers[dsKey] = [[], 0]
+
+            buffer = self._buffers[dsKey]
+
+            buffer[0].append(values)
+            buffer[1] += len(values)
+
+            if buffer[1] >= self._chunkSize:
+                self._WriteBuffer(dsKey)
+
+### --------------------------------------------------------------------------------------------------
+
+    def _WriteBuffer(self, dsKey):
+        ''' Write the collected values of a dataset with a single resize.
+        '''
+
+        arrays, numSamples = self._buffers.pop(dsKey)
+
+        if not numSamples:
+            return
+
+        values = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+        if dsKey not in self._datasets:
+            self._datasets[dsKey] = self._GetDataset(*dsKey, dtype=values.dtype)
+
+        ds = self._datasets[dsKey]
+
+        n = ds.shape[0]
+        ds.resize( (n + numSamples,) )
+        ds[n:] = values
+
+### --------------------------------------------------------------------------------------------------
+
+    def _WriteBuffers(self):
+
+        for dsKey in list(self._buffers.keys()):
+            self._WriteBuffer(dsKey)
+
+### --------------------------------------------------------------------------------------------------
+
+    def _GetDataset(self, demod, ePair, key, dtype):
+
+        group = self._file.require_group('%s/%s' % (demod, ePair))
+
+        if key in group:
+            return group[key]
+
+        return group.create_dataset(key, shape=(0,), maxshape=(None,), dtype=dtype,
+                                    chunks=(self._chunkSize,), compression=self._compression)
+
+### --------------------------------------------------------------------------------------------------
+
+    def GetFileName(self):
+        return self._fName
@@ -6,21 +6,16 @@ Created on Tue May  9 17:23:26 2017
 """
 
 
-__simulationMode__ = False
-
-
 import threading
-try:
-    import zhinst.utils
-except ImportError:
-    __simulationMode__ = True
-
-
-from scipy import io
+import importlib.util
+import concurrent.futures as futures
+import numpy as np
 
 from time import sleep, time, perf_counter
 
-import matplotlib.pyplot as plt
+# zhinst takes long to load, it is imported when a device gets detected, see _ImportZhinst
+# use simulation mode if it is not installed
+__simulationMode__ = importlib.util.find_spec('zhinst') is None
 
 # in case this guy is used somewhere else
 # we need different loading of modules
@@ -34,19 +29,58 @@ try:
 except ImportError:
     from DataProcessor import DataProcessor
 
+try:
+    from libs.RawCapture import RawCapture, ReadRawCapture
+except ImportError:
+    from RawCapture import RawCapture, ReadRawCapture
+
+try:
+    from libs.Hf2Simulator import Hf2Simulator
+except ImportError:
+    from Hf2Simulator import Hf2Simulator
+
 try:
     from libs import coreUtilities as coreUtils
 except ImportError:
     import coreUtilities as coreUtils
 
+
+### -------------------------------------------------------------------------------------------------------------------------------
+
+def _ImportZhinst():
+    ''' Returns zhinst.utils, imported on first call
+    '''
+    import zhinst.utils
+    
+    return zhinst.utils
+    
+    
+    
+def _DisconnectApiSession(daq):
+    ''' Disconnect an API session created by zhinst.utils.create_api_session
+    '''
+    
+    try:
+        daq.disconnect()
+    except Exception:
+        pass
+    
+    
     
 class Hf2Core(CoreDevice, DataProcessor):
     
     __deviceId__         = ['dev10', 'dev275']
     __deviceApiLevel__   = 1
+    
+    # max time in seconds to wait for the API sessions of all devices
+    __detectTimeout__    = 10
         
     __recordingDevices__ = '/demods/*/sample'   # device ID is added later...
     
+    # 'process' splits the data into electrode pairs while recording
+    # 'raw' only copies the polled data into memory-mapped files, see RawCapture
+    __captureModes__     = ['process', 'raw']
+    
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def __init__(self, **flags):
@@ -67,19 +101,34 @@ class Hf2Core(CoreDevice, DataProcessor):
         
         self._recordString = 'Stopped.'
         
+        # check for valid capture mode
+        self._captureMode = flags.get('captureMode', 'process')
+        if self._captureMode not in self.__captureModes__:
+            raise Exception('Unsupported capture mode: %s' % self._captureMode)
+        
+        # raw capture is created for every new stream
+        self._rawCapture        = None
+        self._rawSegmentSamples = flags.get( 'rawSegmentSamples', None )
+        self._rawMaxSegments    = flags.get( 'rawMaxSegments'   , 0    )
+        
         # flags if somethign during recording went wrong
         self._recordFlags = {
                     'dataloss'        : False,
                     'invalidtimestamp': False
                 }
         
+        # polled instead of the device as long as none was found, see Hf2Simulator
+        # 'simulator': flags for the simulator, e.g. sample rate, number of demodulators, schedule
+        self._simulator = None
+        
         flags['detectFunc'] = self.DetectDeviceAndSetupPort
         
         CoreDevice.__init__(self, **flags)
         
         # in case no device was found use simulation mode
-        if not self.comPortStatus and __simulationMode__:
+        if not self.comPortStatus and flags.get('simulate', __simulationMode__):
             self.deviceName = 'Simulator'
+            self._simulator = Hf2Simulator( **flags.get('simulator', {}) )
             self.logger.warning('Simulation mode enabled!')
             
         flags['matlabKey'] = self.deviceName
@@ -99,32 +148,102 @@ class Hf2Core(CoreDevice, DataProcessor):
     
 ### -------------------------------------------------------------------------------------------------------------------------------
         
-    def DetectDeviceAndSetupPort(self):
+    def DetectDeviceAndSetupPort(self, comPorts=None, **flags):
+        ''' Tries the devices of __deviceId__ in this order, the first one which was found is used.
+            detectTimeout: max time in seconds to wait for an API session
+            comPorts is not used, the HF2 is connected through its data server
+        '''
         
         # reset com port variables
         self.ResetComPort()
         
+        if __simulationMode__:
+            self.logger.info('zhinst is not available, no device can be detected.')
+            return self.comPortStatus
+        
+        try:
+            zhinstUtils = _ImportZhinst()
+        except ImportError as e:
+            self.logger.error('Could not import zhinst: %s' % e)
+            return self.comPortStatus
+        
+        timeout = flags.get('detectTimeout', self.__detectTimeout__)
+        
+        self.logger.info('Try to detect %s...' % ', '.join(self.__deviceId__))
+        
+        # creating an API session blocks till the data server answers, so it is done in the background
+        # if we stop waiting, a session which is created afterwards is disconnected again and never used
+        abandoned = threading.Event()
+        session   = coreUtils.RunInThread(self._CreateApiSession, zhinstUtils, abandoned, name='Detect_%s' % self.__class__.__name__)
+        
+        try:
+            result = session.result(timeout)
+        except futures.TimeoutError:
+            abandoned.set()
+            session.add_done_callback(self._DisconnectLateSession)
+            self.logger.warning('Timeout while waiting for %s' % ', '.join(self.__deviceId__))
+            return self.comPortStatus
+        except Exception as e:
+            self.logger.error('Could not create API session: %s' % e)
+            return self.comPortStatus
+        
+        if result:
+            (daq, device, props) = result
+            
+            self.logger.info('Created API session for \'%s\' on \'%s:%s\' with api level \'%s\'' % (device, props['serveraddress'], props['serverport'], props['apilevel']))
+            
+            self.deviceName        = device
+            self.comPort           = daq
+            self.comPortStatus     = props['available']
+            self.comPortInfo       = ['', '%s on %s:%s' % (device.upper(), props['serveraddress'], props['serverport'])]
+            self._recordingDevices = '/' + device + self.__recordingDevices__
+            
+            # might be detected after DataProcessor was initialized
+            self._matlabKey        = device
+                
+        return self.comPortStatus
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _CreateApiSession(self, zhinstUtils, abandoned):
+        ''' Returns (daq, device, props) of the first device of __deviceId__ which was found, None otherwise
+            Sessions are created one after the other, zhinst does not state that creating them is thread safe.
+            abandoned: set if nobody waits for the result any more, no further device is tried then
+        '''
+        
         for device in self.__deviceId__:
             
-            self.logger.info('Try to detect %s...' % device)
+            if abandoned.is_set():
+                break
             
             try:
-                (daq, device, props) = zhinst.utils.create_api_session( device, self.__deviceApiLevel__ )
+                return zhinstUtils.create_api_session(device, self.__deviceApiLevel__)
             except RuntimeError:
-                self.logger.info('Could not be found')
-            else:
-                self.logger.info('Created API session for \'%s\' on \'%s:%s\' with api level \'%s\'' % (device, props['serveraddress'], props['serverport'], props['apilevel']))
-                
-                self.deviceName        = device
-                self.comPort           = daq
-                self.comPortStatus     = props['available']
-                self.comPortInfo       = ['', '%s on %s:%s' % (device.upper(), props['serveraddress'], props['serverport'])]
-                self._recordingDevices = '/' + device + self.__recordingDevices__
-                
-                # no need to search further
-                break
-                
-        return self.comPortStatus
+                self.logger.info('%s could not be found' % device)
+        
+        return None
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _DisconnectLateSession(self, session):
+        ''' Done callback of an API session which was created after the detection timed out
+        '''
+        
+        if not session.cancelled() and not session.exception() and session.result():
+            (daq, device, props) = session.result()
+            self.logger.info('Disconnecting API session for \'%s\', it was created after the detection timed out.' % device)
+            _DisconnectApiSession(daq)
+    
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def DiscardDetection(self):
+        ''' Disconnect the API session of the detected device and reset the port status
+        '''
+        
+        if self.comPort is not None:
+            _DisconnectApiSession(self.comPort)
+        
+        CoreDevice.DiscardDetection(self)
     
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -132,8 +251,13 @@ class Hf2Core(CoreDevice, DataProcessor):
         
         if self.CreateNewStreamFolder():
             
+            # just copy the data, it can be processed later with ProcessRawCapture
+            if self._captureMode == 'raw':
+                self._rawCapture = RawCapture(self._streamFolder + 'raw/', self._rawSegmentSamples, self._rawMaxSegments, self)
+                
             # start processor loop
-            self.Start()
+            else:
+                self.Start()
             
             # initialize new thread
             self._pollThread = threading.Thread(target=self._PollData)
@@ -159,7 +283,11 @@ class Hf2Core(CoreDevice, DataProcessor):
             self._pollThread.join()
 #            self._debugThread.join()
 
-            self.Stop()
+            if self._rawCapture:
+                self._rawCapture.Close()
+                self._rawCapture = None
+            else:
+                self.Stop()
             
             # reset file counter for next run
             self._strmFlCnt = 0
@@ -198,15 +326,21 @@ class Hf2Core(CoreDevice, DataProcessor):
                     }
         
         # check status of device... start if OK
+        # otherwise poll the simulator, if there is one
         if self.comPortStatus:
+            daq              = self.comPort
+            recordingDevices = self._recordingDevices
+        else:
+            daq              = self._simulator
+            recordingDevices = '/' + self._simulator.deviceName + self.__recordingDevices__ if daq else ''
+            
+        if daq:
             
             # subscribe to all demodulators that have been enabled by LabOne interface
-            self.comPort.subscribe(self._recordingDevices)
+            daq.subscribe(recordingDevices)
             
             # clear old data from polling buffer
-            self.comPort.sync()
-            
-        if self.comPortStatus or __simulationMode__:
+            daq.sync()
             
             while self._poll:
                 
@@ -222,22 +356,58 @@ class Hf2Core(CoreDevice, DataProcessor):
                 start = perf_counter()
     
                 # fetch data
-                # block for 1 ms, timeout 10 ms, throw error if data is lost and return flat dictionary
+                # block for 10 ms, timeout 10 ms, throw error if data is lost and return flat dictionary
                 # NOTE: poll downloads all data since last poll, sync or subscription
-                if __simulationMode__:
-                    newData = coreUtils.DataGen(6, 10000, 30)
+                try:
+                    newData = daq.poll(10e-3, 10, 0x04, True)
+                except RuntimeError as e:
+                    self._recordFlags['dataloss'] = True
+                    self.logger.warning('Poll failed: %s' % e)
+                    newData = {}
                 else:
-                    newData = self.comPort.poll(10e-3, 10, 0x04, True)
+                    self._UpdateRecordFlags(newData)
                     
-                self.UpdateData(newData)
+                if not newData:
+                    None
+                elif self._rawCapture:
+                    self._rawCapture.Write(newData)
+                else:
+                    self.UpdateData(newData)
                 
                 # critical stuff is done, release lock
                 self._pollLocker.release()
             
             
             # unsubscribe after finished record event
-            if self.comPortStatus:
-                self.comPort.unsubscribe('*')
+            daq.unsubscribe('*')
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _UpdateRecordFlags(self, newData):
+        ''' Flags stay set till the next recording is started
+        '''
+        
+        for data in newData.values():
+            for key in self._recordFlags:
+                if np.any( data.get('time', {}).get(key, False) ):
+                    self._recordFlags[key] = True
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def ProcessRawCapture(self, folder=None):
+        ''' Split a raw capture into electrode pairs and store it like a regular recording.
+            Uses the raw capture of the current stream folder if no folder is given.
+        '''
+        
+        if not folder:
+            folder = self._streamFolder + 'raw/'
+            
+        self.Start()
+        
+        for newData in ReadRawCapture(folder):
+            self.UpdateData(newData)
+            
+        self.Stop()
         
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:20:44 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import re
+import numpy as np
+
+from time import sleep, monotonic
+
+try:
+    from libs.DataProcessor import ePairLut
+except ImportError:
+    from DataProcessor import ePairLut
+
+
+
+class Hf2Simulator:
+    ''' Stand-in for the data server connection of the HF2 (zhinst ziDAQServer), used in simulation mode.
+        Implements subscribe, sync, poll and unsubscribe like Hf2Core uses them. Samples are
+        generated at the given rate, so a poll returns everything sampled since the last one,
+        with timestamps of the 210 MHz clock and the DIO lines set by the Arduino, which cycles
+        through the electrode pairs of the schedule.
+        realTime=False: every poll advances the simulated time by its duration without waiting,
+                        e.g. to find out how fast the pipeline can process the data
+    '''
+
+    # clock of the lock-in amplifier, timestamps are given in ticks
+    __clock__ = 210e6
+
+    # poll flag to raise an exception in case of data loss
+    __throwOnDataloss__ = 0x04
+
+    __demodPattern__ = re.compile(r'^/(\w+)/demods/(\*|\d+)/sample$')
+
+    def __init__(self, deviceName='dev10', numDemods=6, sampleRate=1800., schedule=None, **flags):
+        ''' schedule:  list of (ePair, residence time in us) the Arduino cycles through,
+                       like the switching schemes, by default ePair 0 is selected all the time
+            frequency: excitation frequency in Hz of each demodulator, see DataProcessor
+            jitter:    standard deviation of the sample interval in seconds, timestamps stay monotonic
+            dataloss:  probability that samples get lost within a poll
+            seed:      for reproducible data
+        '''
+
+        self.deviceName  = deviceName.lower()
+        self._numDemods  = numDemods
+        self._sampleRate = float(sampleRate)
+        self._jitter     = flags.get( 'jitter'  , 0.    )
+        self._dataloss   = flags.get( 'dataloss', 0.    )
+        self._realTime   = flags.get( 'realTime', True  )
+        self._rng        = np.random.RandomState( flags.get('seed') )
+
+        frequency        = flags.get( 'frequency', [10e3 * 10**(i/2) for i in range(numDemods)] )
+        self._frequency  = np.broadcast_to( np.asarray(frequency, dtype=np.float64), (numDemods,) )
+
+        # ticks between two samples
+        self._period     = self.__clock__ / self._sampleRate
+
+        self.SetSchedule(schedule if schedule else [(0, 1e6)])
+
+        self._subscribed = set()
+
+        # simulated time in seconds since the first subscription, see _Now
+        self._startTime  = None
+        self._simTime    = 0.
+
+        # index of the next sample, the same for all demodulators
+        self._nextSample = 0
+
+        # counter of the timestamps, HF2 does not start from zero
+        self._tickOffset = int( self._rng.randint(0, 2**31) )
+
+        # statistics
+        self.numPolls    = 0
+        self.numSamples  = 0
+        self.numDataloss = 0
+        self.lostSamples = 0
+
+### --------------------------------------------------------------------------------------------------
+
+    def SetSchedule(self, schedule):
+        ''' Electrode pairs and their residence times in us, see Arduino firmware.
+            Samples of an electrode pair carry its DIO coding (ePairId & 0x1F).
+        '''
+
+        if not schedule:
+            raise Exception('Schedule needs at least one electrode pair!')
+
+        ePairs, intervals = zip(*schedule)
+
+        intervals = np.asarray(intervals, dtype=np.float64) * 1e-6
+
+        if np.any(intervals <= 0):
+            raise Exception('Residence times have to be positive!')
+
+        self._schedule     = [ (int(e), float(i)) for e, i in schedule ]
+
+        # HF2 reads the DIO lines in reversed order, see DioToElectrodePairs
+        self._scheduleDio  = ePairLut[ np.asarray(ePairs, dtype=np.int64) & 0x1F ].astype(np.uint32) << 20
+        self._scheduleEnds = np.cumsum(intervals)
+
+### --------------------------------------------------------------------------------------------------
+
+    def GetSchedule(self):
+        ''' Returns list of (ePair, residence time in us)
+        '''
+        return list(self._schedule)
+
+### --------------------------------------------------------------------------------------------------
+    #######################################################################
+    ###                      --- zhinst API ---                         ###
+    #######################################################################
+### --------------------------------------------------------------------------------------------------
+
+    def subscribe(self, path):
+
+        for demod in self._ParsePath(path):
+            self._subscribed.add(demod)
+
+        # sampling starts with the first subscription
+        if self._startTime is None:
+            self._startTime = monotonic()
+
+### --------------------------------------------------------------------------------------------------
+
+    def unsubscribe(self, path):
+
+        if path == '*':
+            self._subscribed.clear()
+        else:
+            self._subscribed.difference_update( self._ParsePath(path) )
+
+### --------------------------------------------------------------------------------------------------
+
+    def sync(self):
+        ''' Drops all samples which were not polled yet
+        '''
+
+        if self._startTime is not None:
+            self._nextSample = self._SampleIndex( self._Now() )
+
+### --------------------------------------------------------------------------------------------------
+
+    def poll(self, duration, timeout=0, flags=0, flat=False):
+        ''' Returns a flat dictionary of all samples since the last poll, sync or subscription
+            path -> {'timestamp', 'x', 'y', 'frequency', 'phase', 'dio', 'trigger', 'auxin0', 'auxin1', 'time'}
+            Demodulators without samples are not part of the dictionary.
+        '''
+
+        if self._realTime:
+            sleep(duration)
+        else:
+            self._simTime += duration
+
+        self.numPolls += 1
+
+        if not self._subscribed:
+            return {}
+
+        start = self._nextSample
+        stop  = self._SampleIndex( self._Now() )
+
+        self._nextSample = stop
+
+        dataloss = stop > start and self._rng.random_sample() < self._dataloss
+
+        # first part of the block never reaches the host
+        # when throwing, the rest of the block is gone as well
+        if dataloss:
+            lost = self._rng.randint(1, stop - start + 1)
+
+            if flags & self.__throwOnDataloss__:
+                lost = stop - start
+
+            start += lost
+
+            self.numDataloss += 1
+            self.lostSamples += lost * len(self._subscribed)
+
+            if flags & self.__throwOnDataloss__:
+                raise RuntimeError('Data loss detected.')
+
+        if stop <= start:
+            return {}
+
+        idx       = np.arange(start, stop, dtype=np.int64)
+        timestamp = self._Timestamps(idx)
+        dio       = self._Dio(idx)
+
+        data = {}
+
+        for demod in sorted(self._subscribed):
+            data['/%s/demods/%d/sample' % (self.deviceName, demod)] = self._Samples(demod, timestamp, dio, dataloss)
+
+        self.numSamples += len(idx) * len(self._subscribed)
+
+        return data
+
+### --------------------------------------------------------------------------------------------------
+    #######################################################################
+    ###                      --- GENERATION ---                         ###
+    #######################################################################
+### --------------------------------------------------------------------------------------------------
+
+    def _ParsePath(self, path):
+
+        match = self.__demodPattern__.match(path.lower())
+
+        if not match or match.group(1) != self.deviceName:
+            raise RuntimeError('Path \'%s\' is not supported by the simulator!' % path)
+
+        if match.group(2) == '*':
+            return range(self._numDemods)
+
+        demod = int(match.group(2))
+
+        if demod >= self._numDemods:
+            raise RuntimeError('Demodulator %d does not exist!' % demod)
+
+        return [demod]
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Now(self):
+        ''' Seconds since sampling started
+        '''
+
+        if self._realTime:
+            return monotonic() - self._startTime
+
+        return self._simTime
+
+### --------------------------------------------------------------------------------------------------
+
+    def _SampleIndex(self, t):
+        return int( t * self._sampleRate )
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Timestamps(self, idx):
+
+        ticks = idx * self._period
+
+        # jitter is limited to less than half a period, so timestamps stay monotonic
+        if self._jitter:
+            limit  = 0.49 * self._period
+            ticks += np.clip( self._rng.normal(0., self._jitter * self.__clock__, len(idx)), -limit, limit )
+
+        return ( np.round(ticks).astype(np.uint64) + np.uint64(self._tickOffset) )
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Dio(self, idx):
+        ''' DIO word of every sample, the Arduino switches after every residence time
+        '''
+
+        cycle = self._scheduleEnds[-1]
+        t     = np.mod( idx / self._sampleRate, cycle )
+
+        pos   = np.searchsorted( self._scheduleEnds, t, side='right' )
+
+        return self._scheduleDio[ np.minimum(pos, len(self._scheduleEnds) - 1) ]
+
+### --------------------------------------------------------------------------------------------------
+
+    def _Samples(self, demod, timestamp, dio, dataloss):
+
+        numSamples = len(timestamp)
+
+        # amplitude depends on the electrode pair, like the impedance of the chambers does
+        amplitude  = 1e-3 * (1. + ((dio >> 20) & 0x1F) / 32.)
+        phase      = 0.2 * demod + 1e-2 * self._rng.standard_normal(numSamples)
+        noise      = 1e-5 * self._rng.standard_normal((2, numSamples))
+
+        x          = amplitude * np.cos(phase) + noise[0]
+        y          = amplitude * np.sin(phase) + noise[1]
+
+        return {
+                'timestamp': timestamp,
+                'x'        : x,
+                'y'        : y,
+                'frequency': np.full( numSamples, self._frequency[demod] ),
+                'phase'    : phase,
+                'dio'      : dio,
+                'trigger'  : np.zeros( numSamples, dtype=np.uint32 ),
+                'auxin0'   : np.zeros( numSamples ),
+                'auxin1'   : np.zeros( numSamples ),
+                'time'     : {'dataloss': dataloss, 'invalidtimestamp': False}
+            }
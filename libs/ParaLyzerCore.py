@@ -5,6 +5,14 @@ Created on Tue May  9 18:46:57 2017
 @author: Martin Leonhardt (martin.leonhardt87@gmail.com)
 """
 
+import asyncio
+import threading
+import concurrent.futures as futures
+import serial.tools.list_ports
+
+from functools import partial
+from time import perf_counter
+
 from libs import coreUtilities as coreUtils
 
 from libs.ArduinoCore import ArduinoCore
@@ -21,6 +29,9 @@ class ParaLyzerCore(Logger):
         
     __fileKeys__ = ['cfg', 'swc', 'chc', 'stf', 'log', 'lfl']
     __detKeys__  = ['hf2', 'ard', 'cam', 'til']
+    
+    # max time in seconds to wait for the detection of each device at startup
+    __startupTimeouts__ = {'ard': 10, 'hf2': 15, 'til': 10}
 
 ### -------------------------------------------------------------------------------------------------------------------------------
     
@@ -52,6 +63,12 @@ class ParaLyzerCore(Logger):
             
         self.isRunning = False
         
+        # optional event loop driving the devices, see StartEventLoop
+        self._loop           = None
+        self._loopThread     = None
+        self._transports     = {}
+        self._stoppedReaders = []     # threaded readers stopped for the transports, restarted with StopEventLoop
+        
             
         # create folders and config file, if necessary
         # otherwise read config and update stdConfig and cfgStatus
@@ -66,12 +83,37 @@ class ParaLyzerCore(Logger):
             files['switchConfigFile'] = self.stdConfig['swc']
         
         
-        # initialize devices
-        self.arduino = ArduinoCore   ( selectElectrodePairs=self.SelectElectrodePairs, **flags, **files )
-        self.hf2     = Hf2Core       ( baseStreamFolder=self.stdConfig['stf'],         **flags          )
-        self.tilter  = ChipTilterCore(                                                 **flags          )
+        # seconds spent for each step of the startup, see GetStartupReport
+        self._startupReport = {}
+        
+        # state of the parallel detection per device ('running', 'done' or 'abandoned') and its thread
+        self._detectLock  = threading.Lock()
+        self._detectState = {}
+        self._detections  = {}
+        
+        # enumerating the serial ports takes a while, do it once for all devices
+        start    = perf_counter()
+        comPorts = serial.tools.list_ports.comports()
+        
+        self._startupReport['ports'] = {'init': perf_counter() - start, 'detect': 0., 'status': '%d ports' % len(comPorts)}
+        
+        # initialize devices, detection is done afterwards
+        self.arduino = self._InitDevice( 'ard', ArduinoCore   , selectElectrodePairs=self.SelectElectrodePairs, **flags, **files )
+        self.hf2     = self._InitDevice( 'hf2', Hf2Core       , baseStreamFolder=self.stdConfig['stf'],         **flags          )
+        self.tilter  = self._InitDevice( 'til', ChipTilterCore,                                                 **flags          )
         self.camera  = None
         
+        devices = {'ard': self.arduino, 'hf2': self.hf2, 'til': self.tilter}
+        
+        # detection mostly waits for the devices to answer, so all of them are detected at the same time
+        if flags.get('parallelStartup', True):
+            self._DetectDevicesParallel(devices, comPorts, dict(self.__startupTimeouts__, **flags.get('startupTimeouts', {})))
+        else:
+            for key, device in devices.items():
+                self._DetectDevice(key, device, comPorts)
+        
+        self.logger.info( self.GetStartupReport(asString=True) )
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
         
     # def __del__(self):
@@ -94,6 +136,11 @@ class ParaLyzerCore(Logger):
         
         success = True
         
+        # an abandoned detection is still running and would reset the device when it finished
+        if key in self._detections and not self._detections[key].done():
+            self.logger.warning('Detection of \'%s\' from startup is still running!' % key)
+            return False
+        
         if key == 'ard':
             success = self.arduino.DetectDeviceAndSetupPort()
             
@@ -105,6 +152,119 @@ class ParaLyzerCore(Logger):
             
         return success
         
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetStartupReport(self, asString=False):
+        ''' Seconds needed for initializing ('init') and detecting ('detect') every device at startup,
+            together with the result of the detection ('status')
+            asString: formatted table, slowest device first
+        '''
+        
+        if not asString:
+            return { key: dict(entry) for key, entry in self._startupReport.items() }
+        
+        order = sorted( self._startupReport, key=lambda key: self._startupReport[key]['init'] + self._startupReport[key]['detect'], reverse=True )
+        
+        lines = ['Startup report:']
+        
+        for key in order:
+            entry = self._startupReport[key]
+            lines.append( '  %-5s init %6.3f s  detect %6.3f s  %s' % (key, entry['init'], entry['detect'], entry['status']) )
+        
+        return '\n'.join(lines)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _InitDevice(self, key, deviceClass, **flags):
+        
+        start  = perf_counter()
+        device = deviceClass( deferDetection=True, **flags )
+        
+        self._startupReport[key] = {'init': perf_counter() - start, 'detect': 0., 'status': 'not detected'}
+        
+        return device
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _DetectDevice(self, key, device, comPorts):
+        ''' Detect a single device and record its time in the startup report
+            If the detection was given up meanwhile, see _DetectDevicesParallel, its result is discarded.
+        '''
+        
+        start = perf_counter()
+        error = None
+        
+        try:
+            found  = device.DetectDeviceAndSetupPort(comPorts=comPorts)
+            status = 'found' if found else 'not found'
+        except Exception as e:
+            found  = False
+            error  = e
+            status = 'error: %s' % e
+        
+        with self._detectLock:
+            abandoned = self._detectState.get(key) == 'abandoned'
+            if not abandoned:
+                self._detectState[key] = 'done'
+                self._startupReport[key].update( detect=perf_counter() - start, status=status )
+        
+        if abandoned:
+            self.logger.info('Detection of \'%s\' finished after its timeout, the result is discarded.' % key)
+            device.DiscardDetection()
+            return False
+        
+        if error:
+            raise error
+        
+        return found
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _DetectDevicesParallel(self, devices, comPorts, timeouts):
+        ''' Every device is detected in its own thread.
+            If one does not finish within its timeout, startup goes on without it,
+            its detection is abandoned and the device is reset as soon as the thread finished.
+        '''
+        
+        start   = perf_counter()
+        results = {}
+        
+        for key, device in devices.items():
+            self._detectState[key] = 'running'
+            results[key]           = coreUtils.RunInThread(self._DetectDevice, key, device, comPorts, name='Detect_%s' % key)
+        
+        self._detections.update(results)
+        
+        for key, result in results.items():
+            
+            try:
+                result.result( max(0, timeouts[key] - (perf_counter() - start)) )
+            except futures.TimeoutError:
+                # the thread might have finished its detection right now
+                with self._detectLock:
+                    abandoned = self._detectState[key] == 'running'
+                    if abandoned:
+                        self._detectState[key] = 'abandoned'
+                        self._startupReport[key].update( detect=perf_counter() - start, status='timeout' )
+                
+                if abandoned:
+                    self.logger.warning('Detection of \'%s\' did not finish within %s s!' % (key, timeouts[key]))
+                else:
+                    self._LogDetectionError(key, result)
+            except Exception as e:
+                self.logger.error('Detection of \'%s\' failed: %s' % (key, e))
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _LogDetectionError(self, key, result):
+        ''' Wait for a detection which finished right at its timeout and log its error, if any
+        '''
+        
+        try:
+            result.result()
+        except Exception as e:
+            self.logger.error('Detection of \'%s\' failed: %s' % (key, e))
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def CreateDefaultStructure(self):
@@ -196,6 +356,10 @@ class ParaLyzerCore(Logger):
                 
                 if 'swt' in flags:
                     if flags['swt']:
+                        # store both setups now, so the events just activate them
+                        self.arduino.PrepareSetup(cnti=True , viai=False)
+                        self.arduino.PrepareSetup(cnti=False, viai=True )
+
                         self.tilter.SetTilterEvent( 'onPosUp'  , lambda : self.arduino.SetupArduino(cnti=True, viai=False) )
                         flags.update(cnti=False, viai=True)
                         self.tilter.SetTilterEvent( 'onNegWait', lambda : self.arduino.SetupArduino(cnti=False, viai=True), delay=flags['switchDelay'] )
@@ -250,6 +414,155 @@ class ParaLyzerCore(Logger):
     def IsRunning(self):
         return self.isRunning
         
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def StartEventLoop(self):
+        ''' Run a single asyncio event loop in a background thread.
+            Async transports for the serial devices are opened on first use, see GetTransport.
+            Blocking calls, e.g. HF2 polling, can be moved to the loop's executor with RunBlocking.
+        '''
+        
+        if self._loop:
+            return
+        
+        self._loop       = asyncio.new_event_loop()
+        self._loopThread = threading.Thread(target=self._RunEventLoop, daemon=True)
+        self._loopThread.start()
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def StopEventLoop(self):
+        
+        if not self._loop:
+            return
+        
+        self.RunCoroutine( self._CloseTransports() )
+        
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loopThread.join()
+        self._loop.close()
+        
+        self._loop       = None
+        self._loopThread = None
+        
+        # port belongs to the threaded readers again
+        for start in self._stoppedReaders:
+            start()
+            
+        self._stoppedReaders = []
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def RunCoroutine(self, coro, timeout=None):
+        ''' Execute coroutine in the event loop and wait for its result
+        '''
+        return self.ScheduleCoroutine(coro).result(timeout)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def ScheduleCoroutine(self, coro):
+        ''' Execute coroutine in the event loop, returns a concurrent.futures.Future
+        '''
+        
+        if not self._loop:
+            raise Exception('Event loop is not running, call StartEventLoop first!')
+            
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    async def RunBlocking(self, func, *args, **kwargs):
+        ''' Await a blocking function, which is executed in the default executor of the loop
+        '''
+        return await self._loop.run_in_executor( None, partial(func, *args, **kwargs) )
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def GetTransport(self, key):
+        ''' Return the async transport for 'ard' or 'til', it's opened on first use.
+            The threaded readers of the device are stopped before, since both would read from the same port.
+            Blocking writes and requests of the device, e.g. SetupArduino, go through the transport meanwhile,
+            call them from other threads or with RunBlocking, not in the event loop thread.
+            Returns None in case the device is not available or the transport could not be opened.
+        '''
+        
+        if key not in self._transports:
+            
+            # transports have to be opened in the event loop thread
+            if threading.current_thread() is self._loopThread:
+                self._OpenTransport(key)
+            else:
+                self.RunCoroutine( self._CallInLoop(self._OpenTransport, key) )
+                
+        return self._transports.get(key)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _RunEventLoop(self):
+        
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    async def _CallInLoop(self, func, *args):
+        return func(*args)
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _OpenTransport(self, key):
+        
+        # tilter frames its parameter messages with '#'
+        # with the binary protocol the Arduino cuts its replies by length, see ArduinoCore.OpenAsyncTransport
+        device, delimiter = {'ard': (self.arduino, '\n'), 'til': (self.tilter, '#')}[key]
+        
+        if not device.GetPortStatus():
+            return None
+        
+        # only one reader per port, otherwise incoming bytes are split between them
+        stopped = self._StopThreadedReaders(device)
+        
+        transport = device.OpenAsyncTransport(delimiter, self._loop)
+        
+        if transport:
+            self._transports[key] = transport
+            self._stoppedReaders += stopped
+        else:
+            self.logger.error('Could not open async transport for \'%s\'!' % key)
+            
+            for start in stopped:
+                start()
+            
+        return transport
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    def _StopThreadedReaders(self, device):
+        ''' Stop listener and tilter stream of the device,
+            returns the functions to start them again
+        '''
+        
+        stopped = []
+        
+        if device.IsListening():
+            device.StopListening()
+            stopped.append(device.StartListening)
+            
+        if device is self.tilter and device.IsReading():
+            device.StopInMessageThread()
+            stopped.append(device.StartInMessageThread)
+            
+        return stopped
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
+    async def _CloseTransports(self):
+        
+        for transport in self._transports.values():
+            transport.Close()
+            
+        self._transports = {}
+        
 ### -------------------------------------------------------------------------------------------------------------------------------
     
     def SelectElectrodePairs(self, definedElectrodePairs, **flags):
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:03:18 2026
+
+@author: Martin Leonhardt (martin.leonhardt87@gmail.com)
+"""
+
+import os
+import json
+import numpy as np
+
+from time import perf_counter
+
+try:
+    from libs import coreUtilities as coreUtils
+except ImportError:
+    import coreUtilities as coreUtils
+
+
+
+class RawCapture:
+    ''' Copy-only capture of raw HF2 poll data.
+        Every demodulator writes into preallocated memory-mapped segment files,
+        one block per field, so storing a poll is one copy per field.
+        Splitting into electrode pairs is done later, see ReadRawCapture.
+        The sample counts in the header are updated at least every
+        __flushInterval__ seconds, so a crash loses at most that much data.
+    '''
+
+    # fields stored for each demodulator and their data type
+    __fields__ = [
+            ('x'        , '<f8'),
+            ('y'        , '<f8'),
+            ('frequency', '<f8'),
+            ('timestamp', '<u8'),
+            ('dio'      , '<u4')
+        ]
+
+    # samples per demodulator and segment file, ~37 MB per file
+    __segmentSamples__ = 2**20
+
+    __headerFile__ = 'header.json'
+
+    # max seconds between two header updates while writing
+    __flushInterval__ = 1.
+
+    def __init__(self, folder, segmentSamples=None, maxSegments=0, caller=None):
+        ''' folder:         capture folder, created if necessary
+            segmentSamples: samples per demodulator and segment file
+            maxSegments:    reuse the oldest segment files when given (ring),
+                            0 keeps all segments
+        '''
+
+        self._folder         = folder
+        self._segmentSamples = segmentSamples if segmentSamples else self.__segmentSamples__
+        self._maxSegments    = maxSegments
+        self._caller         = caller
+
+        # byte offsets of the fields inside a segment file
+        self._offsets   = {}
+        self._fileSize  = 0
+        for field, dtype in self.__fields__:
+            self._offsets[field] = self._fileSize
+            self._fileSize      += self._segmentSamples * np.dtype(dtype).itemsize
+
+        # currently open segment for each demodulator
+        self._segments  = {}
+        self._lastFlush = perf_counter()
+
+        self._header = {
+                'fields'        : self.__fields__,
+                'segmentSamples': self._segmentSamples,
+                'maxSegments'   : self._maxSegments,
+                'demods'        : {}
+            }
+
+        coreUtils.SafeMakeDir(self._folder, self._caller)
+
+### --------------------------------------------------------------------------------------------------
+
+    def Write(self, newData):
+        ''' Store an HF2 poll dictionary.
+        '''
+
+        for demod, data in newData.items():
+
+            numSamples = len(data['timestamp'])
+            written    = 0
+
+            while written < numSamples:
+
+                segment = self._segments.get(demod)
+
+                if not segment or segment['count'] == self._segmentSamples:
+                    segment = self._OpenSegment(demod)
+
+                n     = min(numSamples - written, self._segmentSamples - segment['count'])
+                start = segment['count']
+
+                for field, _ in self.__fields__:
+                    segment['views'][field][start:start+n] = data[field][written:written+n]
+
+                segment['count'] += n
+                written          += n
+
+        if perf_counter() - self._lastFlush > self.__flushInterval__:
+            self.Flush()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Flush(self):
+        ''' Flush the open segments and store their current sample counts in the header.
+        '''
+
+        for demod, segment in self._segments.items():
+            segment['mmap'].flush()
+            self._UpdateCount(demod, segment)
+
+        self._WriteHeader()
+
+        self._lastFlush = perf_counter()
+
+### --------------------------------------------------------------------------------------------------
+
+    def Close(self):
+        ''' Flush all segments and write the header.
+        '''
+
+        for demod in list(self._segments.keys()):
+            self._CloseSegment(demod)
+
+        self._WriteHeader()
+
+### --------------------------------------------------------------------------------------------------
+
+    def _OpenSegment(self, demod):
+
+        if demod in self._segments:
+            self._CloseSegment(demod)
+
+        if demod not in self._header['demods']:
+            self._header['demods'][demod] = {'prefix': 'demod%02d' % len(self._header['demods']), 'segments': []}
+
+        demodHeader = self._header['demods'][demod]
+        seq         = len(demodHeader['segments'])
+
+        # ring mode, reuse the oldest file
+        slot = seq % self._maxSegments if self._maxSegments else seq
+
+        fName = '%s_seg%05d.bin' % (demodHeader['prefix'], slot)
+
+        mm = np.memmap(os.path.join(self._folder, fName), dtype=np.uint8, mode='w+', shape=(self._fileSize,))
+
+        views = {}
+        for field, dtype in self.__fields__:
+            itemSize     = np.dtype(dtype).itemsize
+            offset       = self._offsets[field]
+            views[field] = mm[offset:offset + self._segmentSamples*itemSize].view(dtype)
+
+        self._segments[demod] = {'seq': seq, 'file': fName, 'mmap': mm, 'views': views, 'count': 0}
+
+        demodHeader['segments'].append({'seq': seq, 'file': fName, 'count': 0})
+
+        # overwritten segments are not valid anymore
+        if self._maxSegments:
+            demodHeader['segments'] = [s for s in demodHeader['segments'] if s['seq'] > seq - self._maxSegments]
+
+        return self._segments[demod]
+
+### --------------------------------------------------------------------------------------------------
+
+    def _CloseSegment(self, demod):
+
+        segment = self._segments.pop(demod)
+
+        segment['mmap'].flush()
+
+        self._UpdateCount(demod, segment)
+
+        # header is updated whenever a segment is finished
+        self._WriteHeader()
+
+### --------------------------------------------------------------------------------------------------
+
+    def _UpdateCount(self, demod, segment):
+
+        for s in self._header['demods'][demod]['segments']:
+            if s['seq'] == segment['seq']:
+                s['count'] = segment['count']
+
+### --------------------------------------------------------------------------------------------------
+
+    def _WriteHeader(self):
+
+        fName = os.path.join(self._folder, self.__headerFile__)
+
+        # replace the header at once, so a crash while writing leaves the last one intact
+        coreUtils.DumpJsonFile(self._header, fName + '.tmp', self._caller)
+        os.replace(fName + '.tmp', fName)
+
+
+
+### --------------------------------------------------------------------------------------------------
+
+def ReadRawCapture(folder, maxSamples=None):
+    ''' Read back a capture written by RawCapture.
+        Yields HF2 like poll dictionaries with at most maxSamples samples
+        per demodulator, which can be passed to DataProcessor.UpdateData.
+    '''
+
+    header = coreUtils.LoadJsonFile(os.path.join(folder, RawCapture.__headerFile__))
+
+    if not header:
+        return
+
+    segmentSamples = header['segmentSamples']
+    maxSamples     = maxSamples if maxSamples else segmentSamples
+
+    for demod, demodHeader in header['demods'].items():
+        for i, segment in enumerate(demodHeader['segments']):
+
+            mm = np.memmap(os.path.join(folder, segment['file']), dtype=np.uint8, mode='r')
+
+            views  = {}
+            offset = 0
+            for field, dtype in header['fields']:
+                itemSize     = np.dtype(dtype).itemsize
+                views[field] = mm[offset:offset + segmentSamples*itemSize].view(dtype)
+                offset      += segmentSamples*itemSize
+
+            count = segment['count']
+
+            # last segment might still have been open, e.g. after a crash,
+            # files are created with zeros, so written samples have a timestamp
+            if i == len(demodHeader['segments']) - 1:
+                written = np.flatnonzero(views['timestamp'][count:])
+                if len(written):
+                    count += int(written[-1]) + 1
+
+            for start in range(0, count, maxSamples):
+                stop = min(start + maxSamples, count)
+                yield {demod: {field: np.array(view[start:stop]) for field, view in views.items()}}
+
+            del mm
@@ -7,8 +7,16 @@ Created on Tue May  9 17:23:26 2017
 
 __all__ = [
     'ArduinoCore',
+    'ArduinoProtocol',
+    'ArduinoSimulator',
+    'AsyncTransport',
     'ComDevice',
     'CoreDevice',
+    'DemodWorkerPool',
+    'EventScheduler',
+    'Hdf5Storage',
+    'Hf2Simulator',
+    'RawCapture',
     'coreUtilities',
     'inSpheroChipTilter',
     'Logger',
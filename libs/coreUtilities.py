@@ -12,11 +12,13 @@ from collections import deque
 
 import os
 import logging as log
-import scipy as sp
+import numpy as np
 import binascii
 import textwrap
 import json
+import threading
 from datetime import datetime
+from concurrent.futures import Future
 
 #_logger = log.getLogger('coreUtilities')
 
@@ -212,6 +214,28 @@ def SafeLogger(level, msg, caller=None):
 
 ### -------------------------------------------------------------------------------------------------------------------------------
     
+def RunInThread(func, *args, name=None, **kwargs):
+    ''' Run func in a daemon thread and return a concurrent.futures.Future of its result.
+        Unlike an executor, a call that hangs does not block the interpreter from exiting.
+    '''
+    
+    future = Future()
+    
+    def Run():
+        if future.set_running_or_notify_cancel():
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+    
+    threading.Thread(target=Run, name=name, daemon=True).start()
+    
+    return future
+        
+### -------------------------------------------------------------------------------------------------------------------------------
+    
 def GetTextFromByteStream(bStream, group=2):
     if isinstance(bStream, str):
         return textwrap.wrap(binascii.b2a_hex(bStream.encode('latin-1')).decode('latin-1'), group)
@@ -220,7 +244,12 @@ def GetTextFromByteStream(bStream, group=2):
         
 ### -------------------------------------------------------------------------------------------------------------------------------
 
+# DIO word of every electrode pair, bits are reversed and shifted to DIO20...DIO24, see DataProcessor.DioToElectrodePairs
+_dioLut = np.array([int(format(i, '05b')[::-1], 2) << 20 for i in range(32)], dtype=np.uint32)
+
 def DataGen(maxDemod=None, arraySize=None, maxElectrodePair=None):
+    ''' Random poll dictionary, see Hf2Simulator for data with timestamps and a sample rate
+    '''
     
     if maxDemod == None:
         maxDemod = 6
@@ -232,17 +261,17 @@ def DataGen(maxDemod=None, arraySize=None, maxElectrodePair=None):
     data = {}
     
     # 1-6 demodulators
-    for demod in range(sp.random.randint(1,maxDemod+1)):
+    for demod in range(np.random.randint(1,maxDemod+1)):
         
         key = '/dev10/demods/%s/sample' % demod
         
         data[key] = {}
         
-        data[key]['x']         = sp.random.random (             arraySize )
-        data[key]['y']         = sp.random.random (             arraySize )
-        data[key]['frequency'] = sp.random.randint( 100, 50e6 , arraySize )
-        data[key]['timestamp'] = sp.random.randint( 0  , 2**31, arraySize )
-        data[key]['dio']       = sp.array([int("{0:032b}".format(int("{0:05b}".format(i)[::-1], 2)<<20), 2) for i in sp.random.randint( 0, maxElectrodePair, arraySize )])
+        data[key]['x']         = np.random.random (             arraySize )
+        data[key]['y']         = np.random.random (             arraySize )
+        data[key]['frequency'] = np.random.randint( 100, 50e6 , arraySize )
+        data[key]['timestamp'] = np.random.randint( 0  , 2**31, arraySize )
+        data[key]['dio']       = _dioLut[ np.random.randint( 0, maxElectrodePair, arraySize ) ]
         
     return data
 